@@ -0,0 +1,172 @@
+"""
+Emergency triage latency under overload, with and without admission control
+
+Starts the service with uvicorn, measures how many /api/diagnose/batch
+requests per second it sustains, then floods it with batch requests at
+multiples of that rate (open loop, Poisson arrivals) while sending
+emergency messages to /api/diagnose at a steady rate. Each load level
+runs against a fresh server, once with ADMISSION_CONTROL off and once on.
+Reported: the batch rate actually offered, emergency p50/p99, and how
+many batch requests completed or were shed with 429/503. The client runs
+on the same machine; with few cores it competes with the server for CPU
+and cannot offer the full multiple, as the offered column shows.
+
+Usage: python benchmarks/bench_admission.py [--factors 0.5,1,2,5] [--seconds 10] [--batch-items 100]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+from benchmarks.bench_llm_providers import free_port, percentile
+
+MESSAGES = [
+    "I have had a headache since morning and feel tired",
+    "Fever and cough for three days, mild sore throat",
+    "Stomach ache after meals and some nausea",
+    "Dry cough at night, no fever",
+]
+EMERGENCY = "sudden crushing chest pain spreading to my left arm"
+JSON = {"content-type": "application/json"}
+
+
+def start_server(port: int, admission: bool) -> subprocess.Popen:
+    env = {**os.environ, "ADMISSION_CONTROL": "true" if admission else "false"}
+    for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY"):
+        env.pop(key, None)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning", "--backlog", "4096"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit("Service did not start")
+
+
+def batch_body(items: int) -> bytes:
+    # Encoded up front, so the client spends as little CPU per request as it can
+    messages = [{"message": f"{random.choice(MESSAGES)} (case {random.random():.6f})"} for _ in range(items)]
+    return json.dumps({"items": messages}).encode()
+
+
+async def capacity(port: int, items: int, seconds: float) -> float:
+    """Batch requests/sec at a small fixed concurrency"""
+    done = 0
+    deadline = time.perf_counter() + seconds
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+        async def worker():
+            nonlocal done
+            while time.perf_counter() < deadline:
+                (await client.post("/api/diagnose/batch", content=batch_body(items), headers=JSON)).raise_for_status()
+                done += 1
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(4)])
+        return done / (time.perf_counter() - start)
+
+
+async def overload(port: int, rate: float, items: int, seconds: float, emergency_rate: float) -> dict:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    outcomes = {"ok": 0, "429": 0, "503": 0, "other": 0}
+    emergency = []
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as flood, \
+            httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as probes:
+        async def send_batch(body):
+            try:
+                status = (await flood.post("/api/diagnose/batch", content=body, headers=JSON)).status_code
+            except httpx.HTTPError:
+                status = 0
+            key = "ok" if status == 200 else str(status) if status in (429, 503) else "other"
+            outcomes[key] += 1
+
+        async def send_emergency():
+            start = time.perf_counter()
+            response = await probes.post("/api/diagnose", json={"message": EMERGENCY})
+            response.raise_for_status()
+            emergency.append((time.perf_counter() - start) * 1000)
+
+        async def arrivals(rate, make):
+            tasks = []
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                tasks.append(asyncio.create_task(make()))
+                await asyncio.sleep(random.expovariate(rate))
+            return tasks
+
+        bodies = [batch_body(items) for _ in range(64)]
+        flood_tasks, probe_tasks = await asyncio.gather(
+            arrivals(rate, lambda: send_batch(random.choice(bodies))),
+            arrivals(emergency_rate, send_emergency)
+        )
+        await asyncio.wait(probe_tasks, timeout=120)
+        await asyncio.wait(flood_tasks, timeout=5)
+        for task in flood_tasks + probe_tasks:
+            task.cancel()
+
+    return {
+        "emergency_p50": statistics.median(emergency) if emergency else float("nan"),
+        "emergency_p99": percentile(emergency, 99) if emergency else float("nan"),
+        "emergency_lost": len(probe_tasks) - len(emergency),
+        **outcomes,
+        "sent": len(flood_tasks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--factors", default="0.5,1,2,5", help="comma-separated multiples of measured capacity")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--batch-items", type=int, default=100)
+    parser.add_argument("--emergency-rate", type=float, default=10, help="emergency requests per second")
+    args = parser.parse_args()
+
+    random.seed(0)
+    port = free_port()
+    server = start_server(port, admission=False)
+    try:
+        rate = asyncio.run(capacity(port, args.batch_items, 5))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"capacity: {rate:.1f} batch req/s of {args.batch_items} items, {os.cpu_count()} cores")
+    print(
+        f"  {'load':>5}  {'offered':>9}  {'admission':>9}  {'emerg p50':>9}  {'emerg p99':>9}  "
+        f"{'batch ok':>8}  {'429':>5}  {'503':>5}  {'other':>5}"
+    )
+
+    for factor in (float(f) for f in args.factors.split(",")):
+        for admission in (False, True):
+            port = free_port()
+            server = start_server(port, admission)
+            try:
+                r = asyncio.run(overload(port, rate * factor, args.batch_items, args.seconds, args.emergency_rate))
+            finally:
+                server.terminate()
+                server.wait()
+            lost = f"  ({r['emergency_lost']} emergencies unanswered)" if r["emergency_lost"] else ""
+            print(
+                f"  {factor:>4}x  {r['sent'] / args.seconds:7.0f}/s  {'on' if admission else 'off':>9}  {r['emergency_p50']:7.0f}ms  "
+                f"{r['emergency_p99']:7.0f}ms  {r['ok']:>8}  {r['429']:>5}  {r['503']:>5}  {r['other']:>5}{lost}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Bulk ingestion throughput, reports/sec from 1 to N worker processes
+
+Builds a zip of synthetic lab reports (scanned JPEG pages and PDFs with a
+mix of text-layer and scanned pages) and ingests it with an increasing
+number of workers, each into a fresh output directory. Speedup and
+efficiency (speedup per added worker) are relative to the first run.
+Requires poppler and tesseract; without them every report fails fast and
+only the pipeline overhead is measured.
+
+Usage: python benchmarks/bench_bulk_ingest.py [--reports 200] [--workers 1,2,4,8] [--pdf-ratio 0.5]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pdf_pages import build_pdf, page_lines, scanned_jpeg
+from services.bulk_ingest import ingest
+
+
+def build_archive(path: str, reports: int, pdf_ratio: float):
+    """Write reports one at a time, so the archive never sits in memory"""
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for index in range(reports):
+            if int((index + 1) * pdf_ratio) > int(index * pdf_ratio):
+                archive.writestr(f"reports/{index:06d}.pdf", build_pdf(1 + index % 4, 0.5))
+            else:
+                archive.writestr(f"reports/{index:06d}.jpg", scanned_jpeg(page_lines(0, 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reports", type=int, default=200)
+    parser.add_argument("--workers", help="comma-separated worker counts (default: powers of two up to all cores)")
+    parser.add_argument("--pdf-ratio", type=float, default=0.5)
+    parser.add_argument("--shard-size", type=int, default=100)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    if args.workers:
+        counts = [int(count) for count in args.workers.split(",")]
+    else:
+        counts = sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = os.path.join(tmp, "reports.zip")
+        build_archive(archive, args.reports, args.pdf_ratio)
+        print(f"{args.reports} reports, {os.path.getsize(archive) / 1e6:.1f} MB archive, {cores} cores")
+        print(f"  {'workers':>7}  {'reports/s':>9}  {'speedup':>7}  {'efficiency':>10}  {'values':>7}  failed")
+
+        base = None
+        for workers in counts:
+            stats = ingest(archive, os.path.join(tmp, f"out-{workers}"), workers, args.shard_size)
+            rate = stats["reports_per_second"]
+            if base is None:
+                base = (rate, workers)
+            speedup = rate / base[0]
+            print(
+                f"  {workers:>7}  {rate:9.1f}  {speedup:6.2f}x  {speedup * base[1] / workers:9.0%}  "
+                f"{stats['rows']:>7}  {stats['failed']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
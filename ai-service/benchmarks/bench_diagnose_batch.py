@@ -0,0 +1,106 @@
+"""
+Throughput of /api/diagnose/batch versus one /api/diagnose call per message
+
+Points a uvicorn-served app at the local LLM stub and pushes the same
+number of distinct messages through both endpoints, reporting messages
+per second. Single requests are sent with the same client concurrency
+as the batch endpoint's LLM fan-out, so the difference is per-request
+overhead rather than parallelism.
+
+Usage: python benchmarks/bench_diagnose_batch.py [--messages 400] [--batch-size 50] [--concurrency 8] [--latency-ms 20]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_llm_providers import free_port, start_stub
+
+
+def make_messages(count: int, offset: int):
+    # Distinct messages, so the LLM response cache is never hit
+    return [f"I have had a headache and a fever for {offset + i} hours" for i in range(count)]
+
+
+async def run_single(client, messages, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(message: str):
+        async with semaphore:
+            response = await client.post("/api/diagnose", json={"message": message})
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(message) for message in messages))
+    return time.perf_counter() - start
+
+
+async def run_batch(client, messages, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(messages), batch_size):
+        items = [{"message": message} for message in messages[i:i + batch_size]]
+        response = await client.post("/api/diagnose/batch", json={"items": items})
+        response.raise_for_status()
+        assert not any(item["error"] for item in response.json()["results"])
+    return time.perf_counter() - start
+
+
+async def run(port: int, args):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+        # Warm up connections in both directions
+        await run_single(client, make_messages(args.concurrency, 10 ** 6), args.concurrency)
+
+        elapsed = await run_single(client, make_messages(args.messages, 0), args.concurrency)
+        print(f"  single  {args.messages / elapsed:8.1f} msg/s  ({elapsed:.2f}s)")
+        elapsed = await run_batch(client, make_messages(args.messages, args.messages), args.batch_size)
+        print(f"  batch   {args.messages / elapsed:8.1f} msg/s  ({elapsed:.2f}s, {args.batch_size} per request)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    stub_port, app_port = free_port(), free_port()
+    stub = start_stub(stub_port, args.latency_ms, 1)
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+        "BATCH_LLM_CONCURRENCY": str(args.concurrency),
+    }
+    env.pop("ANTHROPIC_API_KEY", None)
+    service = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    try:
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", app_port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        print(f"{args.messages} messages, model latency {args.latency_ms:.0f} ms")
+        asyncio.run(run(app_port, args))
+    finally:
+        for process in (service, stub):
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Time to first byte for /api/diagnose versus /api/diagnose/stream
+
+Points LLMService at the local LLM stub and measures, for each endpoint,
+how long a client waits for the first response byte and for the
+complete response, over a range of model latencies.
+
+Usage: python benchmarks/bench_diagnose_stream.py [--latencies 100,500,2000] [--requests 10]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_llm_providers import free_port, start_stub
+
+
+async def measure(client, url: str, message: str):
+    start = time.perf_counter()
+    first = None
+    async with client.stream("POST", url, json={"message": message}) as response:
+        async for _ in response.aiter_raw():
+            if first is None:
+                first = time.perf_counter() - start
+    return first * 1000, (time.perf_counter() - start) * 1000
+
+
+async def run(port: int, requests: int):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+        for offset, url in enumerate(("/api/diagnose", "/api/diagnose/stream")):
+            # Vary the message so the shared response cache is never hit
+            samples = [
+                await measure(client, url, f"I have had a headache for {offset * requests + i} days")
+                for i in range(requests)
+            ]
+            ttfb = statistics.median(s[0] for s in samples)
+            total = statistics.median(s[1] for s in samples)
+            print(f"  {url:<22} ttfb p50={ttfb:8.1f}ms  complete p50={total:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latencies", default="100,500,2000")
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args()
+
+    for latency in [float(value) for value in args.latencies.split(",")]:
+        stub_port, app_port = free_port(), free_port()
+        stub = start_stub(stub_port, latency, 1)
+        env = {
+            **os.environ,
+            "OPENAI_API_KEY": "stub",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+        }
+        env.pop("ANTHROPIC_API_KEY", None)
+        service = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+            cwd=ROOT, env=env
+        )
+        try:
+            deadline = time.time() + 10
+            while time.time() < deadline:
+                try:
+                    socket.create_connection(("127.0.0.1", app_port), timeout=0.2).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            print(f"model latency {latency:.0f} ms")
+            asyncio.run(run(app_port, args.requests))
+        finally:
+            for process in (service, stub):
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Interaction index versus per-rule substring scanning
+
+Builds a synthetic interaction table with thousands of pairs and checks
+medication lists of 5 to 20 drugs, timing InteractionIndex.check against
+the previous approach of testing every rule with substring scans over the
+lowercased medication list.
+
+Usage: python benchmarks/bench_drug_interactions.py [--drugs 2000] [--pairs 20000] [--repeat 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.drug_interactions import InteractionIndex
+
+LIST_SIZES = [5, 10, 20]
+
+
+def make_table(drugs: int, pairs: int, rng: random.Random):
+    names = [f"drug{i:05d}" for i in range(drugs)]
+    seen = set()
+    interactions = []
+    while len(interactions) < pairs:
+        a, b = rng.sample(names, 2)
+        if frozenset((a, b)) in seen:
+            continue
+        seen.add(frozenset((a, b)))
+        interactions.append({
+            "medications": [a, b],
+            "severity": rng.choice(["low", "medium", "high"]),
+            "description": f"{a} interacts with {b}"
+        })
+    return {
+        "drugs": {name: [f"brand-{name}"] for name in names},
+        "interactions": interactions
+    }
+
+
+def legacy_check(table, medications):
+    """One substring scan of the medication list per side of every rule"""
+    med_names = [m.lower() for m in medications]
+    found = []
+    for rule in table["interactions"]:
+        first, second = rule["medications"]
+        if any(first in m for m in med_names) and any(second in m for m in med_names):
+            found.append(rule)
+    return found
+
+
+def per_call_us(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--drugs", type=int, default=2000)
+    parser.add_argument("--pairs", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    table = make_table(args.drugs, args.pairs, rng)
+    start = time.perf_counter()
+    index = InteractionIndex(table)
+    print(f"index of {len(index)} pairs over {args.drugs} drugs built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    names = list(table["drugs"])
+    print(f"{'drugs':>6} {'index (us)':>11} {'legacy (us)':>12} {'found':>6}")
+    for size in LIST_SIZES:
+        # Half the list comes from known pairs; mix generic names, brand
+        # names and dosage strings
+        chosen = {name for rule in rng.sample(table["interactions"], size // 4) for name in rule["medications"]}
+        chosen.update(rng.sample(names, size - len(chosen)))
+        medications = [
+            rng.choice([name, f"brand-{name}", f"{name} 10 mg tablets"])
+            for name in chosen
+        ]
+        found = len(index.check(medications).interactions)
+        index_us = per_call_us(lambda: index.check(medications), args.repeat)
+        legacy_us = per_call_us(lambda: legacy_check(table, medications), max(1, args.repeat // 20))
+        print(f"{size:>6} {index_us:>11.1f} {legacy_us:>12.1f} {found:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Load test for every ai-service endpoint, with results diffable against a baseline
+
+Starts the local LLM stub with the given latency, serves the app either
+in-process (httpx ASGI transport) or as a uvicorn subprocess, and drives
+each scenario at a fixed concurrency. Reports throughput, p50/p95/p99
+latency, error counts and service RSS, writes them as JSON, and with
+--baseline compares against an earlier run, exiting non-zero when a
+scenario regressed by more than --tolerance.
+
+Report uploads are synthetic scanned-looking PDFs and PNGs, each made
+unique so the result cache is not hit; they need tesseract (and poppler
+for PDFs) to succeed.
+
+Usage: python benchmarks/bench_endpoints.py [--server uvicorn|inprocess] [--scenarios diagnose,drug_interactions]
+           [--requests 200] [--concurrency 16] [--latency-ms 50] [--output results.json]
+           [--baseline benchmarks/baselines/endpoints.json] [--tolerance 0.15]
+"""
+
+from typing import Callable, Dict, List, Optional
+from dataclasses import dataclass
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_llm_providers import free_port, percentile, start_stub
+
+LAB_LINES = [
+    "Hemoglobin: 11.2 g/dL", "WBC: 11.5", "Platelets: 250",
+    "Fasting Glucose: 126 mg/dL", "Total Cholesterol: 210 mg/dL",
+    "LDL: 130 mg/dL", "HDL: 45 mg/dL", "Creatinine: 1.1 mg/dL",
+]
+SYMPTOMS = [
+    "I have had a headache and a fever since {n} hours ago",
+    "Stomach pain and nausea after eating, day {n}",
+    "Persistent cough and sore throat for {n} days",
+    "Feeling dizzy and tired, started {n} hours ago",
+]
+MEDICATION_LISTS = [
+    ["Coumadin 5mg", "aspirin"],
+    ["lisinopril", "potassium chloride", "ibuprofen tablets"],
+    ["simvastatin", "clarithromycin", "metformin"],
+    ["sertraline", "tramadol", "omeprazole", "warfarin"],
+]
+TERMS = ["hemoglobin", "cholesterol", "hypertension", "glucose", "diabetes", "hgb", "cholestrol"]
+
+
+def scanned_page(lines: List[str], nonce: int):
+    """A 150 DPI letter page with the lab lines drawn on it"""
+    import cv2
+    import numpy as np
+
+    page = np.full((1650, 1275), 255, dtype=np.uint8)
+    for row, line in enumerate(lines + [f"Specimen {nonce}"]):
+        cv2.putText(page, line, (100, 150 + row * 90), cv2.FONT_HERSHEY_SIMPLEX, 1.4, 0, 3)
+    return page
+
+
+def make_png(nonce: int) -> bytes:
+    import cv2
+
+    ok, encoded = cv2.imencode(".png", scanned_page(LAB_LINES, nonce))
+    return encoded.tobytes()
+
+
+def make_pdf(nonce: int, pages: int = 2) -> bytes:
+    from PIL import Image
+
+    images = [Image.fromarray(scanned_page(LAB_LINES, nonce * 100 + page)) for page in range(pages)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PDF", save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+
+@dataclass
+class Scenario:
+    name: str
+    # Builds the keyword arguments of client.request for the i-th request
+    request: Callable[[int], Dict]
+    # Caps the concurrency of expensive scenarios
+    max_concurrency: Optional[int] = None
+
+
+def _report(make: Callable[[int], bytes], filename: str, content_type: str) -> Callable[[int], Dict]:
+    def request(i: int) -> Dict:
+        return {
+            "method": "POST", "url": "/api/analyze-report",
+            "files": {"file": (filename, make(i), content_type)}
+        }
+    return request
+
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in [
+        Scenario("health", lambda i: {"method": "GET", "url": "/health"}),
+        Scenario("diagnose", lambda i: {
+            "method": "POST", "url": "/api/diagnose",
+            "json": {"message": SYMPTOMS[i % len(SYMPTOMS)].format(n=i)}
+        }),
+        Scenario("diagnose_emergency", lambda i: {
+            "method": "POST", "url": "/api/diagnose",
+            "json": {"message": f"Crushing chest pain and I can't breathe ({i})"}
+        }),
+        Scenario("diagnose_batch", lambda i: {
+            "method": "POST", "url": "/api/diagnose/batch",
+            "json": {"items": [{"message": SYMPTOMS[j % len(SYMPTOMS)].format(n=i * 10 + j)} for j in range(10)]}
+        }),
+        Scenario("diagnose_stream", lambda i: {
+            "method": "POST", "url": "/api/diagnose/stream",
+            "json": {"message": SYMPTOMS[i % len(SYMPTOMS)].format(n=i)}
+        }),
+        Scenario("drug_interactions", lambda i: {
+            "method": "POST", "url": "/api/drug-interactions",
+            "json": {"medications": MEDICATION_LISTS[i % len(MEDICATION_LISTS)]}
+        }),
+        Scenario("drug_interactions_unknown", lambda i: {
+            "method": "POST", "url": "/api/drug-interactions",
+            "json": {"medications": ["warfarin", f"experimental-compound-{i}"]}
+        }),
+        Scenario("explain_term", lambda i: {
+            "method": "POST", "url": "/api/explain-medical-terms",
+            "params": {"term": TERMS[i % len(TERMS)]}
+        }),
+        Scenario("terms_suggest", lambda i: {
+            "method": "GET", "url": "/api/terms/suggest",
+            "params": {"q": TERMS[i % len(TERMS)][:3 + i % 4]}
+        }),
+        Scenario("analyze_report_png", _report(make_png, "report.png", "image/png"), max_concurrency=2),
+        Scenario("analyze_report_pdf", _report(make_pdf, "report.pdf", "application/pdf"), max_concurrency=2),
+    ]
+}
+
+
+def rss_mb(pid: int) -> Dict[str, float]:
+    """Current and peak resident set size of a process"""
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(rest.split()[0]) / 1024
+    return {"rss_mb": round(values.get("VmRSS", 0), 1), "peak_rss_mb": round(values.get("VmHWM", 0), 1)}
+
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int, offset: int = 0) -> Dict:
+    concurrency = min(concurrency, scenario.max_concurrency or concurrency)
+    # Payloads are built up front so their cost is not measured
+    payloads = [scenario.request(offset + i) for i in range(requests)]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    pending = iter(payloads)
+
+    async def worker():
+        for payload in pending:
+            start = time.perf_counter()
+            try:
+                response = await client.request(**payload)
+                await response.aread()
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+async def run_all(client, names: List[str], args, pid: int) -> Dict[str, Dict]:
+    results = {}
+    for name in names:
+        scenario = SCENARIOS[name]
+        # A short warm-up so connection setup and first-call imports are not measured
+        await run_scenario(client, scenario, min(args.concurrency, 8), args.concurrency, offset=10 ** 6)
+        result = await run_scenario(client, scenario, args.requests, args.concurrency)
+        result.update(rss_mb(pid))
+        results[name] = result
+        print_result(name, result)
+    return results
+
+
+def print_result(name: str, result: Dict):
+    errors = f"  errors {result['errors']} {result['statuses']}" if result["errors"] else ""
+    print(
+        f"  {name:<26} {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f}  "
+        f"p95 {result['p95_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms  rss {result['rss_mb']:6.1f} MB{errors}"
+    )
+
+
+async def serve_inprocess(names: List[str], args) -> Dict[str, Dict]:
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            return await run_all(client, names, args, os.getpid())
+
+
+def serve_uvicorn(names: List[str], args, env: Dict[str, str]) -> Dict[str, Dict]:
+    import httpx
+
+    port = free_port()
+    service = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning", "--backlog", "4096"],
+        cwd=ROOT, env=env
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                break
+            except OSError:
+                if time.time() > deadline or service.poll() is not None:
+                    raise SystemExit("service did not start")
+                time.sleep(0.1)
+
+        async def drive():
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+                return await run_all(client, names, args, service.pid)
+
+        return asyncio.run(drive())
+    finally:
+        service.terminate()
+        service.wait()
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Print the change against the baseline; return the regressed scenarios"""
+    regressions = []
+    print(f"against baseline (tolerance {tolerance:.0%})")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"  {name:<26} not in baseline")
+            continue
+        throughput = result["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0.0
+        p95 = result["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        p99 = result["p99_ms"] / before["p99_ms"] - 1 if before["p99_ms"] else 0.0
+        regressed = (
+            throughput < -tolerance or p95 > tolerance or p99 > tolerance
+            or result["errors"] > before["errors"]
+        )
+        if regressed:
+            regressions.append(name)
+        print(
+            f"  {name:<26} req/s {throughput:+7.1%}  p95 {p95:+7.1%}  p99 {p99:+7.1%}  "
+            f"rss {result['rss_mb'] - before.get('rss_mb', 0):+7.1f} MB"
+            f"{'  REGRESSED' if regressed else ''}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--server", choices=("uvicorn", "inprocess"), default="uvicorn")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=50, help="injected LLM stub latency")
+    parser.add_argument("--token-delay-ms", type=float, default=5, help="stub delay between streamed words")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    stub_port = free_port()
+    os.environ["STUB_TOKEN_DELAY_MS"] = str(args.token_delay_ms)
+    stub = start_stub(stub_port, args.latency_ms, 1)
+    log_dir = tempfile.TemporaryDirectory()
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+        "LLM_PROVIDERS": "openai",
+        "LOG_PATH": os.path.join(log_dir.name, "ai_service.log"),
+    }
+    env.pop("ANTHROPIC_API_KEY", None)
+
+    print(
+        f"{args.server}: {args.requests} requests per scenario, concurrency {args.concurrency}, "
+        f"LLM latency {args.latency_ms:.0f} ms"
+    )
+    try:
+        if args.server == "inprocess":
+            os.environ.clear()
+            os.environ.update(env)
+            results = asyncio.run(serve_inprocess(names, args))
+        else:
+            results = serve_uvicorn(names, args, env)
+    finally:
+        stub.terminate()
+        stub.wait()
+        log_dir.cleanup()
+
+    run = {
+        "meta": {
+            "server": args.server,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "llm_latency_ms": args.latency_ms,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "benchmark_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("server", "concurrency", "llm_latency_ms", "cpus"):
+            if baseline["meta"].get(key) != run["meta"][key]:
+                print(f"warning: baseline {key} is {baseline['meta'].get(key)}, this run {run['meta'][key]}")
+        regressions = compare(results, baseline["scenarios"], args.tolerance)
+        if regressions:
+            print(f"regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Microbenchmark for the Aho-Corasick KeywordMatcher
+
+Times one find_all pass against the naive per-keyword substring scan
+over vocabularies of up to 10k keywords and messages of growing length.
+The automaton's cost should track message length and stay flat as the
+vocabulary grows; the naive scan grows with both.
+
+Usage: python benchmarks/bench_keyword_matcher.py [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.keyword_matcher import KeywordMatcher
+
+VOCAB_SIZES = [100, 1000, 10000]
+MESSAGE_LENGTHS = [200, 2000, 20000]
+
+
+def make_vocab(size: int, rng: random.Random):
+    """Pseudo-words and two-word phrases grouped into 50 keyword sets"""
+    words = set()
+    while len(words) < size:
+        word = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+        if rng.random() < 0.3:
+            word += " " + "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 8)))
+        words.add(word)
+    sets = {}
+    for i, word in enumerate(sorted(words)):
+        sets.setdefault(f"set{i % 50}", []).append(word)
+    return sets
+
+
+def make_message(length: int, vocab, rng: random.Random) -> str:
+    keywords = [kw for kws in vocab.values() for kw in kws]
+    parts = []
+    while sum(len(p) + 1 for p in parts) < length:
+        # Mostly filler, with the occasional real keyword
+        if rng.random() < 0.05:
+            parts.append(rng.choice(keywords))
+        else:
+            parts.append("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 8))))
+    return " ".join(parts)[:length]
+
+
+def naive(vocab, message: str):
+    message_lower = message.lower()
+    return [(pid, kw) for pid, kws in vocab.items() for kw in kws if kw in message_lower]
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    print(f"{'vocab':>7} {'message':>8} {'build (ms)':>11} {'automaton (ms)':>15} {'naive (ms)':>11}")
+    for size in VOCAB_SIZES:
+        vocab = make_vocab(size, rng)
+        start = time.perf_counter()
+        matcher = KeywordMatcher(vocab)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        for length in MESSAGE_LENGTHS:
+            message = make_message(length, vocab, rng)
+            found = {(h.pattern_id, h.keyword) for h in matcher.find_all(message)}
+            if found != set(naive(vocab, message)):
+                raise SystemExit("Automaton and naive scan disagree")
+
+            automaton_ms = best_of(lambda: matcher.find_all(message), args.repeat)
+            naive_ms = best_of(lambda: naive(vocab, message), args.repeat)
+            print(f"{size:>7} {length:>8} {build_ms:>11.1f} {automaton_ms:>15.3f} {naive_ms:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
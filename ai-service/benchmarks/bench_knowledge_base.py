@@ -0,0 +1,140 @@
+"""
+Worker startup time and memory: JSON sources versus the compiled knowledge base
+
+Generates synthetic term and interaction sources of increasing size,
+compiles each with services.knowledge_base, then starts several worker
+processes per backend at once. Each worker loads the data and the term
+index the way main.py does, runs random lookups, and reports its load
+time and its RSS, PSS and dirty private memory while all workers are
+still alive.
+Mapped file pages are clean and shared through the page cache, so only
+the dirty private column is memory each extra worker really costs.
+
+Usage: python benchmarks/bench_knowledge_base.py [--sizes 10000,100000,300000] [--workers 4]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services.knowledge_base import build
+
+WORKER = r"""
+import random, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+if {mode!r} == "json":
+    from services.drug_interactions import InteractionIndex
+    from services.knowledge_base import load_terms
+    from services.term_index import TermIndex
+    terms = load_terms({terms!r})
+    index = InteractionIndex.load({interactions!r})
+    term_index = TermIndex(terms.keys())
+    term_index.build()
+else:
+    from services.drug_interactions import MappedInteractionIndex
+    from services.knowledge_base import KnowledgeBase
+    from services.term_index import TermIndex
+    kb = KnowledgeBase({kb!r})
+    terms = kb.table("terms")
+    index = MappedInteractionIndex(kb)
+    term_index = TermIndex.from_knowledge_base(kb)
+loaded = time.perf_counter() - start
+
+rng = random.Random()
+for _ in range(2000):
+    term = f"term {{rng.randrange({size})}}"
+    terms.get(term)
+    term_index.resolve(term)
+    term_index.complete(term[:-2])
+    index.check([f"drug{{rng.randrange({drugs})}}" for _ in range(10)])
+
+print("ready", flush=True)
+sys.stdin.readline()
+memory = {{}}
+with open("/proc/self/smaps_rollup") as f:
+    for line in f:
+        parts = line.split()
+        if parts[0] in ("Rss:", "Pss:", "Private_Dirty:"):
+            memory[parts[0][:-1]] = int(parts[1])
+print(loaded, memory["Rss"], memory["Pss"], memory["Private_Dirty"], flush=True)
+"""
+
+
+def make_sources(tmp: str, size: int, rng: random.Random):
+    drugs = max(size // 10, 100)
+    terms_path = os.path.join(tmp, "terms.json")
+    with open(terms_path, "w") as f:
+        json.dump({f"term {i}": f"Explanation of term {i}. " * 8 for i in range(size)}, f)
+
+    interactions_path = os.path.join(tmp, "interactions.json")
+    names = [f"drug{i}" for i in range(drugs)]
+    interactions = []
+    for _ in range(size):
+        a, b = rng.sample(names, 2)
+        interactions.append({
+            "medications": [a, b],
+            "severity": rng.choice(["low", "medium", "high"]),
+            "description": f"{a} interacts with {b}"
+        })
+    with open(interactions_path, "w") as f:
+        json.dump({"drugs": {name: [f"brand-{name}"] for name in names}, "interactions": interactions}, f)
+    return terms_path, interactions_path, drugs
+
+
+def run_workers(count: int, **params):
+    code = WORKER.format(root=ROOT, **params)
+    workers = [
+        subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(count)
+    ]
+    for worker in workers:
+        assert worker.stdout.readline().strip() == "ready"
+    results = []
+    for worker in workers:
+        worker.stdin.write("\n")
+        worker.stdin.flush()
+        results.append([float(value) for value in worker.stdout.readline().split()])
+        worker.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,300000")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    print(f"{'entries':>8} {'backend':>8} {'file MB':>8} {'load ms':>9} {'RSS MB':>8} {'PSS MB':>8} {'dirty MB':>9}")
+    for size in [int(value) for value in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as tmp:
+            terms, interactions, drugs = make_sources(tmp, size, rng)
+            kb = os.path.join(tmp, "knowledge_base.mvkb")
+            build(terms, interactions, kb)
+            files = {
+                "json": os.path.getsize(terms) + os.path.getsize(interactions),
+                "mmap": os.path.getsize(kb)
+            }
+            for mode in ("json", "mmap"):
+                results = run_workers(
+                    args.workers, mode=mode, terms=terms, interactions=interactions,
+                    kb=kb, size=size, drugs=drugs
+                )
+                # Mean over the workers
+                loaded, rss, pss, private = [sum(column) / len(results) for column in zip(*results)]
+                print(
+                    f"{size:>8} {mode:>8} {files[mode] / 2 ** 20:>8.1f} {loaded * 1000:>9.1f} "
+                    f"{rss / 1024:>8.1f} {pss / 1024:>8.1f} {private / 1024:>9.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Lab history fetch and trend latency per user
+
+Records synthetic reports for one user, one every few days with a value
+for every test, then times fetching the user's whole history and
+computing every test's trend, as a report response with a user_id does.
+The target is under 1 ms at 1000 points per test.
+
+Usage: python benchmarks/bench_lab_history.py [--points 10,100,1000] [--repeat 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.lab_history import LabHistory, trend
+from services.report_analyzer import ReportAnalyzer
+
+RANGES = {
+    test: (config["normal_min"], config["normal_max"])
+    for test, config in ReportAnalyzer.LAB_PATTERNS.items()
+}
+
+
+def fill(history: LabHistory, user_id: str, points: int):
+    rng = np.random.default_rng(points)
+    start = time.time() - points * 3 * 86400
+    for index in range(points):
+        values = {
+            test: float(rng.uniform(low * 0.8, high * 1.2 if high else 1.0))
+            for test, (low, high) in RANGES.items()
+        }
+        digest = index.to_bytes(32, "big").hex()
+        history.record(user_id, digest, values, at=start + index * 3 * 86400)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", default="10,100,1000", help="comma-separated points per test")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        history = LabHistory(tmp)
+        print(f"{len(RANGES)} tests per report")
+        print(f"  {'points':>6}  {'record':>8}  {'one test':>9}  {'all tests':>9}  {'p99':>8}")
+        for points in (int(count) for count in args.points.split(",")):
+            user_id = f"user-{points}"
+            start = time.perf_counter()
+            fill(history, user_id, points)
+            record_ms = (time.perf_counter() - start) / points * 1000
+
+            single, full = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                series = history.series(user_id, "glucose")
+                trend(series["time"], series["value"], *RANGES["glucose"])
+                single.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                history.trends(user_id, RANGES)
+                full.append(time.perf_counter() - start)
+            full.sort()
+            print(
+                f"  {points:>6}  {record_ms:6.2f}ms  {statistics.median(single) * 1e6:7.0f}us  "
+                f"{statistics.median(full) * 1e6:7.0f}us  {full[int(len(full) * 0.99)] * 1e6:6.0f}us"
+            )
+
+
+if __name__ == "__main__":
+    main()
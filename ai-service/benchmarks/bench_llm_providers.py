@@ -0,0 +1,116 @@
+"""
+Load test for the pooled LLM provider layer
+
+Starts the local LLM stub with uvicorn, points LLMService at it and
+drives /api/diagnose in-process at a fixed concurrency, reporting
+latency percentiles and throughput. Run once with keep-alive and once
+with --no-keepalive to see the cost of per-call connection setup.
+
+Usage: python benchmarks/bench_llm_providers.py [--concurrency 200] [--requests 2000] [--latency-ms 50]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(port: int, latency_ms: float, workers: int) -> subprocess.Popen:
+    env = {**os.environ, "STUB_LATENCY_MS": str(latency_ms)}
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.llm_stub_server:app",
+         "--port", str(port), "--log-level", "warning", "--backlog", "4096",
+         "--workers", str(workers)],
+        cwd=ROOT, env=env
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return stub
+        except OSError:
+            time.sleep(0.1)
+    stub.kill()
+    raise SystemExit("LLM stub did not start")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def drive(concurrency: int, total: int):
+    import httpx
+    from main import app, llm_service
+
+    await llm_service.start()
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.post("/api/diagnose", json={"message": "I have had a headache since morning"})
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    stats = llm_service.providers.stats()
+    await llm_service.close()
+
+    print(f"{total} requests at concurrency {concurrency} in {elapsed:.2f}s")
+    print(f"  throughput: {total / elapsed:.0f} req/s")
+    print(f"  latency: p50={statistics.median(latencies):.1f}ms p99={percentile(latencies, 99):.1f}ms")
+    print(f"  providers: {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--stub-workers", type=int, default=1)
+    parser.add_argument("--no-keepalive", action="store_true")
+    args = parser.parse_args()
+
+    port = free_port()
+    os.environ.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+        "LLM_MAX_CONNECTIONS": str(args.concurrency),
+    })
+    os.environ.pop("ANTHROPIC_API_KEY", None)
+    if args.no_keepalive:
+        os.environ["LLM_MAX_KEEPALIVE"] = "0"
+
+    stub = start_stub(port, args.latency_ms, args.stub_workers)
+    try:
+        asyncio.run(drive(args.concurrency, args.requests))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    main()
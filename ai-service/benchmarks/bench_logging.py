@@ -0,0 +1,122 @@
+"""
+Request throughput with logging off, synchronous and asynchronous
+
+Serves the app with uvicorn once per LOG_MODE and drives
+/api/drug-interactions (answered from the interaction index, so no LLM
+is involved) at a fixed concurrency, reporting req/s and latency
+percentiles. Also reports what a single logger.info call costs the
+calling coroutine in each mode.
+
+Usage: python benchmarks/bench_logging.py [--requests 5000] [--concurrency 32] [--calls 50000]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_llm_providers import free_port, percentile
+
+MODES = ("off", "sync", "async")
+MEDICATIONS = ["Coumadin 5mg", "aspirin", "ibuprofen tablets", "lisinopril", "potassium chloride"]
+
+
+async def drive(port: int, total: int, concurrency: int):
+    import httpx
+
+    latencies = []
+    remaining = iter(range(total))
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await client.post("/api/drug-interactions", json={"medications": MEDICATIONS})
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])  # warm-up
+        latencies.clear()
+        remaining = iter(range(total))
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return total / elapsed, latencies
+
+
+def serve(mode: str, log_dir: str) -> subprocess.Popen:
+    port = free_port()
+    env = {**os.environ, "LOG_MODE": mode, "LOG_PATH": os.path.join(log_dir, f"{mode}.log")}
+    env.pop("OPENAI_API_KEY", None)
+    env.pop("ANTHROPIC_API_KEY", None)
+    service = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return service, port
+        except OSError:
+            time.sleep(0.1)
+    service.kill()
+    raise SystemExit(f"service did not start with LOG_MODE={mode}")
+
+
+def caller_cost(mode: str, log_dir: str, calls: int) -> float:
+    """Mean microseconds spent in logger.info by the caller"""
+    code = (
+        "import os, sys, time\n"
+        f"sys.path.insert(0, {ROOT!r})\n"
+        "from loguru import logger\n"
+        "from services.log_writer import configure_logging\n"
+        "sink = configure_logging()\n"
+        "medications = ['Coumadin 5mg', 'aspirin', 'ibuprofen tablets']\n"
+        "start = time.perf_counter()\n"
+        f"for _ in range({calls}):\n"
+        "    logger.info('Checking drug interactions', medications=medications)\n"
+        f"print((time.perf_counter() - start) / {calls} * 1e6)\n"
+        "if sink is not None:\n"
+        "    sink.close()\n"
+    )
+    env = {**os.environ, "LOG_MODE": mode, "LOG_PATH": os.path.join(log_dir, f"calls-{mode}.log"),
+           "LOG_QUEUE_SIZE": str(calls + 1)}
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--calls", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        print(f"logger.info cost to the caller ({args.calls} calls)")
+        for mode in MODES:
+            print(f"  {mode:<6} {caller_cost(mode, log_dir, args.calls):7.2f} us/call")
+
+        print(f"/api/drug-interactions, {args.requests} requests, concurrency {args.concurrency}")
+        for mode in MODES:
+            service, port = serve(mode, log_dir)
+            try:
+                rate, latencies = asyncio.run(drive(port, args.requests, args.concurrency))
+            finally:
+                service.terminate()
+                service.wait()
+            print(
+                f"  {mode:<6} {rate:8.1f} req/s  p50 {percentile(latencies, 50):6.2f} ms  "
+                f"p99 {percentile(latencies, 99):6.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Per-observation cost of the metrics primitives
+
+Times the operations the service performs on its hot paths: counter
+increments, labelled histogram observations, stage timers and a full
+/metrics render.
+
+Usage: python benchmarks/bench_metrics.py [--iterations 1000000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.metrics import Registry, render
+
+
+def per_op_ns(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    baseline = time.perf_counter() - start
+    return (elapsed - baseline) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1000000)
+    args = parser.parse_args()
+
+    registry = Registry()
+    requests = registry.counter("requests_total", "", ("method", "route", "status"))
+    in_flight = registry.gauge("in_flight", "")
+    latency = registry.histogram("latency_seconds", "", ("method", "route"))
+    stage = registry.histogram("stage_seconds", "", ("stage",))
+    bound = stage.labels("ocr")
+
+    def timed():
+        with stage.labels("score").time():
+            pass
+
+    cases = [
+        ("gauge inc", in_flight.inc),
+        ("labelled counter inc", lambda: requests.labels("POST", "/api/diagnose", "200").inc()),
+        ("labelled histogram observe", lambda: latency.labels("POST", "/api/diagnose").observe(0.0123)),
+        ("bound histogram observe", lambda: bound.observe(0.0123)),
+        ("stage timer (with block)", timed),
+    ]
+    for name, func in cases:
+        print(f"{name:<28} {per_op_ns(func, args.iterations):8.0f} ns")
+
+    for route in range(20):
+        for status in ("200", "404", "500"):
+            requests.labels("POST", f"/route/{route}", status).inc()
+            latency.labels("POST", f"/route/{route}").observe(0.01)
+    start = time.perf_counter()
+    body = render(registry.collect())
+    print(f"{'render (' + str(len(body.splitlines())) + ' lines)':<28} {(time.perf_counter() - start) * 1e6:8.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Event-loop responsiveness while reports are being OCR'd
+
+Uploads several synthetic multi-page reports to /api/analyze-report at
+once and probes /health and /api/diagnose while they are processed,
+reporting probe latency percentiles. Requires tesseract and poppler.
+
+Usage: OCR_WORKERS=4 python benchmarks/bench_ocr_concurrency.py [--reports 8] [--pages 4]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import httpx
+import numpy as np
+from PIL import Image
+
+from main import app, report_analyzer
+
+LAB_LINES = [
+    "Hemoglobin: 14.2 g/dL", "WBC: 11.5", "Platelets: 250",
+    "Fasting Glucose: 126 mg/dL", "Total Cholesterol: 210 mg/dL",
+    "LDL: 130 mg/dL", "HDL: 45 mg/dL", "Creatinine: 1.1 mg/dL",
+]
+
+
+def make_pdf(pages: int) -> bytes:
+    """Render a scanned-looking multi-page PDF at roughly 150 DPI"""
+    images = []
+    for page in range(pages):
+        canvas = np.full((1650, 1275), 255, dtype=np.uint8)
+        for row, line in enumerate(LAB_LINES):
+            cv2.putText(canvas, f"{line}  (p{page + 1})", (100, 150 + row * 90),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.4, 0, 3)
+        images.append(Image.fromarray(canvas))
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PDF", save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def probe(client, method, url, samples, stop, **kwargs):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.request(method, url, **kwargs)
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.005)
+
+
+async def run(reports: int, pages: int):
+    pdf = make_pdf(pages)
+    health, diagnose = [], []
+    stop = asyncio.Event()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        probes = [
+            asyncio.create_task(probe(client, "GET", "/health", health, stop)),
+            asyncio.create_task(probe(client, "POST", "/api/diagnose", diagnose, stop,
+                                      json={"message": "I have a headache"})),
+        ]
+        start = time.perf_counter()
+        uploads = await asyncio.gather(*[
+            client.post("/api/analyze-report",
+                        files={"file": (f"report{i}.pdf", pdf, "application/pdf")})
+            for i in range(reports)
+        ])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*probes)
+
+    report_analyzer.shutdown()
+
+    statuses = [r.status_code for r in uploads]
+    print(f"{reports} reports x {pages} pages in {elapsed:.1f}s "
+          f"(workers={report_analyzer.ocr_pool.workers}, statuses={sorted(set(statuses))})")
+    for name, samples in (("/health", health), ("/api/diagnose", diagnose)):
+        print(f"{name:>14}: n={len(samples):<5} p50={statistics.median(samples):.2f}ms "
+              f"p99={percentile(samples, 99):.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reports", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(run(args.reports, args.pages))
+
+
+if __name__ == "__main__":
+    main()
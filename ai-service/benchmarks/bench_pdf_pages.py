@@ -0,0 +1,160 @@
+"""
+Report analysis latency versus page count for mixed text and scanned PDFs
+
+Builds synthetic reports in which a fraction of the pages carry an
+embedded text layer and the rest are scanned images, with the lab
+tables spread over a few pages. Each report is run through the page
+pipeline (ReportAnalyzer.analyze) and through whole-document OCR of
+every page, the previous behaviour. Requires poppler and tesseract.
+
+Usage: OCR_WORKERS=4 python benchmarks/bench_pdf_pages.py [--pages 1,5,10,30] [--text-ratio 0.5] [--repeat 3]
+"""
+
+from typing import List
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from services.ocr import OCRPool
+from services.report_analyzer import ReportAnalyzer, _ocr_and_extract
+
+LAB_TABLES = [
+    ["Hemoglobin: 11.2 g/dL", "WBC: 11.5", "Platelets: 250"],
+    ["Fasting Glucose: 126 mg/dL", "Glucose: 118 mg/dL", "Total Cholesterol: 210 mg/dL"],
+    ["LDL: 130 mg/dL", "HDL: 45 mg/dL", "Triglycerides: 180 mg/dL"],
+    ["Creatinine: 1.1 mg/dL", "ALT: 62 U/L", "AST: 35 U/L"],
+]
+FILLER = [
+    "Patient history and clinical notes continue on this page.",
+    "Specimen collected at the outpatient laboratory.",
+    "Physician comments: follow up as scheduled.",
+]
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792  # points, US letter
+
+
+def page_lines(page: int, pages: int) -> List[str]:
+    # The lab tables sit on a few pages in the first part of the report,
+    # the rest is narrative; short reports get them all on page one
+    lines = [f"Page {page + 1} of {pages}"]
+    if pages < len(LAB_TABLES):
+        if page == 0:
+            lines += [line for table in LAB_TABLES for line in table]
+    else:
+        step = max(1, pages // 8)
+        if page % step == 0 and page // step < len(LAB_TABLES):
+            lines += LAB_TABLES[page // step]
+    return lines + FILLER
+
+
+def scanned_jpeg(lines: List[str]) -> bytes:
+    """The page drawn at 150 DPI and JPEG-encoded, as a scanner would"""
+    canvas = np.full((1650, 1275), 255, dtype=np.uint8)
+    for row, line in enumerate(lines):
+        cv2.putText(canvas, line, (100, 150 + row * 80), cv2.FONT_HERSHEY_SIMPLEX, 1.3, 0, 3)
+    ok, encoded = cv2.imencode(".jpg", canvas, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return encoded.tobytes()
+
+
+def text_content(lines: List[str]) -> bytes:
+    escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+    body = "".join(f"({line}) Tj 0 -18 Td " for line in escaped)
+    return f"BT /F1 12 Tf 72 720 Td {body}ET".encode()
+
+
+def build_pdf(pages: int, text_ratio: float) -> bytes:
+    """A PDF in which text_ratio of the pages, spread evenly, have a text layer"""
+    objects: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = len(objects) + 1
+    objects.append(b"")  # placeholder for the page tree
+    kids = []
+    for page in range(pages):
+        lines = page_lines(page, pages)
+        if int((page + 1) * text_ratio) > int(page * text_ratio):
+            content = zlib.compress(text_content(lines))
+            stream = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream")
+            resources = b"<< /Font << /F1 %d 0 R >> >>" % font
+        else:
+            jpeg = scanned_jpeg(lines)
+            image = add(
+                b"<< /Type /XObject /Subtype /Image /Width 1275 /Height 1650 /ColorSpace /DeviceGray "
+                b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n" % len(jpeg) + jpeg + b"\nendstream"
+            )
+            draw = b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (PAGE_WIDTH, PAGE_HEIGHT)
+            stream = add(b"<< /Length %d >>\nstream\n" % len(draw) + draw + b"\nendstream")
+            resources = b"<< /XObject << /Im0 %d 0 R >> >>" % image
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R /Resources %s >>"
+            % (pages_id, PAGE_WIDTH, PAGE_HEIGHT, stream, resources)
+        ))
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+    )
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+async def run(page_counts: List[int], text_ratio: float, repeat: int):
+    analyzer = ReportAnalyzer(OCRPool())
+    print(f"text layer on {text_ratio:.0%} of pages, {analyzer.ocr_pool.workers} OCR workers")
+    print(f"  {'pages':>5}  {'pipeline':>10}  {'whole OCR':>10}  {'speedup':>7}  tests found")
+    for pages in page_counts:
+        pdf = build_pdf(pages, text_ratio)
+        pipeline, whole = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = await analyzer.analyze(pdf, "general")
+            pipeline.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            legacy = await analyzer.ocr_pool.run(_ocr_and_extract, pdf)
+            whole.append(time.perf_counter() - start)
+        p, w = statistics.median(pipeline), statistics.median(whole)
+        print(
+            f"  {pages:>5}  {p * 1000:8.0f}ms  {w * 1000:8.0f}ms  {w / p:6.1f}x  "
+            f"{len(result['flagged_values'])} vs {len(legacy['values'])}"
+        )
+    analyzer.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", default="1,5,10,30")
+    parser.add_argument("--text-ratio", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--write", help="also save the largest synthetic PDF to this path")
+    args = parser.parse_args()
+
+    page_counts = [int(count) for count in args.pages.split(",")]
+    if args.write:
+        with open(args.write, "wb") as f:
+            f.write(build_pdf(max(page_counts), args.text_ratio))
+    asyncio.run(run(page_counts, args.text_ratio, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Memory and throughput of pre-fork serving against uvicorn --workers
+
+For each worker count, starts the service three ways: forked from one
+warmed master (services.prefork), the same without gc.freeze(), and with
+uvicorn --workers, whose workers are spawned and each import the app.
+Drives /api/diagnose from separate client processes, then reports req/s
+and the memory of the whole process tree: RSS counts pages shared between
+workers once per process, PSS splits them among the processes sharing
+them (Linux only).
+
+Usage: python benchmarks/bench_prefork.py [--workers 1,2,4] [--seconds 10] [--clients 2]
+"""
+
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+from benchmarks.bench_llm_providers import free_port
+
+MODES = {
+    "prefork": ["-m", "services.prefork"],
+    "prefork, no freeze": ["-m", "services.prefork", "--no-gc-freeze"],
+    "uvicorn --workers": ["-m", "uvicorn", "main:app"],
+}
+MESSAGES = [
+    "I have had a headache since morning and feel tired",
+    "Fever and cough for three days, mild sore throat",
+    "Stomach ache after meals and some nausea",
+]
+
+
+def start(mode: str, workers: int, port: int) -> subprocess.Popen:
+    env = {**os.environ, "LOG_MODE": "off"}
+    for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY"):
+        env.pop(key, None)
+    server = subprocess.Popen(
+        [sys.executable, *MODES[mode], "--workers", str(workers), "--port", str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        # uvicorn runs a single worker in its own process, without a supervisor
+        if len(_tree(server.pid)) >= workers:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                    return server
+            except httpx.HTTPError:
+                pass
+        time.sleep(0.2)
+    server.kill()
+    raise SystemExit(f"{mode} did not start")
+
+
+def _tree(root: int) -> List[int]:
+    """root and all its descendants"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+
+def memory_mb(root: int) -> Dict[str, float]:
+    total = {"Rss": 0.0, "Pss": 0.0}
+    for pid in _tree(root):
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    field = line.split(":")[0]
+                    if field in total:
+                        total[field] += int(line.split()[1]) / 1024
+        except OSError:
+            continue
+    return total
+
+
+def client(port: int, seconds: float, concurrency: int):
+    """Send requests for ``seconds`` and print how many completed"""
+    async def run():
+        done = errors = 0
+        deadline = time.perf_counter() + seconds
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30) as http:
+            async def worker(offset: int):
+                nonlocal done, errors
+                while time.perf_counter() < deadline:
+                    message = f"{MESSAGES[(done + offset) % len(MESSAGES)]} ({done}-{offset})"
+                    response = await http.post("/api/diagnose", json={"message": message})
+                    if response.status_code == 200:
+                        done += 1
+                    else:
+                        errors += 1
+            await asyncio.gather(*[worker(i) for i in range(concurrency)])
+        print(json.dumps({"done": done, "errors": errors}))
+    asyncio.run(run())
+
+
+def drive(port: int, seconds: float, clients: int, concurrency: int) -> float:
+    procs = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--client", str(port),
+             "--seconds", str(seconds), "--concurrency", str(concurrency)],
+            stdout=subprocess.PIPE, text=True
+        )
+        for _ in range(clients)
+    ]
+    results = [json.loads(proc.communicate()[0].strip().splitlines()[-1]) for proc in procs]
+    return sum(r["done"] for r in results) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", help="comma-separated worker counts (default: powers of two up to all cores)")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=2, help="load generator processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight per client")
+    parser.add_argument("--client", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        client(args.client, args.seconds, args.concurrency)
+        return
+
+    cores = os.cpu_count() or 1
+    if args.workers:
+        counts = [int(count) for count in args.workers.split(",")]
+    else:
+        counts = sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+    print(f"{cores} cores, {args.clients} client processes x {args.concurrency} in flight")
+    print(f"  {'workers':>7}  {'mode':<20}  {'req/s':>7}  {'RSS':>8}  {'PSS':>8}  {'PSS/worker':>10}")
+
+    for workers in counts:
+        for mode in MODES:
+            port = free_port()
+            server = start(mode, workers, port)
+            try:
+                rate = drive(port, args.seconds, args.clients, args.concurrency)
+                memory = memory_mb(server.pid)
+            finally:
+                server.terminate()
+                server.wait()
+            print(
+                f"  {workers:>7}  {mode:<20}  {rate:7.0f}  {memory['Rss']:6.0f}MB  "
+                f"{memory['Pss']:6.0f}MB  {memory['Pss'] / workers:8.0f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
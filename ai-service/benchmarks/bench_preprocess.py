@@ -0,0 +1,199 @@
+"""
+OCR time and peak memory for phone photos, before and after preprocessing
+
+Runs a corpus of photos through the previous path (full-resolution
+grayscale decode, median blur and adaptive threshold) and through
+load_and_preprocess, then again from the preprocessed-image cache as a
+re-analysis with another report_type would. Each mode runs in a fresh
+process and peak RSS is reported above its RSS before the first photo
+(Linux only). Without --photos, synthetic 12 MP photos are generated: a
+printed report shot at an angle, with uneven lighting, sensor noise and
+the desk around the page. OCR columns are filled in when tesseract is
+installed.
+
+Usage: python benchmarks/bench_preprocess.py [--photos DIR] [--count 6] [--megapixels 12]
+"""
+
+from typing import Dict, List
+import argparse
+import glob
+import hashlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+LINES = [
+    "CITY DIAGNOSTIC LABORATORY", "Complete Blood Count and Chemistry", "",
+    "Hemoglobin: 11.2 g/dL", "WBC: 11.5", "Platelets: 250",
+    "Fasting Glucose: 126 mg/dL", "Total Cholesterol: 210 mg/dL",
+    "LDL: 130 mg/dL", "HDL: 45 mg/dL", "Triglycerides: 180 mg/dL",
+    "Creatinine: 1.1 mg/dL", "ALT: 62 U/L", "AST: 35 U/L", "",
+    "Physician comments: follow up as scheduled.",
+]
+MODES = ("before", "after", "cached")
+
+
+def phone_photo(seed: int, megapixels: float) -> bytes:
+    """A printed report photographed on a desk, JPEG-encoded"""
+    rng = np.random.default_rng(seed)
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    # Landscape sensor, portrait page: the page fills most of the frame height
+    photo = np.empty((height, width, 3), dtype=np.uint8)
+    photo[:] = (60, 85, 110)  # wooden desk
+
+    page_h = int(height * 0.85)
+    page_w = int(page_h * 0.77)
+    page = np.full((page_h, page_w), 245, dtype=np.uint8)
+    scale = page_h / 1400
+    for row, line in enumerate(LINES):
+        cv2.putText(
+            page, line, (int(90 * scale), int((140 + row * 70) * scale)),
+            cv2.FONT_HERSHEY_SIMPLEX, 1.3 * scale, 25, max(2, int(2.5 * scale)), cv2.LINE_AA
+        )
+
+    angle = float(rng.uniform(-6, 6))
+    corners = np.float32([[0, 0], [page_w, 0], [page_w, page_h], [0, page_h]])
+    center = np.float32([width / 2, height / 2])
+    rotation = cv2.getRotationMatrix2D((0, 0), angle, 1.0)[:, :2].astype(np.float32)
+    placed = (corners - [page_w / 2, page_h / 2]) @ rotation.T + center
+    # A slight keystone, as from a phone not held quite parallel
+    placed += rng.uniform(-0.01, 0.01, placed.shape).astype(np.float32) * height
+    matrix = cv2.getPerspectiveTransform(corners, placed.astype(np.float32))
+    warped = cv2.warpPerspective(page, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=0)
+    mask = cv2.warpPerspective(np.full_like(page, 255), matrix, (width, height), borderValue=0)
+    photo[mask > 0] = warped[mask > 0, None]
+    del warped, mask
+
+    # Light falling off across the frame, plus sensor noise
+    gradient = np.linspace(1.0, 0.7, width, dtype=np.float32)[None, :, None]
+    noisy = photo.astype(np.float32) * gradient + rng.normal(0, 6, photo.shape).astype(np.float32)
+    photo = np.clip(noisy, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def legacy_preprocess(data: bytes) -> np.ndarray:
+    """The pipeline before the preprocessing stage"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    image = cv2.medianBlur(image, 3)
+    return cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+
+
+def reset_peak_rss() -> float:
+    """Reset the kernel's peak-RSS mark and return the current RSS in MB"""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    return _status_mb("VmRSS")
+
+
+def _status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def child(mode: str, paths: List[str], cache_dir: str):
+    """Run one mode over the corpus and print its measurements as JSON"""
+    from services.ocr import OCRError, ocr_binary
+    from services.preprocess import PreprocessCache, load_and_preprocess
+    from services.report_analyzer import ReportAnalyzer
+
+    cache = PreprocessCache(cache_dir)
+    baseline_mb = reset_peak_rss()
+    prep, ocr, pixels, found = [], [], [], []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        start = time.perf_counter()
+        if mode == "before":
+            binary = legacy_preprocess(data)
+        elif mode == "after":
+            binary = load_and_preprocess(data)
+            cache.put(hashlib.sha256(data).hexdigest(), binary)
+        else:
+            binary = cache.get(hashlib.sha256(data).hexdigest())
+        prep.append(time.perf_counter() - start)
+        pixels.append(binary.size)
+
+        start = time.perf_counter()
+        try:
+            text = ocr_binary(binary)
+        except OCRError:
+            continue
+        ocr.append(time.perf_counter() - start)
+        found.append(len(ReportAnalyzer.extract_values(text)))
+        del binary
+
+    print(json.dumps({
+        "preprocess_ms": statistics.median(prep) * 1000,
+        "ocr_ms": statistics.median(ocr) * 1000 if ocr else None,
+        "megapixels": statistics.median(pixels) / 1e6,
+        "tests_found": statistics.mean(found) if found else None,
+        "peak_mb": _status_mb("VmHWM") - baseline_mb,
+    }))
+
+
+def run_mode(mode: str, paths: List[str], cache_dir: str) -> Dict:
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--cache-dir", cache_dir, *paths],
+        check=True, capture_output=True, text=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--photos", help="directory of sample photos (*.jpg, *.jpeg, *.png)")
+    parser.add_argument("--count", type=int, default=6, help="synthetic photos to generate")
+    parser.add_argument("--megapixels", type=float, default=12.0)
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", help=argparse.SUPPRESS)
+    parser.add_argument("paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.paths, args.cache_dir)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.photos:
+            paths = sorted(
+                path for pattern in ("*.jpg", "*.jpeg", "*.png")
+                for path in glob.glob(os.path.join(args.photos, pattern))
+            )
+        else:
+            paths = []
+            for seed in range(args.count):
+                path = os.path.join(tmp, f"photo{seed}.jpg")
+                with open(path, "wb") as f:
+                    f.write(phone_photo(seed, args.megapixels))
+                paths.append(path)
+        sizes = [os.path.getsize(path) / 1e6 for path in paths]
+        print(f"{len(paths)} photos, median {statistics.median(sizes):.1f} MB on disk")
+
+        cache_dir = os.path.join(tmp, "cache")
+        print(f"  {'mode':<8}  {'preprocess':>10}  {'ocr':>8}  {'to OCR':>8}  {'peak RSS':>9}  tests found")
+        for mode in MODES:
+            r = run_mode(mode, paths, cache_dir)
+            ocr = f"{r['ocr_ms']:6.0f}ms" if r["ocr_ms"] is not None else "     n/a"
+            found = f"{r['tests_found']:.1f}" if r["tests_found"] is not None else "n/a (no tesseract)"
+            print(
+                f"  {mode:<8}  {r['preprocess_ms']:8.0f}ms  {ocr}  {r['megapixels']:6.2f}MP  "
+                f"{r['peak_mb']:7.0f}MB  {found}"
+            )
+
+
+if __name__ == "__main__":
+    main()
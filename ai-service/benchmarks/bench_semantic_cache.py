@@ -0,0 +1,90 @@
+"""
+Replay a recorded query log through the LLM response caches
+
+Sends every logged /api/diagnose and /api/explain-medical-terms query
+through LLMService, with an in-process provider that sleeps for the
+configured upstream latency, and reports hit rates and latency saved
+against the same replay with caching disabled.
+
+Usage: python benchmarks/bench_semantic_cache.py [--log benchmarks/data/query_log.tsv] [--latency-ms 100]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.llm_stub_server import reply_for
+from services.llm_service import LLMService
+
+
+class SleepingPool:
+    """Provider pool stand-in with a fixed upstream latency"""
+
+    available = True
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def complete(self, prompt, max_tokens=1024, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return reply_for(prompt)
+
+
+def load_log(path: str):
+    with open(path) as f:
+        return [
+            tuple(line.rstrip("\n").split("\t", 1))
+            for line in f
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+async def replay(queries, latency: float, cached: bool):
+    os.environ["LLM_CACHE_ENDPOINTS"] = "symptoms,terms" if cached else ""
+    service = LLMService()
+    service.providers = SleepingPool(latency)
+
+    start = time.perf_counter()
+    for endpoint, text in queries:
+        if endpoint == "symptoms":
+            await service.analyze_symptoms(text)
+        else:
+            await service.explain_medical_term(text)
+    return time.perf_counter() - start, service
+
+
+async def run(log_path: str, latency_ms: float):
+    queries = load_log(log_path)
+    latency = latency_ms / 1000
+
+    uncached_s, _ = await replay(queries, latency, cached=False)
+    cached_s, service = await replay(queries, latency, cached=True)
+
+    print(f"{len(queries)} queries, upstream latency {latency_ms:.0f} ms")
+    for name, stats in service.cache_stats().items():
+        print(
+            f"  {name:>8}: exact={stats['exact_hits']} similar={stats['similar_hits']} "
+            f"misses={stats['misses']} hit rate={stats['hit_rate']:.0%}"
+        )
+    print(f"  upstream calls: {len(queries)} -> {service.providers.calls}")
+    print(f"  replay time: {uncached_s:.2f}s uncached, {cached_s:.2f}s cached "
+          f"({uncached_s - cached_s:.2f}s saved)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--log", default=os.path.join(ROOT, "benchmarks", "data", "query_log.tsv"))
+    parser.add_argument("--latency-ms", type=float, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.log, args.latency_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Provider calls and latency for bursts of identical LLM requests, with and without single-flight
+
+Fires bursts of identical explain_medical_term calls at LLMService,
+which is pointed at the local LLM stub. Every burst uses a new term,
+so the response cache never answers and each saved provider call is
+down to coalescing.
+
+Usage: python benchmarks/bench_single_flight.py [--bursts 20] [--burst-size 50] [--latency-ms 200]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_llm_providers import free_port, percentile, start_stub
+
+
+async def run(bursts: int, burst_size: int, coalesce: bool):
+    from services.llm_service import LLM_SECONDS, LLMService
+
+    service = LLMService()
+    if not coalesce:
+        service.single_flight = None
+    await service.start()
+    provider_calls = LLM_SECONDS.labels("terms", "provider")
+    before = sum(provider_calls.counts)
+
+    latencies = []
+
+    async def ask(term: str):
+        start = time.perf_counter()
+        await service.explain_medical_term(term)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    for burst in range(bursts):
+        term = f"{'coalesced' if coalesce else 'independent'} term {burst}"
+        await asyncio.gather(*[ask(term) for _ in range(burst_size)])
+    elapsed = time.perf_counter() - start
+    await service.close()
+
+    calls = sum(provider_calls.counts) - before
+    label = "single-flight" if coalesce else "independent"
+    print(
+        f"  {label:<14} provider calls {calls:5d}  {bursts * burst_size / elapsed:8.1f} req/s  "
+        f"p50 {percentile(latencies, 50):7.1f} ms  p99 {percentile(latencies, 99):7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    port = free_port()
+    os.environ.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+        "LLM_PROVIDERS": "openai",
+    })
+    os.environ.pop("ANTHROPIC_API_KEY", None)
+    stub = start_stub(port, args.latency_ms, 1)
+    try:
+        print(f"{args.bursts} bursts of {args.burst_size} identical requests, model latency {args.latency_ms:.0f} ms")
+        for coalesce in (False, True):
+            asyncio.run(run(args.bursts, args.burst_size, coalesce))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    main()
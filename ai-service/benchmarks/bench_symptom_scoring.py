@@ -0,0 +1,73 @@
+"""
+SymptomAnalyzer.analyze cost as the pattern library grows
+
+Builds synthetic pattern libraries of up to 5,000 patterns around the
+built-in ones and times analyze() on a fixed multi-symptom message,
+next to the previous approach of testing every keyword of every pattern
+against the message.
+
+Usage: python benchmarks/bench_symptom_scoring.py [--repeat 200]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.symptom_analyzer import SymptomAnalyzer, SymptomPattern
+
+LIBRARY_SIZES = [10, 100, 1000, 5000]
+MESSAGE = "I've had a headache, a fever and a dry cough since Monday and feel exhausted"
+
+
+def make_library(size: int, rng: random.Random):
+    patterns = dict(SymptomAnalyzer().patterns)
+    while len(patterns) < size:
+        name = "".join(rng.choice(string.ascii_lowercase) for _ in range(8))
+        patterns[name] = SymptomPattern(
+            keywords=[
+                "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(6, 12)))
+                for _ in range(4)
+            ],
+            severity=rng.choice(["low", "moderate", "high"]),
+            recommendations=[f"Recommendation for {name}"],
+            conditions=[f"Condition {name}"]
+        )
+    return patterns
+
+
+def naive_scan(patterns, message: str):
+    message_lower = message.lower()
+    return [name for name, pattern in patterns.items() if any(kw in message_lower for kw in pattern.keywords)]
+
+
+def per_call_us(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    print(f"{'patterns':>9} {'analyze (us)':>13} {'naive scan (us)':>16}  matched")
+    for size in LIBRARY_SIZES:
+        patterns = make_library(size, rng)
+        analyzer = SymptomAnalyzer(patterns=patterns)
+        result = analyzer.analyze(MESSAGE)
+        analyze_us = per_call_us(lambda: analyzer.analyze(MESSAGE), args.repeat)
+        naive_us = per_call_us(lambda: naive_scan(patterns, MESSAGE), args.repeat)
+        matched = [m["symptom"] for m in result["matched_symptoms"]]
+        print(f"{size:>9} {analyze_us:>13.1f} {naive_us:>16.1f}  {matched}")
+
+
+if __name__ == "__main__":
+    main()
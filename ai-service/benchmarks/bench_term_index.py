@@ -0,0 +1,94 @@
+"""
+TermIndex lookup latency over a large synthetic vocabulary
+
+Builds a TermIndex over up to 200k multi-word terms and reports build
+time plus p50/p99 latency for prefix completion, typo resolution and
+ranked suggestions, next to the previous linear substring scan over
+the term dict.
+
+Usage: python benchmarks/bench_term_index.py [--terms 200000] [--queries 2000]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_llm_providers import percentile
+from services.term_index import TermIndex
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 12))) for _ in range(size // 5)]
+    terms = set()
+    while len(terms) < size:
+        terms.add(" ".join(rng.sample(words, rng.randint(1, 3))))
+    return sorted(terms)
+
+
+def typo(term: str, rng: random.Random) -> str:
+    i = rng.randrange(len(term))
+    edit = rng.choice(["delete", "replace", "transpose"])
+    if edit == "delete":
+        return term[:i] + term[i + 1:]
+    if edit == "replace":
+        return term[:i] + rng.choice(string.ascii_lowercase) + term[i + 1:]
+    i = min(i, len(term) - 2)
+    return term[:i] + term[i + 1] + term[i] + term[i + 2:]
+
+
+def legacy_lookup(terms, query: str):
+    for key in terms:
+        if key in query:
+            return key
+    return None
+
+
+def measure(func, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return percentile(samples, 50), percentile(samples, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--terms", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    vocabulary = make_vocabulary(args.terms, rng)
+    start = time.perf_counter()
+    index = TermIndex(vocabulary, {"hgb": vocabulary[0]})
+    print(f"built over {len(index)} terms in {time.perf_counter() - start:.2f}s")
+
+    sample = rng.sample(vocabulary, args.queries)
+    typos = [typo(term, rng) for term in sample]
+    prefixes = [term[:rng.randint(1, 5)] for term in sample]
+    legacy_terms = dict.fromkeys(vocabulary)
+
+    cases = [
+        ("complete (prefix)", index.complete, prefixes),
+        ("resolve (typo)", index.resolve, typos),
+        ("suggest (prefix)", index.suggest, prefixes),
+        ("suggest (typo)", index.suggest, typos),
+        ("legacy substring scan", lambda q: legacy_lookup(legacy_terms, q), typos[:50]),
+    ]
+    print(f"{'lookup':<24} {'p50 us':>9} {'p99 us':>9}")
+    for name, func, queries in cases:
+        p50, p99 = measure(func, queries)
+        print(f"{name:<24} {p50:>9.1f} {p99:>9.1f}")
+
+    recovered = sum(index.resolve(t) == term for t, term in zip(typos, sample))
+    print(f"typos resolved to the original term: {recovered / len(sample):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Peak memory and I/O per /api/analyze-report upload
+
+Posts large synthetic PDFs through the real endpoint with OCR stubbed
+out, comparing the original read-everything-then-write-/tmp handling
+with the staged upload path. Each mode runs in its own process so peak
+RSS is not shared between them.
+
+Usage: python benchmarks/bench_upload_path.py [--size-mb 20] [--requests 5]
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def proc_io() -> dict:
+    with open("/proc/self/io") as f:
+        return {key: int(value) for key, value in (line.split(": ") for line in f)}
+
+
+@asynccontextmanager
+async def legacy_staged_upload(file):
+    """The original handler: whole upload in memory, then a /tmp copy"""
+    temp_path = f"/tmp/{uuid.uuid4()}_{file.filename}"
+    content = await file.read()
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    yield temp_path
+    os.remove(temp_path)
+
+
+async def fake_analyze(source, report_type):
+    # Touch the whole source the way the OCR worker would
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            while f.read(1024 * 1024):
+                pass
+    return {"overall_status": "low", "summary": "", "flagged_values": [], "recommendations": []}
+
+
+async def run_mode(mode: str, size_mb: int, requests: int):
+    import httpx
+    import main
+
+    main.report_analyzer.analyze = fake_analyze
+    if mode == "legacy":
+        main.staged_upload = legacy_staged_upload
+
+    payload = b"%PDF-1.4\n" + os.urandom(size_mb * 1024 * 1024)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        before = proc_io()
+        start = time.perf_counter()
+        for i in range(requests):
+            response = await client.post(
+                "/api/analyze-report",
+                files={"file": (f"report{i}.pdf", payload, "application/pdf")}
+            )
+            response.raise_for_status()
+        elapsed = time.perf_counter() - start
+        after = proc_io()
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(
+        f"{mode:>7}: {elapsed / requests * 1000:8.1f} ms/req  "
+        f"peak RSS +{(peak_rss - baseline_rss) / 1024:7.1f} MB  "
+        f"written {(after['wchar'] - before['wchar']) / requests / 2**20:6.1f} MB/req  "
+        f"read {(after['rchar'] - before['rchar']) / requests / 2**20:6.1f} MB/req"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--mode", choices=["legacy", "staged"])
+    args = parser.parse_args()
+
+    if args.mode:
+        asyncio.run(run_mode(args.mode, args.size_mb, args.requests))
+        return
+
+    for mode in ("legacy", "staged"):
+        subprocess.run(
+            [sys.executable, __file__, "--mode", mode,
+             "--size-mb", str(args.size_mb), "--requests", str(args.requests)],
+            check=True
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Local stand-in for the OpenAI and Anthropic HTTP APIs
+
+Answers /v1/chat/completions and /v1/messages with canned replies shaped
+like the prompts LLMService sends, after an injectable delay, so the
+provider layer can be exercised without network access. Streamed
+requests get their reply word by word as server-sent events.
+
+Usage: STUB_LATENCY_MS=200 STUB_TOKEN_DELAY_MS=20 uvicorn benchmarks.llm_stub_server:app --port 9100
+"""
+
+import asyncio
+import json
+import os
+import random
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="LLM stub")
+
+LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", 200))
+FAILURE_RATE = float(os.getenv("STUB_FAILURE_RATE", 0))
+TOKEN_DELAY_MS = float(os.getenv("STUB_TOKEN_DELAY_MS", 20))
+STREAM_SEPARATOR = "---JSON---"
+
+SYMPTOM_REPLY = {
+    "message": "Thanks for describing your symptoms. This is not medical advice.",
+    "conditions": ["Tension headache", "Dehydration"],
+    "recommendations": ["Stay hydrated", "Rest in a quiet room"],
+    "follow_up_questions": ["How long have you had these symptoms?"],
+    "confidence": 0.6,
+}
+
+
+def reply_for(prompt: str) -> str:
+    if STREAM_SEPARATOR in prompt:
+        structured = {key: value for key, value in SYMPTOM_REPLY.items() if key != "message"}
+        return f"{SYMPTOM_REPLY['message']}\n{STREAM_SEPARATOR}\n{json.dumps(structured)}"
+    if "JSON array" in prompt:
+        return "[]"
+    if "JSON object" in prompt:
+        return json.dumps(SYMPTOM_REPLY)
+    return "This term describes a common lab measurement. Ask your doctor what it means for you."
+
+
+async def respond(request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY_MS / 1000)
+    if random.random() < FAILURE_RATE:
+        raise HTTPException(status_code=503, detail="stub failure")
+    return body, reply_for(body["messages"][-1]["content"])
+
+
+def stream_events(text: str, frame):
+    async def events():
+        for word in text.split(" "):
+            yield f"data: {json.dumps(frame(word + ' '))}\n\n"
+            await asyncio.sleep(TOKEN_DELAY_MS / 1000)
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat(request: Request):
+    body, text = await respond(request)
+    if body.get("stream"):
+        return stream_events(text, lambda chunk: {"choices": [{"index": 0, "delta": {"content": chunk}}]})
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]}
+
+
+@app.post("/v1/messages")
+async def anthropic_messages(request: Request):
+    body, text = await respond(request)
+    if body.get("stream"):
+        return stream_events(text, lambda chunk: {"type": "content_block_delta", "delta": {"type": "text_delta", "text": chunk}})
+    return {"content": [{"type": "text", "text": text}]}
@@ -6,35 +6,61 @@ FastAPI service for medical AI capabilities:
 - Drug interaction checking
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from enum import Enum
 from contextlib import asynccontextmanager
-import uuid
+from dataclasses import asdict
+import asyncio
+import hashlib
+import json
 import os
+import shutil
+import tempfile
 from loguru import logger
 
 from services.symptom_analyzer import SymptomAnalyzer
 from services.report_analyzer import ReportAnalyzer
 from services.llm_service import LLMService
+from services.ocr import OCRPoolSaturated
+from services.report_jobs import JobQueue, JobQueueFull, valid_callback_url
+from services.bulk_ingest import MERGED as INGEST_OUTPUT, IngestRuns
+from services.lab_history import LabHistory, trend
+from services.reference_ranges import Demographics
+from services.result_cache import ResultCache
+from services.keyword_matcher import KeywordMatcher
+from services.drug_interactions import InteractionIndex, MappedInteractionIndex
+from services.knowledge_base import KnowledgeBase, load_abbreviations, load_terms, normalize_term
+from services.term_index import TermIndex
+from services.log_writer import configure_logging
+from services.admission import AdmissionMiddleware, RouteClass
+from services.metrics import CONTENT_TYPE, REGISTRY, Family, MetricsExporter, MetricsMiddleware
+from services.report_analyzer import STAGE_SECONDS as REPORT_STAGE_SECONDS
 
-# Configure logging
-logger.remove()
-logger.add(
-    "logs/ai_service.log",
-    rotation="500 MB",
-    retention="10 days",
-    level="INFO"
-)
+# Configure logging; records are written as JSON lines off the event loop
+log_sink = configure_logging("logs/ai_service.log")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("MedVision AI Service starting up...")
+    await llm_service.start()
+    await metrics_exporter.start()
+    await report_jobs.start()
     yield
     logger.info("MedVision AI Service shutting down...")
+    await metrics_exporter.close()
+    await report_jobs.close()
+    report_analyzer.shutdown()
+    report_cache.close()
+    await llm_service.close()
+    if knowledge_base is not None:
+        knowledge_base.close()
+    if log_sink is not None:
+        await asyncio.to_thread(log_sink.close)
 
 app = FastAPI(
     title="MedVision AI Service",
@@ -43,6 +69,30 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Admission control per route class; innermost, so rejections still get
+# CORS headers and are counted by the metrics middleware. Symptom
+# messages naming an emergency skip the queue; the analyzer is looked up
+# when a request arrives
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+if ADMISSION_CONTROL:
+    app.add_middleware(
+        AdmissionMiddleware,
+        classes=[
+            RouteClass(
+                "triage", ["POST /api/diagnose", "POST /api/diagnose/stream"],
+                initial_limit=32, max_limit=512, max_queue=256, triage=True
+            ),
+            RouteClass("batch", ["POST /api/diagnose/batch"], initial_limit=4, max_limit=64, max_queue=32),
+            RouteClass(
+                "reports", ["POST /api/analyze-report", "POST /api/ingest"],
+                initial_limit=8, max_limit=64, max_queue=32, max_wait=30.0
+            ),
+            RouteClass("default", initial_limit=32, max_limit=512, max_queue=256),
+        ],
+        exempt=["/health", "/metrics"],
+        is_urgent=lambda text: symptom_analyzer.is_emergency(text)
+    )
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -52,10 +102,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route request counts and latency; outermost, so it times everything
+app.add_middleware(MetricsMiddleware)
+metrics_exporter = MetricsExporter()
+
+# Uploads up to this size are analyzed straight from memory; larger ones
+# are streamed in chunks to a temp file that is removed after analysis
+UPLOAD_MEMORY_LIMIT = int(os.getenv("UPLOAD_MEMORY_LIMIT", 8 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Largest accepted /api/diagnose/batch request, and how many of its LLM
+# calls may be in flight at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 8))
+
+# Compiled knowledge base, mapped read-only and shared by all workers
+# through the page cache; without one the JSON sources are loaded instead
+knowledge_base = KnowledgeBase.from_env()
+
 # Initialize services
 symptom_analyzer = SymptomAnalyzer()
 report_analyzer = ReportAnalyzer()
-llm_service = LLMService()
+terms = knowledge_base.table("terms") if knowledge_base else load_terms()
+# A compiled knowledge base carries the term index, read in place from the
+# shared mapping; from the JSON sources it is built on first lookup, or by
+# warm_up() in the pre-fork master
+term_index = (
+    TermIndex.from_knowledge_base(knowledge_base) if knowledge_base
+    else TermIndex(terms.keys(), load_abbreviations())
+)
+llm_service = LLMService(terms=terms, term_index=term_index)
+report_cache = ResultCache()
+# Background report analysis; the handler is looked up when a job runs
+report_jobs = JobQueue(lambda *job: _run_report_job(*job))
+# Bulk ingestion of report archives; directories are only accepted from
+# under INGEST_ROOT, and only when it is set
+ingest_runs = IngestRuns()
+# Lab values per user across reports, for trends in report responses
+lab_history = LabHistory()
+INGEST_ROOT = os.getenv("INGEST_ROOT")
+interaction_index = (
+    MappedInteractionIndex(knowledge_base) if knowledge_base
+    else InteractionIndex.load()
+)
+
+# One keyword automaton shared by the emergency gate, the rule-based
+# analyzer and the mock LLM responses; each message is scanned once
+keyword_matcher = KeywordMatcher({
+    **symptom_analyzer.keyword_sets(),
+    **llm_service.keyword_sets()
+})
+symptom_analyzer.matcher = keyword_matcher
+llm_service.matcher = keyword_matcher
 
 # Enums
 class SeverityLevel(str, Enum):
@@ -84,6 +182,17 @@ class DiagnosisResponse(BaseModel):
     follow_up_questions: Optional[List[str]] = None
     confidence: float
 
+class BatchSymptomRequest(BaseModel):
+    items: List[SymptomRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+
+class BatchDiagnosisItem(BaseModel):
+    index: int
+    result: Optional[DiagnosisResponse] = None
+    error: Optional[str] = None
+
+class BatchDiagnosisResponse(BaseModel):
+    results: List[BatchDiagnosisItem]
+
 class ReportAnalysisRequest(BaseModel):
     report_type: str = "general"
     user_id: Optional[str] = None
@@ -97,6 +206,14 @@ class FlaggedValue(BaseModel):
     explanation: str
     severity: SeverityLevel
 
+class LabTrend(BaseModel):
+    points: int
+    latest: float
+    delta: Optional[float] = None
+    slope_per_day: Optional[float] = None
+    out_of_range_fraction: float
+    out_of_range_slope_per_day: Optional[float] = None
+
 class ReportAnalysisResponse(BaseModel):
     status: str
     overall_status: SeverityLevel
@@ -105,6 +222,24 @@ class ReportAnalysisResponse(BaseModel):
     recommendations: List[str]
     raw_text: Optional[str] = None
     confidence: float
+    trends: Optional[Dict[str, LabTrend]] = None
+    # PDF pages (1-based) that could not be read when status is "partial"
+    failed_pages: Optional[List[int]] = None
+
+class LabHistoryResponse(BaseModel):
+    user_id: str
+    tests: Dict[str, Dict[str, Any]]
+
+class ReportJobResponse(BaseModel):
+    job_id: str
+    status: str  # queued, running, complete or failed
+    lane: str
+    result: Optional[ReportAnalysisResponse] = None
+    error: Optional[str] = None
+    callback_status: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 class DrugInteractionRequest(BaseModel):
     medications: List[str]
@@ -120,98 +255,263 @@ class DrugInteractionResponse(BaseModel):
 async def health_check():
     return {"status": "healthy", "service": "ai-service"}
 
+def _emergency_response() -> DiagnosisResponse:
+    return DiagnosisResponse(
+        message="⚠️ Based on your symptoms, I strongly recommend seeking immediate medical attention. Please call emergency services (911) or go to your nearest emergency room.",
+        diagnosis={
+            "severity": "emergency",
+            "conditions": ["Medical emergency suspected"],
+            "confidence": 0.95
+        },
+        recommendations=[
+            "Call 911 immediately",
+            "Do not drive yourself to the hospital",
+            "If conscious, stay calm and wait for emergency responders"
+        ],
+        follow_up_questions=None,
+        confidence=0.95
+    )
+
+def _combine_diagnosis(diagnosis: Dict, rule_based: Dict) -> DiagnosisResponse:
+    """Merge the LLM diagnosis with rule-based severity and advice"""
+    combined_recommendations = list(set(
+        diagnosis.get("recommendations", []) + 
+        rule_based.get("recommendations", [])
+    ))
+    
+    return DiagnosisResponse(
+        message=diagnosis.get("message", "I've analyzed your symptoms."),
+        diagnosis={
+            "severity": rule_based.get("severity", "unknown"),
+            "conditions": diagnosis.get("conditions", []),
+            "confidence": diagnosis.get("confidence", 0.5)
+        },
+        recommendations=combined_recommendations,
+        follow_up_questions=diagnosis.get("follow_up_questions"),
+        confidence=diagnosis.get("confidence", 0.5)
+    )
+
 @app.post("/api/diagnose", response_model=DiagnosisResponse)
 async def diagnose_symptoms(request: SymptomRequest):
     """
     Analyze symptoms and provide potential diagnoses
     """
-    logger.info(f"Received symptom analysis request: {request.message[:100]}...")
+    logger.info("Received symptom analysis request", message_prefix=request.message[:100])
     
     try:
-        # Check for emergency keywords
-        emergency_keywords = [
-            "chest pain", "difficulty breathing", "stroke", "heart attack",
-            "severe bleeding", "cant breathe", "can't breathe", "unconscious"
-        ]
-        
-        message_lower = request.message.lower()
-        is_emergency = any(kw in message_lower for kw in emergency_keywords)
+        hits = keyword_matcher.find_all(request.message)
         
-        if is_emergency:
-            return DiagnosisResponse(
-                message="⚠️ Based on your symptoms, I strongly recommend seeking immediate medical attention. Please call emergency services (911) or go to your nearest emergency room.",
-                diagnosis={
-                    "severity": "emergency",
-                    "conditions": ["Medical emergency suspected"],
-                    "confidence": 0.95
-                },
-                recommendations=[
-                    "Call 911 immediately",
-                    "Do not drive yourself to the hospital",
-                    "If conscious, stay calm and wait for emergency responders"
-                ],
-                follow_up_questions=None,
-                confidence=0.95
-            )
+        # Check for emergency keywords
+        if symptom_analyzer.is_emergency(request.message, hits):
+            return _emergency_response()
         
         # Use LLM for diagnosis
         diagnosis = await llm_service.analyze_symptoms(
             message=request.message,
             symptoms=request.symptoms,
-            medical_history=request.medical_history
+            medical_history=request.medical_history,
+            keyword_hits=hits
         )
         
         # Use rule-based analyzer for additional insights
-        rule_based = symptom_analyzer.analyze(request.message)
-        
-        # Combine results
-        combined_recommendations = list(set(
-            diagnosis.get("recommendations", []) + 
-            rule_based.get("recommendations", [])
-        ))
+        rule_based = symptom_analyzer.analyze(request.message, hits)
         
-        return DiagnosisResponse(
-            message=diagnosis.get("message", "I've analyzed your symptoms."),
-            diagnosis={
-                "severity": rule_based.get("severity", "unknown"),
-                "conditions": diagnosis.get("conditions", []),
-                "confidence": diagnosis.get("confidence", 0.5)
-            },
-            recommendations=combined_recommendations,
-            follow_up_questions=diagnosis.get("follow_up_questions"),
-            confidence=diagnosis.get("confidence", 0.5)
-        )
+        return _combine_diagnosis(diagnosis, rule_based)
         
     except Exception as e:
         logger.error(f"Diagnosis error: {str(e)}")
         raise HTTPException(status_code=500, detail="Diagnosis failed")
 
+@app.post("/api/diagnose/batch", response_model=BatchDiagnosisResponse)
+async def diagnose_symptoms_batch(request: BatchSymptomRequest):
+    """
+    Analyze many symptom messages in one request. Results come back in
+    request order; an item that fails carries an error instead of a result
+    """
+    logger.info("Received batch symptom analysis request", items=len(request.items))
+    
+    try:
+        messages = [item.message for item in request.items]
+        hits_list = [keyword_matcher.find_all(message) for message in messages]
+        rule_based = symptom_analyzer.analyze_batch(messages, hits_list)
+    except Exception as e:
+        logger.error(f"Batch diagnosis error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Diagnosis failed")
+    
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    
+    async def diagnose(index: int, item: SymptomRequest) -> BatchDiagnosisItem:
+        try:
+            if rule_based[index].get("is_emergency"):
+                return BatchDiagnosisItem(index=index, result=_emergency_response())
+            
+            async with semaphore:
+                diagnosis = await llm_service.analyze_symptoms(
+                    message=item.message,
+                    symptoms=item.symptoms,
+                    medical_history=item.medical_history,
+                    keyword_hits=hits_list[index]
+                )
+            return BatchDiagnosisItem(index=index, result=_combine_diagnosis(diagnosis, rule_based[index]))
+        
+        except Exception as e:
+            logger.error(f"Batch diagnosis error for item {index}: {str(e)}")
+            return BatchDiagnosisItem(index=index, error="Diagnosis failed")
+    
+    results = await asyncio.gather(*(diagnose(i, item) for i, item in enumerate(request.items)))
+    return BatchDiagnosisResponse(results=results)
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/diagnose/stream")
+async def diagnose_symptoms_stream(request: SymptomRequest):
+    """
+    Stream a diagnosis as Server-Sent Events: a `severity` event from the
+    rule-based analyzer right away, `token` events as the LLM writes its
+    reply, then a `result` event shaped like DiagnosisResponse
+    """
+    logger.info("Received streaming symptom analysis request", message_prefix=request.message[:100])
+    
+    async def events():
+        try:
+            hits = keyword_matcher.find_all(request.message)
+            if symptom_analyzer.is_emergency(request.message, hits):
+                yield _sse("severity", {"severity": "emergency", "is_emergency": True})
+                yield _sse("result", _emergency_response().model_dump())
+                return
+            
+            rule_based = symptom_analyzer.analyze(request.message, hits)
+            yield _sse("severity", {
+                "severity": rule_based.get("severity", "unknown"),
+                "is_emergency": rule_based.get("is_emergency", False)
+            })
+            
+            async for event in llm_service.stream_symptoms(
+                message=request.message,
+                symptoms=request.symptoms,
+                medical_history=request.medical_history,
+                keyword_hits=hits
+            ):
+                if "token" in event:
+                    yield _sse("token", {"text": event["token"]})
+                else:
+                    yield _sse("result", _combine_diagnosis(event["result"], rule_based).model_dump())
+        
+        except Exception as e:
+            logger.error(f"Streaming diagnosis error: {str(e)}")
+            yield _sse("error", {"detail": "Diagnosis failed"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/analyze-report", response_model=ReportAnalysisResponse)
 async def analyze_medical_report(
     file: UploadFile = File(...),
-    report_type: str = "general"
+    report_type: str = "general",
+    background: bool = False,
+    callback_url: Optional[str] = None,
+    user_id: Optional[str] = None,
+    sex: Optional[str] = None,
+    age: Optional[float] = Query(None, ge=0, le=130),
+    pregnant: bool = False
 ):
     """
     Analyze uploaded medical report (PDF, image, etc.)
+    
+    With `background=true` or a `callback_url` the report is queued and a
+    job is returned right away; poll GET /api/analyze-report/{job_id} or
+    wait for the finished job to be POSTed to the callback URL
+    
+    With a `user_id` the report's values are added to that user's lab
+    history and the response includes trends over the whole history
+    
+    Values are classified against reference ranges for the patient's
+    `sex`, `age` and `pregnant` when given
     """
-    logger.info(f"Received report analysis request: {file.filename}")
+    logger.info("Received report analysis request", filename=file.filename)
+    
+    if callback_url and not await run_in_threadpool(valid_callback_url, callback_url):
+        raise HTTPException(status_code=422, detail="callback_url must be an http(s) URL on a public or allowed host")
+    
+    # Identical uploads are served from the cache without re-analysis
+    with REPORT_STAGE_SECONDS.labels("hash").time():
+        digest = await run_in_threadpool(_sha256, file.file)
+        await file.seek(0)
+    background = background or bool(callback_url)
+    demographics = Demographics(sex, age, pregnant)
+    with REPORT_STAGE_SECONDS.labels("cache_lookup").time():
+        cached, values = await run_in_threadpool(
+            _cached_report, _report_cache_key(digest, report_type, demographics), bool(user_id)
+        )
+    if cached is not None and user_id:
+        cached = await run_in_threadpool(_with_trends, cached, values, user_id, digest, demographics)
+    
+    if background:
+        options = {"user_id": user_id, **asdict(demographics)}
+        return await _submit_report_job(file, report_type, digest, cached, callback_url, options)
+    
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
+    # Reject before staging the upload when OCR capacity is exhausted
+    if report_analyzer.ocr_pool.saturated:
+        raise _ocr_unavailable(report_analyzer.ocr_pool.retry_after)
     
     try:
-        # Save file temporarily
-        temp_path = f"/tmp/{uuid.uuid4()}_{file.filename}"
-        content = await file.read()
-        
-        with open(temp_path, "wb") as f:
-            f.write(content)
-        
-        # Analyze report
-        analysis = await report_analyzer.analyze(temp_path, report_type)
+        async with staged_upload(file) as source:
+            body, values = await _analyze_report(source, report_type, digest, demographics)
+        if user_id:
+            body = await run_in_threadpool(_with_trends, body, values, user_id, digest, demographics)
+        return Response(content=body, media_type="application/json")
         
-        # Clean up
-        os.remove(temp_path)
-        
-        return ReportAnalysisResponse(
-            status="complete",
+    except OCRPoolSaturated as e:
+        raise _ocr_unavailable(e.retry_after)
+    except Exception as e:
+        logger.error(f"Report analysis error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Report analysis failed")
+
+@app.get("/api/analyze-report/{job_id}", response_model=ReportJobResponse)
+async def get_report_job(job_id: str):
+    """
+    State of a background report analysis, with its result once complete
+    """
+    job = await report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown report job")
+    return _job_response(job)
+
+def _report_cache_key(digest: str, report_type: str, demographics: Demographics) -> str:
+    return f"{digest}:{report_type}:{demographics.key}:{ReportAnalyzer.VERSION}"
+
+def _cached_report(key: str, with_values: bool) -> Tuple[Optional[bytes], Optional[Dict[str, float]]]:
+    """A cached response body and, if asked for, its unformatted lab values;
+    a body whose values were evicted counts as a miss"""
+    body = report_cache.get(key)
+    if body is None or not with_values:
+        return body, None
+    values = report_cache.get(f"{key}:values")
+    if values is None:
+        return None, None
+    return body, json.loads(values)
+
+async def _analyze_report(
+    source,
+    report_type: str,
+    digest: str,
+    demographics: Optional[Demographics] = None
+) -> Tuple[bytes, Dict[str, float]]:
+    """Analyze a staged report; cache and return the serialized response
+    and the lab values it shows, unformatted"""
+    demographics = demographics or Demographics()
+    analysis = await report_analyzer.analyze(source, report_type, digest, demographics)
+    
+    with REPORT_STAGE_SECONDS.labels("serialize").time():
+        response = ReportAnalysisResponse(
+            status=analysis.get("status", "complete"),
             overall_status=analysis.get("overall_status", "unknown"),
             summary=analysis.get("summary", ""),
             flagged_values=[
@@ -228,25 +528,223 @@ async def analyze_medical_report(
             ],
             recommendations=analysis.get("recommendations", []),
             raw_text=analysis.get("raw_text"),
-            confidence=analysis.get("confidence", 0.8)
+            confidence=analysis.get("confidence", 0.8),
+            failed_pages=analysis.get("failed_pages")
         )
         
-    except Exception as e:
-        logger.error(f"Report analysis error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Report analysis failed")
+        body = response.model_dump_json().encode()
+    values = analysis.get("values", {})
+    # Partial results may come from a transient OCR failure; not cached,
+    # so the next upload tries the failed pages again
+    if not analysis.get("failed_pages"):
+        key = _report_cache_key(digest, report_type, demographics)
+        await run_in_threadpool(report_cache.put, key, body)
+        await run_in_threadpool(report_cache.put, f"{key}:values", json.dumps(values).encode())
+    return body, values
+
+async def _run_report_job(path: str, report_type: str, digest: str, options: Dict) -> bytes:
+    """Background job handler; options carry the submitter's user_id and demographics"""
+    demographics = Demographics(options.get("sex"), options.get("age"), options.get("pregnant", False))
+    body, values = await _analyze_report(path, report_type, digest, demographics)
+    if options.get("user_id"):
+        body = await run_in_threadpool(_with_trends, body, values, options["user_id"], digest, demographics)
+    return body
+
+def _with_trends(
+    body: bytes,
+    values: Dict[str, float],
+    user_id: str,
+    digest: str,
+    demographics: Demographics
+) -> bytes:
+    """Record a report's values for a user and add the user's trends
+    
+    The cached body is shared by every user who uploads the same report,
+    so trends are added to a copy
+    """
+    result = json.loads(body)
+    with REPORT_STAGE_SECONDS.labels("history").time():
+        lab_history.record(user_id, digest, values)
+        result["trends"] = lab_history.trends(user_id, ReportAnalyzer.ranges.ranges(demographics))
+    return json.dumps(result).encode()
+
+@app.get("/api/lab-history/{user_id}", response_model=LabHistoryResponse)
+async def get_lab_history(
+    user_id: str,
+    sex: Optional[str] = None,
+    age: Optional[float] = Query(None, ge=0, le=130),
+    pregnant: bool = False
+):
+    """
+    Every recorded value of each test for a user, with its trend against
+    the reference ranges for `sex`, `age` and `pregnant`
+    """
+    ranges = ReportAnalyzer.ranges.ranges(Demographics(sex, age, pregnant))
+    history = await run_in_threadpool(lab_history.history, user_id)
+    if not history:
+        raise HTTPException(status_code=404, detail="No lab history for this user")
+    return LabHistoryResponse(
+        user_id=user_id,
+        tests={
+            test: {
+                "times": points["time"].tolist(),
+                "values": points["value"].tolist(),
+                "trend": trend(points["time"], points["value"], *ranges[test]),
+            }
+            for test, points in history.items()
+            if test in ranges and len(points)
+        }
+    )
+
+async def _submit_report_job(
+    file: UploadFile,
+    report_type: str,
+    digest: str,
+    cached: Optional[bytes],
+    callback_url: Optional[str],
+    options: Dict
+) -> JSONResponse:
+    if cached is not None:
+        job = await report_jobs.add_finished(report_type, digest, cached, callback_url)
+    else:
+        try:
+            job = await report_jobs.submit(file.file, file.size or 0, report_type, digest, callback_url, options)
+        except JobQueueFull as e:
+            logger.warning("Report job rejected: queue full")
+            raise HTTPException(
+                status_code=503,
+                detail="Report analysis queue is full, please retry later",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+    
+    logger.info("Queued report analysis job", job_id=job["job_id"], lane=job["lane"])
+    return JSONResponse(
+        status_code=200 if job["status"] == "complete" else 202,
+        content=_job_response(job).model_dump(mode="json"),
+        headers={"Location": f"/api/analyze-report/{job['job_id']}"}
+    )
+
+def _job_response(job: Dict) -> ReportJobResponse:
+    result = job["result"]
+    return ReportJobResponse(
+        **{**job, "result": ReportAnalysisResponse.model_validate_json(result) if result else None}
+    )
+
+@asynccontextmanager
+async def staged_upload(file: UploadFile):
+    """Yield an upload as bytes if small, otherwise as a temp file path"""
+    if file.size is not None and file.size <= UPLOAD_MEMORY_LIMIT:
+        with REPORT_STAGE_SECONDS.labels("upload_read").time():
+            data = await file.read()
+        yield data
+        return
+    
+    suffix = os.path.splitext(file.filename or "")[1]
+    # Deleted on close, so the file is cleaned up even if analysis fails
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        with REPORT_STAGE_SECONDS.labels("upload_spool").time():
+            await run_in_threadpool(shutil.copyfileobj, file.file, tmp, UPLOAD_CHUNK_SIZE)
+            await run_in_threadpool(tmp.flush)
+        yield tmp.name
+
+def _sha256(fileobj) -> str:
+    return hashlib.file_digest(fileobj, "sha256").hexdigest()
+
+def _ocr_unavailable(retry_after: int) -> HTTPException:
+    logger.warning("Report analysis rejected: OCR pool saturated")
+    return HTTPException(
+        status_code=503,
+        detail="Report analysis is at capacity, please retry shortly",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+@app.post("/api/ingest", status_code=202)
+async def ingest_reports(file: Optional[UploadFile] = File(None), path: Optional[str] = None):
+    """
+    Ingest an archive of lab reports, a zip upload or a directory under
+    INGEST_ROOT, into a columnar .npz with one row per (report, test).
+    Runs in the background; submitting the same archive again resumes an
+    interrupted run
+    """
+    if ingest_runs.busy:
+        raise HTTPException(status_code=409, detail="Another ingestion run is in progress")
+    
+    if file is not None:
+        digest = await run_in_threadpool(_sha256, file.file)
+        run_id = digest[:16]
+        run = ingest_runs.get(run_id)
+        if run is not None and run["status"] == "complete":
+            # Nothing to do, so the upload is not staged; a copy of the
+            # patient data must not outlive the run
+            return run
+        source = os.path.join(ingest_runs.directory, f"{run_id}.zip")
+        if not os.path.exists(source):
+            await file.seek(0)
+            os.makedirs(ingest_runs.directory, exist_ok=True)
+            with open(f"{source}.tmp", "wb") as out:
+                await run_in_threadpool(shutil.copyfileobj, file.file, out, UPLOAD_CHUNK_SIZE)
+            os.replace(f"{source}.tmp", source)
+        remove_source = True
+    elif path is not None:
+        if not INGEST_ROOT:
+            raise HTTPException(status_code=400, detail="Directory ingestion is not enabled")
+        root = os.path.realpath(INGEST_ROOT)
+        source = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, source]) != root or not os.path.isdir(source):
+            raise HTTPException(status_code=400, detail="path must be a directory under INGEST_ROOT")
+        run_id = hashlib.sha256(source.encode()).hexdigest()[:16]
+        remove_source = False
+    else:
+        raise HTTPException(status_code=422, detail="Upload a zip file or give a directory path")
+    
+    logger.info("Starting ingestion run", run_id=run_id)
+    return ingest_runs.start(run_id, source, remove_source)
+
+@app.get("/api/ingest/{run_id}")
+async def get_ingest_run(run_id: str):
+    """
+    Progress of an ingestion run: reports done, failures and reports/sec
+    """
+    run = ingest_runs.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion run")
+    return run
+
+@app.get("/api/ingest/{run_id}/output")
+async def get_ingest_output(run_id: str):
+    """
+    The merged .npz of a completed ingestion run
+    """
+    run = ingest_runs.get(run_id)
+    if run is None or run["status"] != "complete":
+        raise HTTPException(status_code=404, detail="No completed ingestion run with this id")
+    return FileResponse(
+        os.path.join(ingest_runs.output_dir(run_id), INGEST_OUTPUT),
+        media_type="application/octet-stream",
+        filename=f"lab_values-{run_id}.npz"
+    )
 
 @app.post("/api/drug-interactions", response_model=DrugInteractionResponse)
 async def check_drug_interactions(request: DrugInteractionRequest):
     """
     Check for drug interactions
     """
-    logger.info(f"Checking drug interactions for: {request.medications}")
+    logger.info("Checking drug interactions", medications=request.medications)
     
     try:
-        # Use LLM to check interactions
-        interactions = await llm_service.check_drug_interactions(request.medications)
+        # Known pairs come from the interaction index; the LLM is only asked
+        # about pairs involving medications the index does not know
+        report = interaction_index.check(request.medications)
+        interactions = report.interactions
+        if report.unknown and len(request.medications) > 1:
+            interactions += await llm_service.check_drug_interactions(
+                request.medications, unknown=report.unknown
+            )
         
-        warnings = [i for i in interactions if i.get("severity") == "high"]
+        warnings = [
+            f"{' + '.join(map(str, i.get('medications', [])))}: {i.get('description', '')}"
+            for i in interactions if i.get("severity") == "high"
+        ]
         
         return DrugInteractionResponse(
             has_interactions=len(interactions) > 0,
@@ -258,6 +756,74 @@ async def check_drug_interactions(request: DrugInteractionRequest):
         logger.error(f"Drug interaction check error: {str(e)}")
         raise HTTPException(status_code=500, detail="Drug interaction check failed")
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Hit, miss and eviction counters for the result caches"""
+    return {
+        "reports": report_cache.stats(),
+        "llm": llm_service.cache_stats(),
+        "llm_single_flight": llm_service.single_flight.stats() if llm_service.single_flight else None
+    }
+
+@app.get("/api/terms/suggest")
+async def suggest_terms(q: str, limit: int = 10):
+    """
+    Autocomplete medical terms, tolerating typos and abbreviations
+    """
+    matches = term_index.suggest(normalize_term(q), max(1, min(limit, 50)))
+    return {
+        "query": q,
+        "suggestions": [
+            {"term": m.term, "match": m.match, "distance": m.distance}
+            for m in matches
+        ]
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics, merged across workers when METRICS_DIR is set"""
+    # Collected on the loop, where metrics change; snapshot files are
+    # read and written in a thread
+    families = metrics_exporter.registry.collect()
+    content = await run_in_threadpool(metrics_exporter.render, families)
+    return Response(content=content, media_type=CONTENT_TYPE)
+
+def _service_stats():
+    """Cache and pool state, read at scrape time"""
+    reports = report_cache.stats()
+    yield Family("report_cache_hits_total", "counter", "Report cache hits by tier", ("tier",), {
+        ("memory",): reports["memory_hits"], ("disk",): reports["disk_hits"]
+    })
+    yield Family("report_cache_misses_total", "counter", "Report cache misses", (), {(): reports["misses"]})
+    yield Family("report_cache_evictions_total", "counter", "Report cache evictions by tier", ("tier",), {
+        ("memory",): reports["memory_evictions"], ("disk",): reports["disk_evictions"]
+    })
+    yield Family("report_cache_bytes", "gauge", "Bytes held by the report cache", ("tier",), {
+        ("memory",): reports["memory_bytes"], ("disk",): reports["disk_bytes"]
+    })
+    
+    llm = llm_service.cache_stats()
+    yield Family("llm_cache_hits_total", "counter", "LLM response cache hits", ("endpoint", "kind"), {
+        (endpoint, kind): stats[f"{kind}_hits"] for endpoint, stats in llm.items() for kind in ("exact", "similar")
+    })
+    yield Family("llm_cache_misses_total", "counter", "LLM response cache misses", ("endpoint",), {
+        (endpoint,): stats["misses"] for endpoint, stats in llm.items()
+    })
+    yield Family("llm_cache_entries", "gauge", "Entries in the LLM response cache", ("endpoint",), {
+        (endpoint,): stats["entries"] for endpoint, stats in llm.items()
+    })
+    
+    pool = report_analyzer.ocr_pool
+    yield Family("ocr_pool_in_flight", "gauge", "OCR jobs running or queued", (), {(): pool.in_flight})
+    yield Family("ocr_pool_capacity", "gauge", "OCR jobs accepted before rejecting", (), {(): pool.capacity})
+    
+    providers = llm_service.providers.stats()
+    yield Family("llm_provider_cooling_down", "gauge", "1 while a provider is skipped after failures", ("provider",), {
+        (p["name"],): int(p["cooling_down"]) for p in providers
+    })
+
+REGISTRY.register_collector(_service_stats)
+
 @app.post("/api/explain-medical-terms")
 async def explain_medical_term(term: str, context: Optional[str] = None):
     """
@@ -270,6 +836,35 @@ async def explain_medical_term(term: str, context: Optional[str] = None):
         logger.error(f"Medical term explanation error: {str(e)}")
         raise HTTPException(status_code=500, detail="Explanation failed")
 
+# Hooks for pre-fork serving (services/prefork.py): the master imports
+# this module, warms it and forks workers that share its state
+def warm_up():
+    """Build what would otherwise be built on first use in every worker"""
+    app.openapi()
+    # Starlette builds the middleware stack on the first request
+    app.middleware_stack = app.build_middleware_stack()
+    message = "Headache and fever since yesterday, some chest pain"
+    hits = keyword_matcher.find_all(message)
+    symptom_analyzer.analyze(message, hits)
+    symptom_analyzer.analyze_batch([message], [hits])
+    ReportAnalyzer.extract_values("Hemoglobin: 13.5 g/dL\nGlucose: 95 mg/dL")
+    term_index.build()
+    term_index.suggest(normalize_term("hypertention"))
+    interaction_index.check(["warfarin", "aspirin"])
+
+def before_fork():
+    """Release what forked workers must not share; the master serves nothing"""
+    report_cache.close()
+
+def init_worker():
+    """Per-process resources of a forked worker: the log writer thread
+    and the report cache's sqlite connection do not survive fork"""
+    global log_sink, report_cache
+    log_sink = configure_logging("logs/ai_service.log")
+    report_cache = ResultCache()
+
 if __name__ == "__main__":
+    # One process; `python -m services.prefork --workers N` serves with
+    # N workers forked from one warmed master
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,380 @@
+"""
+Admission control for the HTTP API
+Each route class has a concurrency limit that adapts to observed latency
+and a bounded queue; emergency triage requests go to the front, and what
+cannot be served soon is turned away before its body is read
+"""
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import json
+import math
+import time
+
+from services import metrics
+
+ADMISSION_LIMIT = metrics.gauge(
+    "admission_limit", "Adaptive concurrency limit by route class", ("route_class",)
+)
+ADMISSION_QUEUED = metrics.gauge(
+    "admission_queued", "Requests waiting for admission by route class", ("route_class",)
+)
+ADMISSION_WAIT = metrics.histogram(
+    "admission_wait_seconds", "Time requests waited for admission", ("route_class", "priority")
+)
+ADMISSION_REJECTED = metrics.counter(
+    "admission_rejected_total", "Requests turned away by admission control", ("route_class", "status")
+)
+
+
+class Shed(Exception):
+    """A request turned away, with the status and Retry-After (0 for none) to send"""
+
+    def __init__(self, status: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class GradientLimit:
+    """Concurrency limit following the ratio of baseline to current latency
+
+    The baseline is the lowest latency seen over the last ``window``
+    seconds. While latency stays within ``tolerance`` times the baseline
+    the limit grows by about its square root per sample; past that it
+    shrinks in proportion, by at most half. Updates are smoothed, so one
+    slow request moves the limit only a little, and the limit only grows
+    while at least half of it is in use.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        tolerance: float = 2.0,
+        smoothing: float = 0.2,
+        window: float = 30.0
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.window = window
+        self._baseline = math.inf
+        self._window_min = math.inf
+        self._window_start = time.monotonic()
+
+    @property
+    def value(self) -> int:
+        return int(self.limit)
+
+    def update(self, latency: float, in_flight: int):
+        now = time.monotonic()
+        if now - self._window_start >= self.window:
+            self._baseline, self._window_min, self._window_start = self._window_min, latency, now
+        else:
+            self._window_min = min(self._window_min, latency)
+        baseline = min(self._baseline, self._window_min)
+
+        gradient = max(0.5, min(1.0, self.tolerance * baseline / max(latency, 1e-9)))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        if target > self.limit and in_flight * 2 < self.limit:
+            return
+        limit = (1 - self.smoothing) * self.limit + self.smoothing * target
+        self.limit = min(float(self.maximum), max(float(self.minimum), limit))
+
+
+@dataclass
+class RouteClass:
+    """Routes sharing one limit and queue
+
+    ``routes`` are ``"METHOD /path"`` strings matched exactly; a class
+    without routes takes every request no other class matches. Requests
+    in a ``triage`` class whose body mentions an emergency go ahead of
+    the rest and may use ``urgent_headroom`` slots beyond the limit.
+    """
+    name: str
+    routes: Sequence[str] = ()
+    initial_limit: int = 16
+    min_limit: int = 1
+    max_limit: int = 256
+    max_queue: int = 64
+    max_wait: float = 10.0
+    triage: bool = False
+    urgent_headroom: int = 16
+
+
+class _Lane:
+    """Admission state of one route class"""
+
+    def __init__(self, route_class: RouteClass):
+        self.route_class = route_class
+        self.name = route_class.name
+        self.limit = GradientLimit(route_class.initial_limit, route_class.min_limit, route_class.max_limit)
+        self.in_flight = 0
+        self.urgent: Deque[asyncio.Future] = deque()
+        self.waiting: Deque[asyncio.Future] = deque()
+        # Triage requests holding a place in the urgent queue while their
+        # body is read, because the normal queue is full
+        self.classifying = 0
+        # Smoothed service time, for Retry-After estimates
+        self.latency = 1.0
+        ADMISSION_LIMIT.labels(self.name).set(self.limit.value)
+
+    @property
+    def has_room(self) -> bool:
+        return self.in_flight < self.limit.value and not self.urgent and not self.waiting
+
+    def retry_after(self) -> int:
+        queued = len(self.urgent) + len(self.waiting) + 1
+        return min(60, max(1, math.ceil(queued * self.latency / max(self.limit.value, 1))))
+
+    async def acquire(self, urgent: bool):
+        start = time.perf_counter()
+        waiter = self.enqueue(urgent)
+        if waiter is not None:
+            await self.wait(waiter, urgent, start)
+
+    def enqueue(self, urgent: bool) -> Optional[asyncio.Future]:
+        """Take a slot (None) or a place in the queue: a future set once admitted
+
+        Raises Shed when the queue is full.
+        """
+        if urgent:
+            if self.in_flight < self.limit.value + self.route_class.urgent_headroom and not self.urgent:
+                self.in_flight += 1
+                return None
+            queue = self.urgent
+        else:
+            if self.has_room:
+                self.in_flight += 1
+                return None
+            queue = self.waiting
+        if len(queue) >= self.route_class.max_queue:
+            raise Shed(429, self.retry_after(), "Server busy, request not queued")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        ADMISSION_QUEUED.labels(self.name).inc()
+        return waiter
+
+    def promote(self, waiter: asyncio.Future):
+        """Move a queued request ahead of the others, admitting it now if the headroom allows"""
+        if waiter.done() or waiter not in self.waiting:
+            return
+        self.waiting.remove(waiter)
+        if self.in_flight < self.limit.value + self.route_class.urgent_headroom and not self.urgent:
+            self.in_flight += 1
+            waiter.set_result(None)
+        else:
+            self.urgent.append(waiter)
+
+    async def wait(self, waiter: asyncio.Future, urgent: bool, start: float):
+        """Wait for a queued request's slot, at most max_wait since ``start``"""
+        timeout = max(self.route_class.max_wait - (time.perf_counter() - start), 0.0)
+        try:
+            done, _ = await asyncio.wait((waiter,), timeout=timeout)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        finally:
+            ADMISSION_QUEUED.labels(self.name).dec()
+            ADMISSION_WAIT.labels(self.name, "urgent" if urgent else "normal").observe(time.perf_counter() - start)
+        if not done:
+            self._abandon(waiter)
+            raise Shed(503, self.retry_after(), "Server busy, timed out waiting in queue")
+
+    def abandon(self, waiter: asyncio.Future):
+        """Give up a place in the queue before waiting on it"""
+        ADMISSION_QUEUED.labels(self.name).dec()
+        self._abandon(waiter)
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done():
+            # Admitted just as the wait ended; pass the slot on
+            self.release()
+            return
+        waiter.cancel()
+        for queue in (self.urgent, self.waiting):
+            if waiter in queue:
+                queue.remove(waiter)
+
+    def release(self, latency: Optional[float] = None):
+        if latency is not None:
+            self.latency = 0.9 * self.latency + 0.1 * latency
+            self.limit.update(latency, self.in_flight)
+            ADMISSION_LIMIT.labels(self.name).set(self.limit.value)
+        self.in_flight -= 1
+        while self.urgent and self.in_flight < self.limit.value + self.route_class.urgent_headroom:
+            self.in_flight += 1
+            self.urgent.popleft().set_result(None)
+        while self.waiting and self.in_flight < self.limit.value:
+            self.in_flight += 1
+            self.waiting.popleft().set_result(None)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting requests per route class
+
+    A request that cannot be admitted right away is queued; one arriving
+    at a full queue gets 429 and one that waits longer than its class's
+    ``max_wait`` gets 503, both with Retry-After and without the request
+    body being read. In triage classes the body of a request that holds
+    a place in a queue is read, up to ``triage_body_limit`` bytes, and
+    matched with ``is_urgent`` so emergencies can go first; a malformed
+    Content-Length there gets 400. Latency samples for the
+    adaptive limits are taken at the start of each successful response,
+    after admission, from requests that are not urgent.
+    """
+
+    def __init__(
+        self,
+        app,
+        classes: Sequence[RouteClass],
+        exempt: Sequence[str] = (),
+        is_urgent: Optional[Callable[[str], bool]] = None,
+        triage_body_limit: int = 16384
+    ):
+        self.app = app
+        self.lanes = [_Lane(route_class) for route_class in classes]
+        self.routes: Dict[Tuple[str, str], _Lane] = {}
+        for lane in self.lanes:
+            for route in lane.route_class.routes:
+                method, path = route.split(" ", 1)
+                self.routes[(method, path)] = lane
+        self.default = next((lane for lane in self.lanes if not lane.route_class.routes), None)
+        self.exempt = set(exempt)
+        self.is_urgent = is_urgent
+        self.triage_body_limit = triage_body_limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt:
+            await self.app(scope, receive, send)
+            return
+        lane = self.routes.get((scope["method"], scope["path"]), self.default)
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+
+        urgent = False
+        try:
+            if lane.route_class.triage and self.is_urgent is not None:
+                urgent, receive = await self._acquire_triage(lane, scope, receive)
+            else:
+                await lane.acquire(False)
+        except Shed as e:
+            ADMISSION_REJECTED.labels(lane.name, str(e.status)).inc()
+            await _reject(send, e)
+            return
+
+        started: Optional[float] = None
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal started, status
+            if message["type"] == "http.response.start":
+                started = time.perf_counter()
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampled = started is not None and status < 400 and not urgent
+            lane.release(started - start if sampled else None)
+
+    async def _acquire_triage(self, lane: _Lane, scope, receive) -> Tuple[bool, Callable]:
+        """Admit a triage request, reading its body to spot emergencies only if it must wait
+
+        A body is read only by a request that already holds a place in a
+        queue, so the bodies in memory are bounded by the queue sizes
+        and a request turned away at full queues is never read.
+        Normally that is a place in the normal queue, given up for an
+        urgent one if the body names an emergency. When the normal
+        queue is full, the place is reserved in the urgent queue, and
+        the request is shed if it turns out not to be urgent.
+        """
+        length = _content_length(scope)
+        start = time.perf_counter()
+        if len(lane.waiting) < lane.route_class.max_queue:
+            waiter = lane.enqueue(False)
+            if waiter is None:
+                return False, receive
+            try:
+                urgent, receive = await self._classify(scope, receive, length)
+            except BaseException:
+                lane.abandon(waiter)
+                raise
+            if urgent:
+                lane.promote(waiter)
+            await lane.wait(waiter, urgent, start)
+            return urgent, receive
+
+        if len(lane.urgent) + lane.classifying >= lane.route_class.max_queue:
+            raise Shed(429, lane.retry_after(), "Server busy, request not queued")
+        lane.classifying += 1
+        try:
+            urgent, receive = await self._classify(scope, receive, length)
+        finally:
+            lane.classifying -= 1
+        if not urgent:
+            raise Shed(429, lane.retry_after(), "Server busy, request not queued")
+        await lane.acquire(True)
+        return True, receive
+
+    async def _classify(self, scope, receive, length: Optional[int]) -> Tuple[bool, Callable]:
+        body, receive = await self._peek_body(receive, length)
+        urgent = body is not None and self.is_urgent(body.decode("utf-8", errors="replace"))
+        return urgent, receive
+
+    async def _peek_body(self, receive, length: Optional[int]) -> Tuple[Optional[bytes], Callable]:
+        """Read a small body ahead of the app and hand it back a receive that replays it"""
+        if length is not None and length > self.triage_body_limit:
+            return None, receive
+
+        messages: List[Dict] = []
+        size = 0
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            size += len(message.get("body", b""))
+            if not message.get("more_body") or size > self.triage_body_limit:
+                break
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        return b"".join(m.get("body", b"") for m in messages), replay
+
+
+def _content_length(scope) -> Optional[int]:
+    """The request's Content-Length, if given; Shed with 400 when malformed"""
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            try:
+                length = int(value)
+            except ValueError:
+                length = -1
+            if length < 0:
+                raise Shed(400, 0, "Invalid Content-Length header")
+            return length
+    return None
+
+
+async def _reject(send, shed: Shed):
+    body = json.dumps({"detail": shed.detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if shed.retry_after:
+        headers.append((b"retry-after", str(shed.retry_after).encode()))
+    await send({"type": "http.response.start", "status": shed.status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
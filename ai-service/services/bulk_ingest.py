@@ -0,0 +1,427 @@
+"""
+Bulk ingestion of archived lab reports
+Streams a zip or directory of reports through OCR and value extraction on
+every core and writes one row per (report, test) to NumPy .npz shards,
+checkpointed so an interrupted run resumes where it stopped
+
+    python -m services.bulk_ingest reports.zip --output ingest/clinic-a
+"""
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+from loguru import logger
+
+from services.ocr import (
+    OCRError, has_text_layer, init_worker, is_pdf, ocr_binary, ocr_file, pdf_text_layer_sync,
+    preprocess, rasterize_pdf_page
+)
+from services.reference_ranges import SEVERITIES, STATUSES
+from services.report_analyzer import ReportAnalyzer
+
+REPORT_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
+# Test codes in the output are indexes into this tuple
+TESTS = tuple(ReportAnalyzer.LAB_PATTERNS)
+UNITS = tuple(ReportAnalyzer.LAB_PATTERNS[test]["unit"] for test in TESTS)
+STATUS_CODES = {status: code for code, status in STATUSES.items()}
+CHECKPOINT = "checkpoint.jsonl"
+MERGED = "lab_values.npz"
+
+
+@dataclass
+class Item:
+    """One report in an archive: a file, or a member of the zip at ``path``"""
+    name: str
+    path: str
+    member: Optional[str] = None
+
+
+@dataclass
+class ReportResult:
+    name: str
+    digest: str = ""
+    # (test code, value, status code, severity code) per recognized test
+    values: List[Tuple[int, float, int, int]] = field(default_factory=list)
+    error: str = ""
+
+
+def iter_archive(source: str) -> Iterator[Item]:
+    """Reports in a zip file or directory tree, in a stable order
+
+    Only names are listed up front; contents are read by the workers.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in REPORT_EXTENSIONS:
+                    path = os.path.join(root, name)
+                    yield Item(os.path.relpath(path, source), path)
+        return
+
+    with zipfile.ZipFile(source) as archive:
+        members = [
+            info.filename for info in archive.infolist()
+            if not info.is_dir() and os.path.splitext(info.filename)[1].lower() in REPORT_EXTENSIONS
+        ]
+    for member in members:
+        yield Item(member, source, member)
+
+
+# Zip files opened by this worker process, by path
+_archives: Dict[str, zipfile.ZipFile] = {}
+
+
+def _read(item: Item) -> bytes:
+    if item.member is None:
+        with open(item.path, "rb") as f:
+            return f.read()
+    archive = _archives.get(item.path)
+    if archive is None:
+        archive = _archives[item.path] = zipfile.ZipFile(item.path)
+    return archive.read(item.member)
+
+
+def _pdf_text(path: str) -> str:
+    """Text layer first, OCR for image-only pages until every test is found"""
+    try:
+        texts = pdf_text_layer_sync(path)
+    except (OSError, OCRError):
+        return ocr_file(path)
+
+    seen: Set[str] = set()
+    scanned = []
+    for page, text in enumerate(texts):
+        if has_text_layer(text):
+            seen |= set(ReportAnalyzer.matcher.search(text))
+        else:
+            scanned.append(page)
+    for page in scanned:
+        if len(seen) == len(TESTS):
+            break
+        texts[page] = ocr_binary(preprocess(rasterize_pdf_page(path, page + 1)))
+        seen |= set(ReportAnalyzer.matcher.search(texts[page]))
+    return "\f".join(texts)
+
+
+def ingest_one(item: Item) -> ReportResult:
+    """Process pool entry point: read one report and extract its lab values"""
+    result = ReportResult(item.name)
+    try:
+        data = _read(item)
+        result.digest = hashlib.sha256(data).hexdigest()
+        if is_pdf(data):
+            if item.member is None:
+                text = _pdf_text(item.path)
+            else:
+                # poppler needs a file; zip members are staged one at a time
+                with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+                    tmp.write(data)
+                    tmp.flush()
+                    text = _pdf_text(tmp.name)
+        else:
+            # No digest: archive images would only churn the preprocess cache
+            text = ocr_file(data)
+        del data
+        result.values = [
+            (
+                TESTS.index(value["name"]), value["value"],
+                STATUS_CODES[value["status"]], SEVERITIES.index(value["severity"])
+            )
+            for value in ReportAnalyzer.extract_values(text)
+        ]
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"[:500]
+    return result
+
+
+def run_pool(items: Iterable[Item], workers: int) -> Iterator[ReportResult]:
+    """Results for items in completion order, with at most 2 x workers in flight"""
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        pending = {executor.submit(ingest_one, item) for item in itertools.islice(items, workers * 2)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                item = next(items, None)
+                if item is not None:
+                    pending.add(executor.submit(ingest_one, item))
+
+
+def read_checkpoint(output: str) -> List[Dict]:
+    """Shards written so far, each with the names of the reports it holds"""
+    entries = []
+    path = os.path.join(output, CHECKPOINT)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash; its shard is an orphan
+                    break
+    return entries
+
+
+class ShardWriter:
+    """Buffers results and writes them out as checkpointed .npz shards
+
+    A shard is written and renamed into place before its line is appended
+    to the checkpoint, so after a crash the checkpoint lists exactly the
+    reports whose rows are on disk; shards it does not list are removed.
+    Reports that failed are written with their error but listed apart
+    and left out of ``done``, so a resumed run tries them again.
+    """
+
+    def __init__(self, output: str, shard_size: int):
+        self.output = output
+        self.shard_size = shard_size
+        self._buffer: List[ReportResult] = []
+        os.makedirs(output, exist_ok=True)
+        entries = read_checkpoint(output)
+        self.shards: List[str] = [entry["shard"] for entry in entries]
+        self.done: Set[str] = {name for entry in entries for name in entry["reports"]}
+
+        # Drop what a crash left behind: orphan shards and a partial last
+        # checkpoint line, which new lines must not be appended after
+        for name in os.listdir(self.output):
+            if name.startswith("part-") and name not in self.shards:
+                os.remove(os.path.join(self.output, name))
+        if entries:
+            path = os.path.join(self.output, CHECKPOINT)
+            with open(f"{path}.tmp", "w") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+            os.replace(f"{path}.tmp", path)
+
+    def add(self, result: ReportResult):
+        self._buffer.append(result)
+        if len(self._buffer) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        shard = f"part-{len(self.shards):05d}.npz"
+        tmp = os.path.join(self.output, f"{shard}.tmp.npz")
+        np.savez(tmp, **_columns(self._buffer))
+        os.replace(tmp, os.path.join(self.output, shard))
+
+        with open(os.path.join(self.output, CHECKPOINT), "a") as f:
+            f.write(json.dumps({
+                "shard": shard,
+                "reports": [r.name for r in self._buffer if not r.error],
+                "failed": [r.name for r in self._buffer if r.error]
+            }) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.shards.append(shard)
+        self.done.update(r.name for r in self._buffer if not r.error)
+        self._buffer = []
+
+
+def _columns(results: List[ReportResult]) -> Dict[str, np.ndarray]:
+    rows = [(index, *value) for index, result in enumerate(results) for value in result.values]
+    report, test, value, status, severity = zip(*rows) if rows else ((), (), (), (), ())
+    return {
+        # One row per (report, test)
+        "report": np.array(report, dtype=np.int32),
+        "test": np.array(test, dtype=np.int16),
+        "value": np.array(value, dtype=np.float64),
+        "status": np.array(status, dtype=np.int8),
+        "severity": np.array(severity, dtype=np.int8),
+        # One entry per report, indexed by the report column
+        "report_name": np.array([r.name for r in results], dtype=np.str_),
+        "report_digest": np.array([r.digest for r in results], dtype="U64"),
+        "report_error": np.array([r.error for r in results], dtype=np.str_),
+        # Dictionaries for the test and severity codes
+        "tests": np.array(TESTS, dtype=np.str_),
+        "units": np.array(UNITS, dtype=np.str_),
+        "severities": np.array(SEVERITIES, dtype=np.str_),
+    }
+
+
+def merge(output: str) -> str:
+    """Concatenate the shards of a run into a single lab_values.npz
+
+    A report that failed and was retried by a resumed run is in more than
+    one shard; only its latest attempt is kept.
+    """
+    shards = [entry["shard"] for entry in read_checkpoint(output)]
+    latest: Dict[str, Tuple[int, int]] = {}
+    for number, shard in enumerate(shards):
+        with np.load(os.path.join(output, shard)) as part:
+            for index, name in enumerate(part["report_name"].tolist()):
+                latest[name] = (number, index)
+
+    columns: Dict[str, List[np.ndarray]] = {}
+    offset = 0
+    for number, shard in enumerate(shards):
+        with np.load(os.path.join(output, shard)) as part:
+            keep = np.array(
+                [latest[name] == (number, index) for index, name in enumerate(part["report_name"].tolist())],
+                dtype=bool
+            )
+            # Renumber the kept reports; rows follow their report
+            renumbered = np.cumsum(keep) - 1 + offset
+            rows = keep[part["report"]]
+            for key in ("report", "test", "value", "status", "severity"):
+                array = renumbered[part[key][rows]] if key == "report" else part[key][rows]
+                columns.setdefault(key, []).append(array.astype(part[key].dtype))
+            for key in ("report_name", "report_digest", "report_error"):
+                columns.setdefault(key, []).append(part[key][keep])
+            offset += int(keep.sum())
+    merged = {key: np.concatenate(arrays) for key, arrays in columns.items()}
+    if not merged:
+        merged = _columns([])
+    merged["tests"] = np.array(TESTS, dtype=np.str_)
+    merged["units"] = np.array(UNITS, dtype=np.str_)
+    merged["severities"] = np.array(SEVERITIES, dtype=np.str_)
+
+    path = os.path.join(output, MERGED)
+    np.savez(f"{path}.tmp.npz", **merged)
+    os.replace(f"{path}.tmp.npz", path)
+    return path
+
+
+def ingest(
+    source: str,
+    output: str,
+    workers: Optional[int] = None,
+    shard_size: Optional[int] = None,
+    progress: Optional[Callable[[Dict], None]] = None
+) -> Dict:
+    """Ingest every report in ``source``, resuming a previous run in ``output``"""
+    workers = workers or int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+    writer = ShardWriter(output, shard_size or int(os.getenv("INGEST_SHARD_SIZE", 500)))
+    stats = {"reports": 0, "failed": 0, "rows": 0, "resumed": len(writer.done), "workers": workers}
+    start = time.perf_counter()
+
+    # Reports finished by an earlier run are skipped before reaching a worker
+    todo = (item for item in iter_archive(source) if item.name not in writer.done)
+    for result in run_pool(todo, workers):
+        writer.add(result)
+        stats["reports"] += 1
+        stats["rows"] += len(result.values)
+        if result.error:
+            stats["failed"] += 1
+            logger.warning("Report ingestion failed", report=result.name, error=result.error)
+        if progress is not None:
+            progress({**stats, "reports_per_second": stats["reports"] / (time.perf_counter() - start)})
+    writer.flush()
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["reports_per_second"] = stats["reports"] / stats["seconds"] if stats["seconds"] else 0.0
+    stats["output"] = merge(output)
+    return stats
+
+
+def load(path: str) -> Dict[str, np.ndarray]:
+    """Read an ingestion output (a merged file or a single shard) into memory"""
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+class IngestRuns:
+    """Ingestion runs started through the API, one at a time
+
+    A run is named after the sha256 of its archive and writes to its own
+    directory, so submitting the same archive again after a restart
+    resumes it from its checkpoint.
+    """
+
+    def __init__(self, directory: Optional[str] = None, workers: Optional[int] = None):
+        self.directory = directory or os.getenv("INGEST_DIR", "ingest")
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", max((os.cpu_count() or 1) // 2, 1)))
+        self._runs: Dict[str, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def output_dir(self, run_id: str) -> str:
+        return os.path.join(self.directory, run_id)
+
+    @property
+    def busy(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, run_id: str, source: str, remove_source: bool = False) -> Dict:
+        """Start or resume the run; the caller checks ``busy`` first
+
+        ``remove_source`` deletes the archive once the run completes, for
+        archives uploaded through the API.
+        """
+        run = self.get(run_id)
+        if run is not None and run["status"] in ("running", "complete"):
+            if remove_source and run["status"] == "complete" and os.path.exists(source):
+                os.remove(source)
+            return run
+        run = self._runs[run_id] = {"run_id": run_id, "status": "running", "progress": {}}
+        self._task = asyncio.create_task(self._run(run, source, remove_source))
+        return run
+
+    async def _run(self, run: Dict, source: str, remove_source: bool):
+        def progress(stats: Dict):
+            run["progress"] = stats
+
+        try:
+            stats = await asyncio.to_thread(
+                ingest, source, self.output_dir(run["run_id"]), self.workers, None, progress
+            )
+            run.update(status="complete", progress=stats)
+            if remove_source:
+                os.remove(source)
+        except Exception as e:
+            logger.error("Ingestion run failed", run_id=run["run_id"], error=str(e))
+            run.update(status="failed", error=str(e))
+
+    def get(self, run_id: str) -> Optional[Dict]:
+        if not re.fullmatch(r"[0-9a-f]{16}", run_id):
+            # Run ids name directories; nothing else may reach the filesystem
+            return None
+        if run_id in self._runs:
+            return self._runs[run_id]
+        # Runs from before a restart are known by their output directory
+        output = self.output_dir(run_id)
+        if os.path.exists(os.path.join(output, MERGED)):
+            return {"run_id": run_id, "status": "complete", "progress": {}}
+        if os.path.exists(os.path.join(output, CHECKPOINT)):
+            return {"run_id": run_id, "status": "interrupted", "progress": {}}
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest an archive of lab reports into columnar .npz files")
+    parser.add_argument("source", help="zip file or directory of reports")
+    parser.add_argument("--output", required=True, help="run directory; an existing one is resumed")
+    parser.add_argument("--workers", type=int, help="worker processes (default: INGEST_WORKERS or all cores)")
+    parser.add_argument("--shard-size", type=int, help="reports per checkpointed shard")
+    args = parser.parse_args()
+
+    last = [0.0]
+
+    def progress(stats: Dict):
+        now = time.monotonic()
+        if now - last[0] >= 5:
+            last[0] = now
+            print(f"  {stats['reports']} reports, {stats['failed']} failed, "
+                  f"{stats['rows']} values, {stats['reports_per_second']:.1f} reports/s")
+
+    stats = ingest(args.source, args.output, args.workers, args.shard_size, progress)
+    print(f"ingested {stats['reports']} reports ({stats['resumed']} already done, {stats['failed']} failed), "
+          f"{stats['rows']} values, {stats['reports_per_second']:.1f} reports/s on {stats['workers']} workers")
+    print(f"wrote {stats['output']}")
+
+
+if __name__ == "__main__":
+    main()
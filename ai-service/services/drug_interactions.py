@@ -0,0 +1,192 @@
+"""
+Drug interaction engine
+The interaction table is loaded once into an index of normalized drug IDs,
+so checking a medication list is a handful of dictionary lookups per pair
+"""
+
+from typing import Dict, FrozenSet, Hashable, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field
+from itertools import combinations
+import json
+import os
+import re
+
+from services.knowledge_base import KnowledgeBase
+
+DEFAULT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "drug_interactions.json")
+
+SEVERITY_ORDER = {"low": 0, "medium": 1, "high": 2}
+
+# Strength, dosage form and release suffixes that do not change the drug
+_DOSE = re.compile(r"\b\d+(?:\.\d+)?\s*(?:mg|mcg|µg|g|ml|iu|units?|%)\b")
+_FORM = re.compile(r"\b(?:tablets?|tabs?|capsules?|caps?|oral|solution|er|xr|sr|cr|dr|hcl)\b")
+# Salt and strength words that may surround a drug name ("losartan
+# potassium", "low dose aspirin"); any other leftover word means the
+# medication is something else ("root beer" is not beer)
+_QUALIFIERS = frozenset((
+    "sodium", "potassium", "calcium", "magnesium", "hydrochloride", "hydrobromide", "sulfate", "sulphate",
+    "citrate", "tartrate", "succinate", "maleate", "mesylate", "besylate", "acetate", "phosphate",
+    "monohydrate", "dihydrate", "low", "dose", "extra", "strength", "regular", "chewable",
+    "extended", "delayed", "immediate", "release", "generic"
+))
+
+
+def normalize_drug_name(name: str) -> str:
+    name = _FORM.sub(" ", _DOSE.sub(" ", name.lower()))
+    return " ".join(re.sub(r"[^a-z0-9\- ]+", " ", name).split())
+
+
+@dataclass
+class InteractionReport:
+    interactions: List[Dict]
+    # Medications as supplied that are not in the table; pairs involving
+    # them have no known answer
+    unknown: List[str] = field(default_factory=list)
+
+
+class InteractionIndex:
+    """Pairwise interaction lookup over normalized drug IDs
+
+    Generic names, brand names and synonyms all map to one integer ID.
+    Class rules in the table ("class:nsaid") are expanded into concrete
+    pairs at load time, keyed by the frozenset of the two IDs.
+    """
+
+    def __init__(self, table: Dict):
+        self.names: List[str] = []
+        self.aliases: Dict[str, int] = {}
+        for canonical, synonyms in table["drugs"].items():
+            drug_id = len(self.names)
+            self.names.append(canonical)
+            for alias in [canonical, *synonyms]:
+                self.aliases[normalize_drug_name(alias)] = drug_id
+
+        classes = {
+            name: [self.aliases[normalize_drug_name(member)] for member in members]
+            for name, members in table.get("classes", {}).items()
+        }
+
+        def expand(entry: str) -> List[int]:
+            if entry.startswith("class:"):
+                return classes[entry[6:]]
+            return [self.aliases[normalize_drug_name(entry)]]
+
+        self.rules: List[Dict] = []
+        # pair -> (rule, first drug, second drug), in the rule's own order
+        self.pairs: Dict[FrozenSet[int], Tuple[int, int, int]] = {}
+        for rule in table["interactions"]:
+            rule_id = len(self.rules)
+            self.rules.append({k: v for k, v in rule.items() if k != "medications"})
+            first, second = rule["medications"]
+            for a in expand(first):
+                for b in expand(second):
+                    if a == b:
+                        continue
+                    key = frozenset((a, b))
+                    existing = self.pairs.get(key)
+                    # A pair covered by several rules keeps the most severe one
+                    if existing is None or self._severity(rule_id) > self._severity(existing[0]):
+                        self.pairs[key] = (rule_id, a, b)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "InteractionIndex":
+        path = path or os.getenv("DRUG_INTERACTIONS_PATH", DEFAULT_TABLE)
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def _severity(self, rule_id: int) -> int:
+        return SEVERITY_ORDER.get(self.rules[rule_id].get("severity"), -1)
+
+    def _alias(self, normalized: str) -> Optional[Hashable]:
+        return self.aliases.get(normalized)
+
+    def _interaction(self, a: Hashable, b: Hashable) -> Optional[Dict]:
+        entry = self.pairs.get(frozenset((a, b)))
+        if entry is None:
+            return None
+        rule_id, first, second = entry
+        return {"medications": [self.names[first], self.names[second]], **self.rules[rule_id]}
+
+    def resolve(self, name: str) -> Optional[Hashable]:
+        """Map a medication as written to its drug ID, if known
+
+        Tries the whole normalized name first, then its word n-grams from
+        longest to shortest, accepting an n-gram only when every word left
+        over is a qualifier: "warfarin sodium 5mg" finds warfarin, "root
+        beer" finds nothing.
+        """
+        words = normalize_drug_name(name).split()
+        for size in range(len(words), 0, -1):
+            for start in range(len(words) - size + 1):
+                if not _QUALIFIERS.issuperset(words[:start] + words[start + size:]):
+                    continue
+                found = self._alias(" ".join(words[start:start + size]))
+                if found is not None:
+                    return found
+        return None
+
+    def check(self, medications: List[str]) -> InteractionReport:
+        """Report every interacting pair in a medication list"""
+        ids: Dict[Hashable, None] = {}
+        unknown = []
+        for medication in medications:
+            drug_id = self.resolve(medication)
+            if drug_id is None:
+                unknown.append(medication)
+            else:
+                # Brand and generic of the same drug count once
+                ids[drug_id] = None
+
+        interactions = []
+        for a, b in combinations(ids, 2):
+            interaction = self._interaction(a, b)
+            if interaction is not None:
+                interactions.append(interaction)
+
+        interactions.sort(key=lambda i: -SEVERITY_ORDER.get(i.get("severity"), -1))
+        return InteractionReport(interactions=interactions, unknown=unknown)
+
+    def export(self) -> Dict[str, Iterator[Tuple[str, str]]]:
+        """String tables for the compiled knowledge base, keyed by drug name"""
+        return {
+            "drug_aliases": ((alias, self.names[drug_id]) for alias, drug_id in self.aliases.items()),
+            "drug_rules": ((str(rule_id), json.dumps(rule)) for rule_id, rule in enumerate(self.rules)),
+            "drug_pairs": (
+                (pair_key(self.names[first], self.names[second]), f"{rule_id}\t{self.names[first]}\t{self.names[second]}")
+                for rule_id, first, second in self.pairs.values()
+            )
+        }
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+
+def pair_key(a: str, b: str) -> str:
+    """Order-independent key of two canonical drug names"""
+    return "\0".join(sorted((a, b)))
+
+
+class MappedInteractionIndex(InteractionIndex):
+    """InteractionIndex answered from a compiled knowledge base
+
+    Drug IDs are canonical names, and nothing is loaded up front; each
+    lookup reads the mapped tables directly.
+    """
+
+    def __init__(self, kb: KnowledgeBase):
+        self._aliases = kb.table("drug_aliases")
+        self._rules = kb.table("drug_rules")
+        self._pairs = kb.table("drug_pairs")
+
+    def _alias(self, normalized: str) -> Optional[str]:
+        return self._aliases.get(normalized)
+
+    def _interaction(self, a: str, b: str) -> Optional[Dict]:
+        entry = self._pairs.get(pair_key(a, b))
+        if entry is None:
+            return None
+        rule_id, first, second = entry.split("\t")
+        return {"medications": [first, second], **json.loads(self._rules.get(rule_id))}
+
+    def __len__(self) -> int:
+        return len(self._pairs)
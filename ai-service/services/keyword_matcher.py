@@ -0,0 +1,83 @@
+"""
+Multi-pattern keyword matching with an Aho-Corasick automaton
+Finds every keyword of every set in one pass over the text
+"""
+
+from typing import Dict, Iterable, List, Set, Tuple
+from collections import deque
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class KeywordHit:
+    pattern_id: str
+    keyword: str
+    start: int
+    end: int
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over named keyword sets
+
+    Matching is case-insensitive substring matching, like ``kw in
+    text.lower()``, but all keywords of all sets are found in a single
+    pass whose cost depends on the text length, not the vocabulary size.
+    """
+
+    def __init__(self, keyword_sets: Dict[str, Iterable[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # (pattern id, keyword) pairs ending at each node, including
+        # those inherited through failure links
+        self._out: List[Tuple[Tuple[str, str], ...]] = [()]
+
+        for pattern_id, keywords in keyword_sets.items():
+            for keyword in keywords:
+                self._insert(keyword.lower(), pattern_id)
+        self._link()
+
+    def _insert(self, keyword: str, pattern_id: str):
+        node = 0
+        for char in keyword:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[node][char] = child
+            node = child
+        if (pattern_id, keyword) not in self._out[node]:
+            self._out[node] += ((pattern_id, keyword),)
+
+    def _link(self):
+        """Compute failure links breadth-first"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] += self._out[self._fail[child]]
+
+    def find_all(self, text: str) -> List[KeywordHit]:
+        """Return every keyword occurrence, in order of end offset"""
+        goto, fail, out = self._goto, self._fail, self._out
+        hits = []
+        node = 0
+
+        for i, char in enumerate(text.lower()):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern_id, keyword in out[node]:
+                hits.append(KeywordHit(pattern_id, keyword, i - len(keyword) + 1, i + 1))
+
+        return hits
+
+    @staticmethod
+    def pattern_ids(hits: List[KeywordHit]) -> Set[str]:
+        return {hit.pattern_id for hit in hits}
@@ -0,0 +1,345 @@
+"""
+Compiled, memory-mapped knowledge base for medical terms and drug data
+Built offline from the JSON sources by the CLI below and opened with mmap
+at runtime, so workers share its pages through the OS page cache. The
+term lookup index is compiled into the same file, so no worker builds
+one of its own
+
+    python -m services.knowledge_base build --output data/knowledge_base.mvkb
+"""
+
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, TypeVar
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_TERMS = os.path.join(DATA_DIR, "medical_terms.json")
+DEFAULT_ABBREVIATIONS = os.path.join(DATA_DIR, "term_abbreviations.json")
+DEFAULT_INTERACTIONS = os.path.join(DATA_DIR, "drug_interactions.json")
+
+# File layout, all little-endian:
+#   header     magic, version, table count, array count
+#   directory  per table: name, slot count, slot array offset;
+#              then per array: name, offset, length in bytes
+#   slots      per table: open-addressing hash table of string offsets
+#   arrays     raw fixed-width arrays, each 8-byte aligned
+#   heap       UTF-8 keys and values
+MAGIC = b"MVKB"
+VERSION = 2
+HEADER = struct.Struct("<4sHHH")
+NAME_SIZE = 32
+DIRECTORY_ENTRY = struct.Struct(f"<{NAME_SIZE}sQQ")
+# key hash (0 = empty slot), key offset, key length, value offset, value length
+SLOT = struct.Struct("<QQIQI")
+
+T = TypeVar("T")
+
+
+def _hash(key: bytes) -> int:
+    # Never 0, which marks an empty slot
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") | 1
+
+
+def _entry_name(name: str) -> bytes:
+    encoded = name.encode()
+    if not encoded or len(encoded) > NAME_SIZE or b"\0" in encoded:
+        raise ValueError(f"Knowledge base names must be 1 to {NAME_SIZE} bytes without NUL: {name!r}")
+    return encoded
+
+
+def normalize_term(text: str) -> str:
+    return " ".join(re.sub(r"[^a-z0-9\-' ]+", " ", text.lower()).split())
+
+
+# Opposite findings spelled almost alike, as word prefixes and as whole
+# words. Lookups that tolerate small differences in wording must never
+# turn one side of a pair into the other
+CONTRAST_PREFIXES = (("hyper", "hypo"), ("brady", "tachy"), ("micro", "macro"))
+CONTRAST_WORDS = (
+    ("left", "right"), ("upper", "lower"), ("anterior", "posterior"),
+    ("high", "low"), ("increased", "decreased"), ("inhalation", "exhalation"),
+)
+
+
+def contrast_markers(text: str) -> FrozenSet[str]:
+    """The sides of contrast pairs that words of a normalized text are on"""
+    markers = set()
+    for word in text.split():
+        for pair in CONTRAST_PREFIXES:
+            markers.update(prefix for prefix in pair if word.startswith(prefix))
+        for pair in CONTRAST_WORDS:
+            markers.update(w for w in pair if word == w)
+    return frozenset(markers)
+
+
+def contrasting(a: str, b: str) -> bool:
+    """Whether a and b are on different sides of any contrast pair"""
+    markers_a, markers_b = contrast_markers(a), contrast_markers(b)
+    for pair in CONTRAST_PREFIXES + CONTRAST_WORDS:
+        side_a, side_b = markers_a.intersection(pair), markers_b.intersection(pair)
+        if side_a and side_b and side_a != side_b:
+            return True
+    return False
+
+
+def find_phrase(get: Callable[[str], Optional[T]], text: str) -> Optional[T]:
+    """Look up a whole phrase, then its word n-grams from longest to shortest"""
+    found = get(text)
+    if found is not None:
+        return found
+
+    words = text.split()
+    for size in range(len(words) - 1, 0, -1):
+        for start in range(len(words) - size + 1):
+            found = get(" ".join(words[start:start + size]))
+            if found is not None:
+                return found
+    return None
+
+
+def find_terms(contains: Callable[[str], bool], text: str, max_words: int = 4) -> FrozenSet[str]:
+    """Every word n-gram of text, up to max_words long, that contains accepts"""
+    words = text.split()
+    return frozenset(
+        phrase
+        for size in range(1, min(max_words, len(words)) + 1)
+        for start in range(len(words) - size + 1)
+        if contains(phrase := " ".join(words[start:start + size]))
+    )
+
+
+class MappedTable:
+    """Read-only string -> string hash table over a region of the mapped file"""
+
+    def __init__(self, buffer: mmap.mmap, slots: int, offset: int):
+        self._buffer = buffer
+        self._slots = slots
+        self._mask = slots - 1
+        self._offset = offset
+        self._size: Optional[int] = None
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        encoded = key.encode()
+        h = _hash(encoded)
+        buffer = self._buffer
+        i = h & self._mask
+        while True:
+            slot_hash, key_off, key_len, val_off, val_len = SLOT.unpack_from(buffer, self._offset + i * SLOT.size)
+            if slot_hash == 0:
+                return default
+            if slot_hash == h and buffer[key_off:key_off + key_len] == encoded:
+                return buffer[val_off:val_off + val_len].decode()
+            i = (i + 1) & self._mask
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """Walk every entry in slot order; touches the whole table"""
+        buffer = self._buffer
+        for slot_hash, key_off, key_len, val_off, val_len in SLOT.iter_unpack(
+            buffer[self._offset:self._offset + self._slots * SLOT.size]
+        ):
+            if slot_hash:
+                yield buffer[key_off:key_off + key_len].decode(), buffer[val_off:val_off + val_len].decode()
+
+    def keys(self) -> Iterator[str]:
+        return (key for key, _ in self.items())
+
+    def __len__(self) -> int:
+        if self._size is None:
+            self._size = sum(1 for _ in self.items())
+        return self._size
+
+
+class KnowledgeBase:
+    """A compiled knowledge base file mapped read-only into memory
+
+    Opening reads only the header and table directory, so startup cost
+    and private memory do not depend on the size of the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, table_count, array_count = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self._buffer.close()
+            raise ValueError(f"{path} is not a version {VERSION} knowledge base")
+
+        self.tables: Dict[str, MappedTable] = {}
+        self._arrays: Dict[str, Tuple[int, int]] = {}
+        for i in range(table_count + array_count):
+            name, first, second = DIRECTORY_ENTRY.unpack_from(self._buffer, HEADER.size + i * DIRECTORY_ENTRY.size)
+            name = name.rstrip(b"\0").decode()
+            if i < table_count:
+                self.tables[name] = MappedTable(self._buffer, first, second)
+            else:
+                self._arrays[name] = (first, second)
+
+    @classmethod
+    def from_env(cls) -> Optional["KnowledgeBase"]:
+        """Open the file named by KNOWLEDGE_BASE_PATH, if set"""
+        path = os.getenv("KNOWLEDGE_BASE_PATH")
+        return cls(path) if path else None
+
+    def table(self, name: str) -> MappedTable:
+        return self.tables[name]
+
+    def array(self, name: str, dtype: str) -> np.ndarray:
+        """A read-only NumPy view of a stored array; no data is copied"""
+        offset, length = self._arrays[name]
+        return np.frombuffer(self._buffer, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    def close(self):
+        self.tables = {}
+        self._arrays = {}
+        try:
+            self._buffer.close()
+        except BufferError:
+            # Arrays handed out still view the mapping, which is unmapped
+            # once the last of them is dropped
+            pass
+
+
+def write_knowledge_base(
+    path: str,
+    tables: Dict[str, Iterable[Tuple[str, str]]],
+    arrays: Optional[Dict[str, bytes]] = None
+):
+    """Compile string -> string tables and raw arrays into a knowledge base file"""
+    arrays = arrays or {}
+    names = [_entry_name(name) for name in list(tables) + list(arrays)]
+    heap = bytearray()
+    interned: Dict[bytes, int] = {}
+    directory_size = HEADER.size + len(names) * DIRECTORY_ENTRY.size
+
+    def intern(data: bytes) -> int:
+        offset = interned.get(data)
+        if offset is None:
+            offset = interned[data] = len(heap)
+            heap.extend(data)
+        return offset
+
+    # Slot arrays are laid out first, so heap offsets are relocated once
+    # the total slot size is known
+    layouts: List[Tuple[str, int, List[Optional[tuple]]]] = []
+    for name, entries in tables.items():
+        entries = dict(entries)
+        slots = 1
+        while slots < max(len(entries) * 2, 8):
+            slots *= 2
+        array: List[Optional[tuple]] = [None] * slots
+        for key, value in entries.items():
+            key_bytes, value_bytes = key.encode(), value.encode()
+            h = _hash(key_bytes)
+            i = h & (slots - 1)
+            while array[i] is not None:
+                i = (i + 1) & (slots - 1)
+            array[i] = (h, intern(key_bytes), len(key_bytes), intern(value_bytes), len(value_bytes))
+        layouts.append((name, slots, array))
+
+    offset = directory_size + sum(slots * SLOT.size for _, slots, _ in layouts)
+    array_offsets = []
+    for data in arrays.values():
+        offset += -offset % 8
+        array_offsets.append(offset)
+        offset += len(data)
+    heap_offset = offset
+    empty = SLOT.pack(0, 0, 0, 0, 0)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(layouts), len(arrays)))
+        offset = directory_size
+        for name, (_, slots, _) in zip(names, layouts):
+            f.write(DIRECTORY_ENTRY.pack(name, slots, offset))
+            offset += slots * SLOT.size
+        for name, data, array_offset in zip(names[len(layouts):], arrays.values(), array_offsets):
+            f.write(DIRECTORY_ENTRY.pack(name, array_offset, len(data)))
+        for _, _, array in layouts:
+            f.write(b"".join(
+                empty if slot is None
+                else SLOT.pack(slot[0], slot[1] + heap_offset, slot[2], slot[3] + heap_offset, slot[4])
+                for slot in array
+            ))
+        for data, array_offset in zip(arrays.values(), array_offsets):
+            f.write(b"\0" * (array_offset - f.tell()))
+            f.write(data)
+        f.write(heap)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_terms(path: Optional[str] = None) -> Dict[str, str]:
+    """Term explanations from the JSON source, keyed by normalized term"""
+    with open(path or DEFAULT_TERMS) as f:
+        return {normalize_term(term): text for term, text in json.load(f).items()}
+
+
+def load_abbreviations(path: Optional[str] = None) -> Dict[str, str]:
+    """Abbreviation -> term, both normalized"""
+    with open(path or DEFAULT_ABBREVIATIONS) as f:
+        return {normalize_term(short): normalize_term(term) for short, term in json.load(f).items()}
+
+
+def build(
+    terms_path: str,
+    interactions_path: str,
+    output: str,
+    abbreviations_path: Optional[str] = None
+) -> Dict[str, int]:
+    from services.drug_interactions import InteractionIndex
+    from services.term_index import TermIndex
+
+    index = InteractionIndex.load(interactions_path)
+    terms = load_terms(terms_path)
+    abbreviations = load_abbreviations(abbreviations_path)
+    term_index = TermIndex(terms.keys(), abbreviations)
+    tables = {
+        "terms": terms,
+        "abbreviations": abbreviations,
+        **{name: dict(entries) for name, entries in term_index.export().items()},
+        **{name: dict(entries) for name, entries in index.export().items()}
+    }
+    # Write next to the target and rename, so running workers never see
+    # a half-written file
+    tmp = f"{output}.tmp"
+    write_knowledge_base(tmp, tables, term_index.export_arrays())
+    os.replace(tmp, output)
+    return {name: len(entries) for name, entries in tables.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the compiled knowledge base")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="compile the JSON sources")
+    build_parser.add_argument("--terms", default=DEFAULT_TERMS)
+    build_parser.add_argument("--abbreviations", default=DEFAULT_ABBREVIATIONS)
+    build_parser.add_argument("--interactions", default=DEFAULT_INTERACTIONS)
+    build_parser.add_argument("--output", required=True)
+    info_parser = commands.add_parser("info", help="list the tables of a compiled file")
+    info_parser.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        counts = build(args.terms, args.interactions, args.output, args.abbreviations)
+        print(f"wrote {args.output} ({os.path.getsize(args.output)} bytes)")
+    else:
+        kb = KnowledgeBase(args.path)
+        counts = {name: len(table) for name, table in kb.tables.items()}
+        kb.close()
+    for name, count in counts.items():
+        print(f"  {name:<16} {count} entries")
+
+
+if __name__ == "__main__":
+    main()
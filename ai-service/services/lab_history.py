@@ -0,0 +1,151 @@
+"""
+Per-user history of extracted lab values
+Append-only float64 series on local files, one per user and test, with
+trends computed over the whole series in NumPy
+"""
+
+from typing import Dict, Iterator, Optional, Tuple
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import os
+import time
+
+import numpy as np
+
+# One observation: epoch seconds and value, both float64, stored back to
+# back so a series file is a single contiguous array
+POINT = np.dtype([("time", "<f8"), ("value", "<f8")])
+DIGEST_SIZE = 32
+SECONDS_PER_DAY = 86400.0
+# Slopes over less time than this, such as two reports uploaded minutes
+# apart, say nothing useful per day and are left out
+MIN_SLOPE_SPAN = SECONDS_PER_DAY
+
+
+def trend(times: np.ndarray, values: np.ndarray, low: float, high: float) -> Dict:
+    """Trend of one test's series against its normal range [low, high]
+
+    ``delta`` is the change from the previous value. ``slope_per_day``
+    is the least-squares slope. ``out_of_range_slope_per_day`` is the
+    least-squares slope of the distance outside the range, which is
+    zero inside it: positive when values are moving further out of
+    range, negative when they are coming back. Slopes are None until
+    the series spans MIN_SLOPE_SPAN.
+    """
+    count = len(values)
+    outside = np.clip(values, low, high)
+    outside -= values
+    np.abs(outside, out=outside)
+    result = {
+        "points": count,
+        "latest": float(values[-1]),
+        "delta": float(values[-1] - values[-2]) if count > 1 else None,
+        "slope_per_day": None,
+        "out_of_range_fraction": np.count_nonzero(outside) / count,
+        "out_of_range_slope_per_day": None,
+    }
+    if times.max() - times.min() >= MIN_SLOPE_SPAN:
+        centered = times - times.mean()
+        days = SECONDS_PER_DAY / float(centered.dot(centered))
+        # centered sums to zero, so the other side need not be centered
+        result["slope_per_day"] = float(centered.dot(values)) * days
+        result["out_of_range_slope_per_day"] = float(centered.dot(outside)) * days
+    return result
+
+
+class LabHistory:
+    """Lab values per user and test, kept under ``directory``
+
+    Each user has a directory named after a hash of the user id, holding
+    one ``<test>.f8`` file of POINT records per test and a list of the
+    report digests already recorded, so re-analyzing a report does not
+    add its values twice. The check and the appends run under a per-user
+    file lock, so the same report recorded at once by two requests or
+    processes is still added once. Appends are single writes of whole
+    records; a record cut short by a crash is ignored when reading and
+    cut off before the next append.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.getenv("LAB_HISTORY_DIR", "lab_history")
+
+    def _user_dir(self, user_id: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(user_id.encode()).hexdigest()[:32])
+
+    def record(self, user_id: str, digest: str, values: Dict[str, float], at: Optional[float] = None) -> bool:
+        """Append a report's values; False if this report was recorded before"""
+        user_dir = self._user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        raw_digest = bytes.fromhex(digest)
+        at = time.time() if at is None else at
+        # The same report may be recorded at once by a request and a
+        # background job, or by two worker processes; the check and the
+        # appends must not interleave
+        with _locked(os.path.join(user_dir, "lock")):
+            seen = _read(os.path.join(user_dir, "reports.bin"), np.dtype((np.uint8, DIGEST_SIZE)))
+            if len(seen) and (seen == np.frombuffer(raw_digest, dtype=np.uint8)).all(axis=1).any():
+                return False
+
+            for test, value in values.items():
+                point = np.array([(at, value)], dtype=POINT)
+                _append(os.path.join(user_dir, f"{test}.f8"), point.tobytes(), POINT.itemsize)
+            # Last, so a crash before it lets the report be recorded again
+            # rather than be marked recorded with values missing
+            _append(os.path.join(user_dir, "reports.bin"), raw_digest, DIGEST_SIZE)
+        return True
+
+    def series(self, user_id: str, test: str) -> np.ndarray:
+        """All observations of a test in recording order, as a POINT array"""
+        return _read(os.path.join(self._user_dir(user_id), f"{test}.f8"), POINT)
+
+    def history(self, user_id: str) -> Dict[str, np.ndarray]:
+        user_dir = self._user_dir(user_id)
+        try:
+            names = os.listdir(user_dir)
+        except FileNotFoundError:
+            return {}
+        return {
+            name[:-3]: _read(os.path.join(user_dir, name), POINT)
+            for name in names if name.endswith(".f8")
+        }
+
+    def trends(self, user_id: str, ranges: Dict[str, Tuple[float, float]]) -> Dict[str, Dict]:
+        """Trend of every test in the user's history that has a normal range"""
+        return {
+            test: trend(points["time"], points["value"], *ranges[test])
+            for test, points in self.history(user_id).items()
+            if test in ranges and len(points)
+        }
+
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    """Exclusive flock on path for the duration of the block"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        # flock locks belong to the open file, so threads of one process
+        # holding separate descriptors exclude each other too
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _append(path: str, data: bytes, itemsize: int):
+    with open(path, "ab") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size % itemsize:
+            f.truncate(size - size % itemsize)
+        f.write(data)
+
+
+def _read(path: str, dtype: np.dtype) -> np.ndarray:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return np.empty(0, dtype=dtype)
+    # Whole records only; a torn final append is left out
+    usable = len(data) - len(data) % dtype.itemsize
+    return np.frombuffer(data, dtype=dtype, count=usable // dtype.itemsize)
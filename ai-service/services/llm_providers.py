@@ -0,0 +1,312 @@
+"""
+HTTP provider layer for LLM calls
+One long-lived pooled httpx client per provider, with per-call timeouts
+and failover ordered by provider health
+"""
+
+from typing import AsyncIterator, Dict, List, Optional
+from loguru import logger
+import json
+import os
+import time
+
+import httpx
+
+from services import metrics
+
+PROVIDER_SECONDS = metrics.histogram(
+    "llm_provider_seconds", "Latency of successful calls per provider", ("provider",)
+)
+PROVIDER_FAILURES = metrics.counter(
+    "llm_provider_failures_total", "Failed calls per provider, including failovers", ("provider",)
+)
+
+class LLMUnavailable(Exception):
+    """Raised when no configured provider produced a completion"""
+
+
+class LLMProvider:
+    """Base class for a chat-completion provider behind a pooled client"""
+
+    name = ""
+    default_base_url = ""
+    path = ""
+
+    def __init__(self, api_key: str, model: str, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url or self.default_base_url
+        self.client: Optional[httpx.AsyncClient] = None
+
+        # Health state used to order failover
+        self.failures = 0
+        self.latency = 0.0
+        self.cooldown_until = 0.0
+
+    def headers(self) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def payload(self, prompt: str, max_tokens: int) -> Dict:
+        raise NotImplementedError
+
+    def parse(self, body: Dict) -> str:
+        raise NotImplementedError
+
+    def parse_delta(self, event: Dict) -> Optional[str]:
+        """Text carried by one server-sent event of a streamed reply"""
+        raise NotImplementedError
+
+    def open(self, limits: httpx.Limits, timeout: httpx.Timeout, http2: bool):
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers(),
+            limits=limits,
+            timeout=timeout,
+            http2=http2
+        )
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def complete(self, prompt: str, max_tokens: int, timeout: Optional[float]) -> str:
+        response = await self.client.post(
+            self.path,
+            json=self.payload(prompt, max_tokens),
+            **({"timeout": timeout} if timeout is not None else {})
+        )
+        response.raise_for_status()
+        return self.parse(response.json())
+
+    async def stream(self, prompt: str, max_tokens: int, timeout: Optional[float]) -> AsyncIterator[str]:
+        """Yield text chunks of a streamed completion as they arrive"""
+        async with self.client.stream(
+            "POST",
+            self.path,
+            json={**self.payload(prompt, max_tokens), "stream": True},
+            **({"timeout": timeout} if timeout is not None else {})
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                text = self.parse_delta(json.loads(data))
+                if text:
+                    yield text
+
+    def health_key(self, now: float):
+        """Sort key: providers out of cooldown first, then fewest failures, then fastest"""
+        return (self.cooldown_until > now, self.failures, self.latency)
+
+    def record_success(self, elapsed: float):
+        PROVIDER_SECONDS.labels(self.name).observe(elapsed)
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.latency = elapsed if not self.latency else 0.8 * self.latency + 0.2 * elapsed
+
+    def record_failure(self):
+        PROVIDER_FAILURES.labels(self.name).inc()
+        self.failures += 1
+        self.cooldown_until = time.monotonic() + min(2 ** self.failures, 60)
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+    default_base_url = "https://api.openai.com/v1"
+    path = "/chat/completions"
+
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def payload(self, prompt: str, max_tokens: int) -> Dict:
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens
+        }
+
+    def parse(self, body: Dict) -> str:
+        return body["choices"][0]["message"]["content"]
+
+    def parse_delta(self, event: Dict) -> Optional[str]:
+        choices = event.get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content")
+
+
+class AnthropicProvider(LLMProvider):
+    name = "anthropic"
+    default_base_url = "https://api.anthropic.com"
+    path = "/v1/messages"
+
+    def headers(self) -> Dict[str, str]:
+        return {"x-api-key": self.api_key, "anthropic-version": "2023-06-01"}
+
+    def payload(self, prompt: str, max_tokens: int) -> Dict:
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens
+        }
+
+    def parse(self, body: Dict) -> str:
+        return "".join(block["text"] for block in body["content"] if block["type"] == "text")
+
+    def parse_delta(self, event: Dict) -> Optional[str]:
+        if event.get("type") == "content_block_delta":
+            return event["delta"].get("text")
+        return None
+
+
+class ProviderPool:
+    """Configured providers tried in order of health until one succeeds"""
+
+    def __init__(
+        self,
+        providers: List[LLMProvider],
+        timeout: Optional[float] = None,
+        max_connections: Optional[int] = None,
+        max_keepalive: Optional[int] = None,
+        http2: Optional[bool] = None
+    ):
+        self.providers = providers
+        timeout = timeout or float(os.getenv("LLM_TIMEOUT", 30))
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=(
+                max_keepalive if max_keepalive is not None
+                else int(os.getenv("LLM_MAX_KEEPALIVE", max_connections))
+            ),
+            keepalive_expiry=60
+        )
+        self.http2 = (
+            http2 if http2 is not None
+            else os.getenv("LLM_HTTP2", "true").lower() == "true"
+        )
+
+    @classmethod
+    def from_env(
+        cls,
+        openai_key: Optional[str],
+        anthropic_key: Optional[str],
+        model: str
+    ) -> "ProviderPool":
+        """Build the pool from API keys, in LLM_PROVIDERS preference order"""
+        available = {}
+        if openai_key:
+            available["openai"] = OpenAIProvider(
+                openai_key, model, os.getenv("OPENAI_BASE_URL")
+            )
+        if anthropic_key:
+            available["anthropic"] = AnthropicProvider(
+                anthropic_key,
+                os.getenv("ANTHROPIC_MODEL", "claude-3-haiku-20240307"),
+                os.getenv("ANTHROPIC_BASE_URL")
+            )
+
+        order = os.getenv("LLM_PROVIDERS", "openai,anthropic").split(",")
+        return cls([available[name.strip()] for name in order if name.strip() in available])
+
+    @property
+    def available(self) -> bool:
+        return bool(self.providers)
+
+    async def start(self):
+        for provider in self.providers:
+            if provider.client is None:
+                provider.open(self.limits, self.timeout, self.http2)
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.aclose()
+
+    async def complete(
+        self,
+        prompt: str,
+        max_tokens: int = 1024,
+        timeout: Optional[float] = None
+    ) -> str:
+        """Return the first successful completion, failing over by health"""
+        if not self.providers:
+            raise LLMUnavailable("No LLM provider configured")
+
+        now = time.monotonic()
+        for provider in sorted(self.providers, key=lambda p: p.health_key(now)):
+            if provider.client is None:
+                # Clients normally come from the lifespan hook; open lazily
+                # when used outside the app (scripts, benchmarks)
+                provider.open(self.limits, self.timeout, self.http2)
+
+            start = time.perf_counter()
+            try:
+                text = await provider.complete(prompt, max_tokens, timeout)
+            except (httpx.HTTPError, KeyError, IndexError, TypeError, ValueError) as e:
+                provider.record_failure()
+                logger.warning(f"LLM provider {provider.name} failed: {e!r}")
+                continue
+
+            provider.record_success(time.perf_counter() - start)
+            return text
+
+        raise LLMUnavailable("All LLM providers failed")
+
+    async def stream(
+        self,
+        prompt: str,
+        max_tokens: int = 1024,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """Stream a completion, failing over only until the first chunk arrives"""
+        if not self.providers:
+            raise LLMUnavailable("No LLM provider configured")
+
+        now = time.monotonic()
+        for provider in sorted(self.providers, key=lambda p: p.health_key(now)):
+            if provider.client is None:
+                provider.open(self.limits, self.timeout, self.http2)
+
+            start = time.perf_counter()
+            chunks = provider.stream(prompt, max_tokens, timeout)
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except (httpx.HTTPError, KeyError, IndexError, TypeError, ValueError) as e:
+                await chunks.aclose()
+                provider.record_failure()
+                logger.warning(f"LLM provider {provider.name} failed: {e!r}")
+                continue
+
+            # Once text has been sent on, a failure can no longer fail over
+            try:
+                if first is not None:
+                    yield first
+                    async for chunk in chunks:
+                        yield chunk
+            except (httpx.HTTPError, KeyError, IndexError, TypeError, ValueError):
+                provider.record_failure()
+                raise
+            finally:
+                await chunks.aclose()
+
+            provider.record_success(time.perf_counter() - start)
+            return
+
+        raise LLMUnavailable("All LLM providers failed")
+
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        return [
+            {
+                "name": provider.name,
+                "failures": provider.failures,
+                "latency_ms": round(provider.latency * 1000, 2),
+                "cooling_down": provider.cooldown_until > now
+            }
+            for provider in self.providers
+        ]
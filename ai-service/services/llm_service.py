@@ -3,48 +3,206 @@ LLM service for advanced medical AI capabilities
 Uses OpenAI or Anthropic for symptom analysis and report interpretation
 """
 
-from typing import Dict, List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Mapping, Optional, Union
 from loguru import logger
+import json
 import os
+import time
+
+from services import metrics
+from services.keyword_matcher import KeywordHit, KeywordMatcher
+from services.knowledge_base import find_phrase, find_terms, load_abbreviations, load_terms, normalize_term
+from services.llm_providers import ProviderPool
+from services.semantic_cache import SemanticCache, normalize
+from services.single_flight import SingleFlight
+from services.term_index import TermIndex
+
+# Streamed replies put the patient-facing message first, then this line,
+# then the structured part as JSON
+STREAM_SEPARATOR = "---JSON---"
+
+LLM_SECONDS = metrics.histogram(
+    "llm_request_seconds", "LLM-backed lookups by endpoint and whether a provider or the cache answered",
+    ("endpoint", "source")
+)
+LLM_IN_FLIGHT = metrics.gauge("llm_calls_in_flight", "Provider calls awaiting a reply")
+LLM_ERRORS = metrics.counter("llm_errors_total", "LLM lookups that fell back after an error", ("endpoint",))
+LLM_COALESCED = metrics.counter(
+    "llm_coalesced_calls_total", "Provider calls served by joining an identical call already in flight",
+    ("endpoint",)
+)
 
 class LLMService:
     """Service for LLM-based medical analysis"""
     
-    def __init__(self):
+    # Keywords that select a canned response when no provider is configured
+    MOCK_SYMPTOM_KEYWORDS = {
+        "headache": ["headache", "head pain"],
+        "fever": ["fever", "temperature", "hot"],
+        "cough": ["cough", "coughing"]
+    }
+    
+    def __init__(
+        self,
+        matcher: Optional[KeywordMatcher] = None,
+        terms: Optional[Mapping[str, str]] = None,
+        term_index: Optional[TermIndex] = None
+    ):
         self.openai_key = os.getenv("OPENAI_API_KEY")
         self.anthropic_key = os.getenv("ANTHROPIC_API_KEY")
         self.model = os.getenv("LLM_MODEL", "gpt-4")
+        self.providers = ProviderPool.from_env(self.openai_key, self.anthropic_key, self.model)
+        
+        # May be replaced by an automaton shared with other services
+        self.matcher = matcher or KeywordMatcher(self.keyword_sets())
+        
+        # Term explanations: a table of the compiled knowledge base, or the
+        # JSON source when no compiled file is configured
+        self.terms = terms if terms is not None else load_terms()
+        self.term_index = (
+            term_index if term_index is not None
+            else TermIndex(self.terms.keys(), load_abbreviations())
+        )
+        
+        # Response caches per endpoint; drop a name from LLM_CACHE_ENDPOINTS
+        # to opt that endpoint out
+        enabled = os.getenv("LLM_CACHE_ENDPOINTS", "symptoms,terms").split(",")
+        self.caches = {
+            name: SemanticCache(find_terms=self._find_terms)
+            for name in ("symptoms", "terms")
+            if name in [e.strip() for e in enabled]
+        }
+        
+        # Identical prompts that arrive while one is already being answered
+        # wait for that answer instead of calling the provider again
+        self.single_flight = (
+            SingleFlight() if os.getenv("LLM_SINGLE_FLIGHT", "true").lower() == "true" else None
+        )
+    
+    @classmethod
+    def keyword_sets(cls) -> Dict[str, List[str]]:
+        """Keyword sets this service needs from a KeywordMatcher"""
+        return {f"mock:{name}": keywords for name, keywords in cls.MOCK_SYMPTOM_KEYWORDS.items()}
+    
+    async def start(self):
+        """Open the pooled provider clients; called from the app lifespan"""
+        await self.providers.start()
+    
+    async def close(self):
+        await self.providers.close()
     
     async def analyze_symptoms(
         self,
         message: str,
         symptoms: Optional[List[str]] = None,
-        medical_history: Optional[List[str]] = None
+        medical_history: Optional[List[str]] = None,
+        keyword_hits: Optional[List[KeywordHit]] = None
     ) -> Dict:
         """Use LLM to analyze symptoms and provide diagnosis"""
         
-        # In production, call OpenAI/Anthropic API
-        # For demo, return structured mock response
-        
         prompt = self._build_symptom_prompt(message, symptoms, medical_history)
         
         try:
-            # Mock response for demo
-            return self._mock_symptom_response(message)
+            if self.providers.available:
+                semantic_text = " ".join([message, *(symptoms or []), *(medical_history or [])])
+                return await self._complete_cached(
+                    "symptoms", prompt, semantic_text, self._parse_symptom_response
+                )
+            # Mock response when no provider is configured
+            return self._mock_symptom_response(message, keyword_hits)
         except Exception as e:
+            LLM_ERRORS.labels("symptoms").inc()
             logger.error(f"LLM analysis error: {str(e)}")
-            return {
-                "message": "I've analyzed your symptoms. Please consult a healthcare provider for a proper diagnosis.",
-                "conditions": [],
-                "recommendations": ["Consult a doctor"],
-                "confidence": 0.5
-            }
+            return self._fallback_symptom_response()
+    
+    async def stream_symptoms(
+        self,
+        message: str,
+        symptoms: Optional[List[str]] = None,
+        medical_history: Optional[List[str]] = None,
+        keyword_hits: Optional[List[KeywordHit]] = None
+    ) -> AsyncIterator[Dict]:
+        """Yield {"token": text} events as the reply is generated, then {"result": diagnosis}"""
+        
+        # Shares the non-streaming cache entry for the same question
+        prompt = self._build_symptom_prompt(message, symptoms, medical_history)
+        semantic_text = " ".join([message, *(symptoms or []), *(medical_history or [])])
+        cache = self.caches.get("symptoms")
+        
+        try:
+            if not self.providers.available:
+                result = self._mock_symptom_response(message, keyword_hits)
+            elif cache is not None and (cached := cache.get(prompt, semantic_text)) is not None:
+                result = cached
+            else:
+                reply = ""
+                sent = 0
+                split_at = -1
+                stream_prompt = self._build_symptom_prompt(message, symptoms, medical_history, streaming=True)
+                LLM_IN_FLIGHT.inc()
+                start = time.perf_counter()
+                try:
+                    async for chunk in self.providers.stream(stream_prompt):
+                        reply += chunk
+                        if split_at == -1:
+                            split_at = reply.find(STREAM_SEPARATOR)
+                            # Hold back a possible partial separator at the end
+                            end = split_at if split_at != -1 else len(reply) - len(STREAM_SEPARATOR) + 1
+                            if end > sent:
+                                yield {"token": reply[sent:end]}
+                                sent = end
+                finally:
+                    LLM_IN_FLIGHT.dec()
+                    LLM_SECONDS.labels("symptoms_stream", "provider").observe(time.perf_counter() - start)
+                
+                if split_at == -1:
+                    if len(reply) > sent:
+                        yield {"token": reply[sent:]}
+                    result = {**self._fallback_symptom_response(), "message": reply.strip()}
+                else:
+                    result = self._normalize_symptom_reply(
+                        self._parse_json(reply[split_at + len(STREAM_SEPARATOR):]),
+                        message=reply[:split_at].strip()
+                    )
+                if cache is not None:
+                    cache.put(prompt, semantic_text, result)
+                yield {"result": result}
+                return
+            
+            yield {"token": result["message"]}
+            yield {"result": result}
+        except Exception as e:
+            LLM_ERRORS.labels("symptoms_stream").inc()
+            logger.error(f"LLM streaming analysis error: {str(e)}")
+            yield {"result": self._fallback_symptom_response()}
+    
+    def _fallback_symptom_response(self) -> Dict:
+        return {
+            "message": "I've analyzed your symptoms. Please consult a healthcare provider for a proper diagnosis.",
+            "conditions": [],
+            "recommendations": ["Consult a doctor"],
+            "confidence": 0.5
+        }
     
-    async def check_drug_interactions(self, medications: List[str]) -> List[Dict]:
-        """Check for drug interactions using LLM"""
+    async def check_drug_interactions(
+        self,
+        medications: List[str],
+        unknown: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """Check for drug interactions using LLM
+        
+        With ``unknown``, only interactions involving those medications are
+        asked for; the pairs among the others are answered by the
+        interaction index.
+        """
         
+        focus = (
+            f"Only report interactions that involve at least one of: {', '.join(unknown)}"
+            if unknown else ""
+        )
         prompt = f"""
         Check for interactions between these medications: {', '.join(medications)}
+        {focus}
         
         For each interaction found, provide:
         - medications involved
@@ -52,13 +210,20 @@ class LLMService:
         - description of the interaction
         - clinical significance
         
-        Return as JSON array of interactions.
+        Respond only with a JSON array of objects with the keys
+        "medications" (list), "severity", "description",
+        "clinical_significance" and "recommendation".
+        Return an empty array if there are no interactions.
         """
         
         try:
-            # Mock response for demo
-            return self._mock_drug_interactions(medications)
+            if self.providers.available:
+                interactions = self._parse_json(await self._call_provider("interactions", prompt))
+                return interactions if isinstance(interactions, list) else []
+            # Without a provider only the interaction index can answer
+            return []
         except Exception as e:
+            LLM_ERRORS.labels("interactions").inc()
             logger.error(f"Drug interaction check error: {str(e)}")
             return []
     
@@ -78,16 +243,76 @@ class LLMService:
         """
         
         try:
+            if self.providers.available:
+                return await self._complete_cached(
+                    "terms", prompt, f"{term} {context or ''}", str.strip, max_tokens=512
+                )
             return self._mock_term_explanation(term)
         except Exception as e:
+            LLM_ERRORS.labels("terms").inc()
             logger.error(f"Term explanation error: {str(e)}")
             return f"{term} is a medical term. Please consult your healthcare provider for more information."
     
+    def _find_terms(self, text: str):
+        """Knowledge base terms named in a text, so similar cached answers
+        about different conditions are told apart"""
+        return find_terms(self.terms.__contains__, text)
+    
+    async def _complete_cached(
+        self,
+        endpoint: str,
+        prompt: str,
+        semantic_text: str,
+        parse: Callable[[str], Any],
+        **kwargs
+    ) -> Any:
+        """Complete a prompt through the endpoint's response cache, if enabled"""
+        cache = self.caches.get(endpoint)
+        if cache is not None:
+            start = time.perf_counter()
+            cached = cache.get(prompt, semantic_text)
+            if cached is not None:
+                LLM_SECONDS.labels(endpoint, "cache").observe(time.perf_counter() - start)
+                return cached
+        
+        result = parse(await self._call_provider(endpoint, prompt, **kwargs))
+        if cache is not None:
+            cache.put(prompt, semantic_text, result)
+        return result
+    
+    async def _call_provider(self, endpoint: str, prompt: str, **kwargs) -> str:
+        """Complete a prompt through the provider pool, timed per endpoint
+        
+        Concurrent calls with the same endpoint, normalized prompt and
+        options share one provider request. Replies are strings, so every
+        caller can parse its own result from the shared one.
+        """
+        if self.single_flight is None:
+            return await self._timed_complete(endpoint, prompt, **kwargs)
+        
+        key = (endpoint, normalize(prompt), tuple(sorted(kwargs.items())))
+        if key in self.single_flight:
+            LLM_COALESCED.labels(endpoint).inc()
+        return await self.single_flight.do(key, lambda: self._timed_complete(endpoint, prompt, **kwargs))
+    
+    async def _timed_complete(self, endpoint: str, prompt: str, **kwargs) -> str:
+        LLM_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            return await self.providers.complete(prompt, **kwargs)
+        finally:
+            LLM_IN_FLIGHT.dec()
+            LLM_SECONDS.labels(endpoint, "provider").observe(time.perf_counter() - start)
+    
+    def cache_stats(self) -> Dict:
+        return {name: cache.stats() for name, cache in self.caches.items()}
+    
     def _build_symptom_prompt(
         self,
         message: str,
         symptoms: Optional[List[str]],
-        medical_history: Optional[List[str]]
+        medical_history: Optional[List[str]],
+        streaming: bool = False
     ) -> str:
         """Build prompt for symptom analysis"""
         
@@ -112,13 +337,54 @@ class LLMService:
         immediately recommend calling emergency services.
         """
         
+        if streaming:
+            prompt += f"""
+        First write your response to the user as plain text. Then write a
+        line containing only {STREAM_SEPARATOR} followed by a JSON object
+        with the keys "conditions" (list), "recommendations" (list),
+        "follow_up_questions" (list) and "confidence" (0 to 1).
+        """
+        else:
+            prompt += """
+        Respond only with a JSON object with the keys "message",
+        "conditions" (list), "recommendations" (list),
+        "follow_up_questions" (list) and "confidence" (0 to 1).
+        """
+        
         return prompt
     
-    def _mock_symptom_response(self, message: str) -> Dict:
+    @staticmethod
+    def _parse_json(text: str) -> Union[Dict, List]:
+        """Parse a JSON reply, tolerating prose or code fences around it"""
+        starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+        if not starts:
+            raise ValueError("LLM reply contains no JSON")
+        start = min(starts)
+        end = text.rfind("}" if text[start] == "{" else "]")
+        return json.loads(text[start:end + 1])
+    
+    def _parse_symptom_response(self, text: str) -> Dict:
+        """Normalize an LLM symptom reply to the mock response shape"""
+        return self._normalize_symptom_reply(self._parse_json(text))
+    
+    def _normalize_symptom_reply(self, reply: Union[Dict, List], message: Optional[str] = None) -> Dict:
+        if not isinstance(reply, dict):
+            raise ValueError("Expected a JSON object")
+        return {
+            "message": message or str(reply.get("message", "I've analyzed your symptoms.")),
+            "conditions": list(reply.get("conditions") or []),
+            "recommendations": list(reply.get("recommendations") or []),
+            "follow_up_questions": list(reply.get("follow_up_questions") or []),
+            "confidence": float(reply.get("confidence", 0.5))
+        }
+    
+    def _mock_symptom_response(self, message: str, hits: Optional[List[KeywordHit]] = None) -> Dict:
         """Generate mock symptom response"""
-        message_lower = message.lower()
+        if hits is None:
+            hits = self.matcher.find_all(message)
+        matched = KeywordMatcher.pattern_ids(hits)
         
-        if any(kw in message_lower for kw in ['headache', 'head pain']):
+        if "mock:headache" in matched:
             return {
                 "message": "I understand you're experiencing headaches. This is a common symptom with many potential causes. Let me provide some information to help you understand what might be going on.",
                 "conditions": ["Tension headache", "Migraine", "Dehydration", "Stress headache"],
@@ -137,7 +403,7 @@ class LLMService:
                 ],
                 "confidence": 0.65
             }
-        elif any(kw in message_lower for kw in ['fever', 'temperature', 'hot']):
+        elif "mock:fever" in matched:
             return {
                 "message": "A fever indicates your body is fighting an infection. Let's understand more about what you're experiencing.",
                 "conditions": ["Viral infection", "Flu", "Common cold", "Bacterial infection"],
@@ -155,7 +421,7 @@ class LLMService:
                 ],
                 "confidence": 0.7
             }
-        elif any(kw in message_lower for kw in ['cough', 'coughing']):
+        elif "mock:cough" in matched:
             return {
                 "message": "Coughs can be caused by many things, from simple irritants to infections. Let me help you understand what might be causing yours.",
                 "conditions": ["Common cold", "Allergies", "Bronchitis", "Post-nasal drip"],
@@ -191,58 +457,12 @@ class LLMService:
                 "confidence": 0.4
             }
     
-    def _mock_drug_interactions(self, medications: List[str]) -> List[Dict]:
-        """Generate mock drug interactions"""
-        interactions = []
-        
-        med_names = [m.lower() for m in medications]
-        
-        # Common interactions
-        if any('warfarin' in m for m in med_names):
-            if any(nsaids := [m for m in med_names if m in ['aspirin', 'ibuprofen', 'naproxen']]):
-                interactions.append({
-                    "medications": ["warfarin", nsaids[0]],
-                    "severity": "high",
-                    "description": "Increased risk of bleeding",
-                    "clinical_significance": "Blood thinners and NSAIDs both increase bleeding risk. Combination significantly elevates risk of internal bleeding.",
-                    "recommendation": "Avoid this combination. Consult your doctor about alternative pain relief options."
-                })
-        
-        if any('lisinopril' in m for m in med_names):
-            if any('potassium' in m for m in med_names):
-                interactions.append({
-                    "medications": ["lisinopril", "potassium supplements"],
-                    "severity": "medium",
-                    "description": "Elevated potassium levels",
-                    "clinical_significance": "ACE inhibitors like lisinopril can increase potassium retention. Supplements may lead to dangerous hyperkalemia.",
-                    "recommendation": "Monitor potassium levels regularly. Discuss with your doctor."
-                })
-        
-        if any('metformin' in m for m in med_names):
-            if any('alcohol' in m for m in med_names):
-                interactions.append({
-                    "medications": ["metformin", "alcohol"],
-                    "severity": "medium",
-                    "description": "Increased risk of lactic acidosis",
-                    "clinical_significance": "Both substances can affect liver function and increase risk of rare but serious lactic acidosis.",
-                    "recommendation": "Limit or avoid alcohol while taking metformin. Discuss with your doctor."
-                })
-        
-        return interactions
-    
     def _mock_term_explanation(self, term: str) -> str:
-        """Generate mock term explanation"""
-        explanations = {
-            "hemoglobin": "Hemoglobin is a protein in your red blood cells that carries oxygen throughout your body. Normal levels are 12-17.5 g/dL. Low hemoglobin can indicate anemia.",
-            "glucose": "Glucose is the main type of sugar in your blood and the primary source of energy for your body's cells. Normal fasting glucose is 70-100 mg/dL.",
-            "cholesterol": "Cholesterol is a waxy substance found in your blood. Your body needs it to build cells, but too much can lead to heart problems. Total cholesterol should be under 200 mg/dL.",
-            "hypertension": "High blood pressure - when the force of blood against your artery walls is too high. Often called the 'silent killer' because it typically has no symptoms.",
-            "diabetes": "A condition where your body can't properly regulate blood sugar. This happens when your body doesn't produce enough insulin or becomes resistant to it."
-        }
-        
-        term_lower = term.lower()
-        for key, explanation in explanations.items():
-            if key in term_lower:
-                return explanation
+        """Explain a term from the knowledge base when no provider is configured"""
+        # Resolves abbreviations ("HGB") and typos ("hemoglobn") as well
+        resolved = find_phrase(self.term_index.resolve, normalize_term(term))
+        explanation = self.terms.get(resolved) if resolved is not None else None
+        if explanation is not None:
+            return explanation
         
         return f"{term} is a medical term related to your health. Please consult your healthcare provider for a detailed explanation specific to your situation."
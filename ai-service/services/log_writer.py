@@ -0,0 +1,194 @@
+"""
+Non-blocking structured logging
+A loguru sink that hands records to a background thread, which encodes
+them as JSON lines and writes them to a size-rotated file
+"""
+
+from typing import Dict, Optional
+from datetime import datetime, timedelta
+import glob
+import json
+import os
+import queue
+import random
+import threading
+import traceback
+
+from loguru import logger
+
+from services import metrics
+
+DROPPED = metrics.counter(
+    "log_records_dropped_total", "Log records not written, by reason", ("reason",)
+)
+QUEUE_DEPTH = metrics.gauge("log_queue_depth", "Log records waiting for the writer thread")
+
+# Levels at or above this are never sampled away
+SAMPLING_CEILING = 30  # WARNING
+
+_STOP = object()
+
+
+def _default(value):
+    # Extra fields are passed as live objects and only turned into text here
+    return str(value)
+
+
+def encode(record: Dict) -> str:
+    """One JSON line for a loguru record"""
+    entry = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "message": record["message"],
+        "module": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "process": record["process"].id,
+    }
+    if record["extra"]:
+        entry.update(record["extra"])
+    if record["exception"] is not None:
+        type_, value, tb = record["exception"]
+        entry["exception"] = "".join(traceback.format_exception(type_, value, tb))
+    return json.dumps(entry, default=_default, ensure_ascii=False) + "\n"
+
+
+class AsyncJsonSink:
+    """loguru sink whose caller only pays for a sampling check and a queue put
+
+    Records go onto a bounded queue; JSON encoding, conversion of extra
+    fields to text and file I/O happen on the writer thread. Below
+    WARNING, records are kept at ``sample_rate``, and at
+    ``backpressure_rate`` once the queue is more than half full. A record
+    that finds the queue full is dropped and counted rather than waited on.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        queue_size: Optional[int] = None,
+        sample_rate: Optional[float] = None,
+        backpressure_rate: Optional[float] = None,
+        rotation_bytes: Optional[int] = None,
+        retention_days: Optional[float] = None
+    ):
+        self.path = path
+        self.queue_size = queue_size or int(os.getenv("LOG_QUEUE_SIZE", 10000))
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+        self.backpressure_rate = (
+            backpressure_rate if backpressure_rate is not None
+            else float(os.getenv("LOG_BACKPRESSURE_SAMPLE_RATE", 0.1))
+        )
+        self.rotation_bytes = rotation_bytes or int(os.getenv("LOG_ROTATION_MB", 500)) * 1024 * 1024
+        self.retention = timedelta(days=retention_days or float(os.getenv("LOG_RETENTION_DAYS", 10)))
+
+        self._queue: "queue.Queue" = queue.Queue(self.queue_size)
+        self._high_water = self.queue_size // 2
+        self._random = random.random
+        self._file = None
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def accept(self, record: Dict) -> bool:
+        """loguru filter: decides sampling before the record is formatted"""
+        if record["level"].no >= SAMPLING_CEILING:
+            return True
+        rate = self.backpressure_rate if self._queue.qsize() > self._high_water else self.sample_rate
+        if rate >= 1.0 or self._random() < rate:
+            return True
+        DROPPED.labels("sampled").inc()
+        return False
+
+    def __call__(self, message):
+        try:
+            self._queue.put_nowait(message.record)
+        except queue.Full:
+            DROPPED.labels("queue_full").inc()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            # Drain whatever else is waiting so the file is written and
+            # flushed once per batch rather than once per record
+            while item is not _STOP and len(batch) < 1024:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            lines = []
+            for record in batch:
+                if record is _STOP:
+                    break
+                try:
+                    lines.append(encode(record))
+                except Exception as e:
+                    lines.append(json.dumps({"level": "ERROR", "message": f"Unencodable log record: {e!r}"}) + "\n")
+            try:
+                self._write("".join(lines))
+            except OSError:
+                DROPPED.labels("write_error").inc(len(lines))
+            QUEUE_DEPTH.set(self._queue.qsize())
+            if batch[-1] is _STOP:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write(self, data: str):
+        if not data:
+            return
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(data)
+        self._file.flush()
+        if self._file.tell() >= self.rotation_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+        os.replace(self.path, f"{self.path}.{stamp}")
+        cutoff = (datetime.now() - self.retention).timestamp()
+        for old in glob.glob(f"{glob.escape(self.path)}.*"):
+            try:
+                if os.path.getmtime(old) < cutoff:
+                    os.remove(old)
+            except OSError:
+                continue
+
+    def close(self, timeout: float = 5.0):
+        """Write out everything queued so far and stop the writer thread"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+
+def configure_logging(path: str = "logs/ai_service.log") -> Optional[AsyncJsonSink]:
+    """Install the service's log handler according to LOG_MODE
+
+    ``async`` (default) uses AsyncJsonSink; ``sync`` writes the same JSON
+    records from the calling coroutine through loguru's own file sink;
+    ``off`` disables logging. LOG_PATH overrides the file location.
+    """
+    path = os.getenv("LOG_PATH", path)
+    mode = os.getenv("LOG_MODE", "async").lower()
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    logger.remove()
+    if mode == "off":
+        return None
+    if mode == "sync":
+        logger.add(path, rotation="500 MB", retention="10 days", level=level, serialize=True)
+        return None
+
+    sink = AsyncJsonSink(path)
+    # The sink reads message.record, so the formatted text is never used
+    logger.add(sink, level=level, format="{message}", filter=sink.accept)
+    return sink
@@ -0,0 +1,439 @@
+"""
+Lightweight Prometheus-style metrics
+Counters, gauges and histograms kept in plain per-process objects and
+rendered in the Prometheus text format. With METRICS_DIR set, every
+worker writes periodic snapshots there and /metrics merges them
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from bisect import bisect_left
+from dataclasses import dataclass, field
+import asyncio
+import json
+import math
+import os
+import time
+
+from loguru import logger
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class _Timer:
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus +Inf; made cumulative when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+class Metric:
+    """A named metric family with one child per label combination
+
+    Observations only touch the child's own fields; there are no locks.
+    Each worker process aggregates its own values, and the event loop
+    runs one observation at a time.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _export(self, child):
+        return child.value
+
+    def family(self) -> "Family":
+        return Family(
+            self.name, self.kind, self.documentation, self.labelnames,
+            {labels: self._export(child) for labels, child in self._children.items()}
+        )
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _export(self, child):
+        return {"buckets": list(child.counts), "sum": child.sum}
+
+    def family(self) -> "Family":
+        family = super().family()
+        family.buckets = self.buckets
+        return family
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+
+@dataclass
+class Family:
+    name: str
+    kind: str
+    documentation: str
+    labelnames: Tuple[str, ...]
+    samples: Dict[Tuple[str, ...], object]
+    buckets: Tuple[float, ...] = field(default_factory=tuple)
+
+
+class Registry:
+    """Metrics of this process plus callbacks that report external state"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        # Idempotent, so re-importing a module returns the same metric
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        """Add a callback producing families at scrape time (cache and pool stats)"""
+        self._collectors.append(collector)
+
+    def collect(self) -> List[Family]:
+        families = [metric.family() for metric in self._metrics.values()]
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e!r}")
+        return families
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def _snapshot(families: List[Family]) -> Dict:
+    return {
+        family.name: {
+            "kind": family.kind,
+            "documentation": family.documentation,
+            "labelnames": list(family.labelnames),
+            "buckets": list(family.buckets),
+            "samples": [[list(labels), value] for labels, value in family.samples.items()]
+        }
+        for family in families
+    }
+
+
+def _merge(snapshots: Dict[int, Dict], live: Iterable[int]) -> List[Family]:
+    """Sum counters and histograms over workers; keep gauges per live worker"""
+    live = set(live)
+    merged: Dict[str, Family] = {}
+    for pid, snapshot in snapshots.items():
+        for name, data in snapshot.items():
+            gauge = data["kind"] == "gauge"
+            if gauge and pid not in live:
+                continue
+            labelnames = tuple(data["labelnames"]) + (("worker",) if gauge else ())
+            family = merged.get(name)
+            if family is None:
+                family = merged[name] = Family(
+                    name, data["kind"], data["documentation"], labelnames, {}, tuple(data["buckets"])
+                )
+            for labels, value in data["samples"]:
+                key = tuple(labels) + ((str(pid),) if gauge else ())
+                existing = family.samples.get(key)
+                if existing is None:
+                    family.samples[key] = value
+                elif family.kind == "histogram":
+                    family.samples[key] = {
+                        "buckets": [a + b for a, b in zip(existing["buckets"], value["buckets"])],
+                        "sum": existing["sum"] + value["sum"]
+                    }
+                else:
+                    family.samples[key] = existing + value
+    return list(merged.values())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render(families: List[Family]) -> str:
+    """Prometheus text exposition format"""
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {family.documentation}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for labels, value in family.samples.items():
+            if family.kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(list(family.buckets) + [math.inf], value["buckets"]):
+                    cumulative += count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{family.name}_bucket{_labels(family.labelnames, labels, le)} {cumulative}")
+                lines.append(f"{family.name}_sum{_labels(family.labelnames, labels)} {_number(value['sum'])}")
+                lines.append(f"{family.name}_count{_labels(family.labelnames, labels)} {cumulative}")
+            else:
+                lines.append(f"{family.name}{_labels(family.labelnames, labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Renders /metrics for one worker or, with METRICS_DIR, for all of them
+
+    In multi-worker mode each worker writes its snapshot to
+    ``<dir>/<pid>.json`` every ``interval`` seconds and on every scrape it
+    serves, then merges the snapshots of all workers. Counters of exited
+    workers keep counting toward the totals; their gauges are dropped.
+    """
+
+    def __init__(self, registry: Registry = REGISTRY, directory: Optional[str] = None, interval: Optional[float] = None):
+        self.registry = registry
+        self.directory = directory or os.getenv("METRICS_DIR")
+        self.interval = interval or float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+        self._task: Optional[asyncio.Task] = None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    async def start(self):
+        if self.directory and self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._write()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self._write_snapshot, _snapshot(self.registry.collect()))
+            except OSError as e:
+                logger.warning(f"Could not write metrics snapshot: {e!r}")
+
+    def _write(self):
+        self._write_snapshot(_snapshot(self.registry.collect()))
+
+    def _write_snapshot(self, snapshot: Dict):
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.tmp", path)
+
+    def render(self, families: Optional[List[Family]] = None) -> str:
+        """The exposition for a scrape
+
+        Metrics are updated on the event loop without locks, so an async
+        caller collects ``families`` there and runs this, which reads
+        and writes the snapshot files, in a thread.
+        """
+        if families is None:
+            families = self.registry.collect()
+        if not self.directory:
+            return render(families)
+
+        own = _snapshot(families)
+        self._write_snapshot(own)
+        snapshots = {os.getpid(): own}
+        live = {os.getpid()}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                pid = int(name[:-5])
+            except ValueError:
+                continue  # not a worker snapshot
+            if pid in snapshots:
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots[pid] = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _alive(pid):
+                live.add(pid)
+        return render(_merge(snapshots, live))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing requests per route template
+
+    Routes are labelled by their template (``/api/analyze-report``), never
+    by the raw path, so label cardinality stays bounded.
+    """
+
+    def __init__(self, app, registry: Registry = REGISTRY):
+        self.app = app
+        self.requests = registry.counter(
+            "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+        )
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+        )
+        self.in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being served")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            self.requests.labels(scope["method"], path, str(status)).inc()
+            self.latency.labels(scope["method"], path).observe(elapsed)
@@ -0,0 +1,246 @@
+"""
+OCR pipeline for medical reports
+OpenCV preprocessing followed by Tesseract, run in a bounded process pool
+so CPU-heavy work never blocks the event loop
+"""
+
+from typing import Callable, List, Optional, Union
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import os
+import signal
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+import pytesseract
+
+from services.preprocess import PreprocessCache, load_and_preprocess, preprocess
+
+PDF_DPI = 300
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+_PDFTOTEXT = ("pdftotext", "-layout", "-enc", "UTF-8")
+# Pages whose embedded text has fewer visible characters than this are
+# treated as scanned images and OCR'd
+MIN_TEXT_CHARS = 32
+
+# Preprocessed page images by content hash, shared by all pool workers
+PREPROCESSED = PreprocessCache()
+
+
+class OCRPoolSaturated(Exception):
+    """Raised when the OCR pool has no free worker or queue slot"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OCR pool saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class OCRError(RuntimeError):
+    """OCR failure that survives the trip back from a pool worker"""
+
+
+def init_worker():
+    # Workers are forked from the server, inheriting its signal handlers
+    # and the event loop's wakeup fd; a SIGTERM sent to a worker would
+    # otherwise be delivered to the server's loop and shut it down
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+class OCRPool:
+    """Bounded process pool for OCR jobs
+
+    At most ``workers`` jobs run at once and at most ``queue_depth`` more
+    wait for a worker. Anything beyond that is rejected immediately with
+    OCRPoolSaturated instead of piling up behind the running jobs.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_depth: Optional[int] = None,
+        retry_after: Optional[int] = None
+    ):
+        self.workers = workers or int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+        self.queue_depth = (
+            queue_depth if queue_depth is not None
+            else int(os.getenv("OCR_QUEUE_DEPTH", self.workers * 2))
+        )
+        self.retry_after = retry_after or int(os.getenv("OCR_RETRY_AFTER", 5))
+        self.in_flight = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_depth
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.capacity
+
+    async def run(self, func: Callable, *args, admitted: bool = False):
+        """Run func(*args) in a worker process, or reject if saturated
+
+        ``admitted`` skips the capacity check for follow-up jobs of work
+        that was already let in, such as the remaining pages of a report,
+        so it is not rejected halfway through.
+        """
+        if self.saturated and not admitted:
+            raise OCRPoolSaturated(self.retry_after)
+
+        if self._executor is None:
+            # Created lazily so importing the service never forks
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(func, *args)
+        self.in_flight += 1
+        # Released when the job ends, not when its caller stops waiting:
+        # a page job abandoned on early exit keeps its worker busy until
+        # it finishes, so it must still count against capacity
+        future.add_done_callback(lambda _: self._release(loop))
+        return await asyncio.wrap_future(future)
+
+    def _release(self, loop: asyncio.AbstractEventLoop):
+        # Done callbacks run on the executor's thread; the count is only
+        # changed on the loop
+        try:
+            loop.call_soon_threadsafe(self._done)
+        except RuntimeError:
+            # The loop is closed, so nothing else touches the count
+            self._done()
+
+    def _done(self):
+        self.in_flight -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def is_pdf(source: Union[str, bytes]) -> bool:
+    """Sniff the PDF magic number from a path or an in-memory upload"""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            head = f.read(5)
+    else:
+        head = bytes(source[:5])
+    return head == b"%PDF-"
+
+
+def prepare_pages(source: Union[str, bytes], digest: Optional[str] = None) -> List[np.ndarray]:
+    """Binary page images of a report, ready for Tesseract
+
+    With the upload's content hash, a photo preprocessed before (for
+    another report_type, say) comes from the cache without being decoded.
+    """
+    if is_pdf(source):
+        return [preprocess(page) for page in rasterize_pdf(source)]
+    return [cached_preprocess(digest, lambda: load_and_preprocess(source))]
+
+
+def cached_preprocess(key: Optional[str], build: Callable[[], np.ndarray]) -> np.ndarray:
+    """PREPROCESSED[key], built and stored on a miss; no caching without a key"""
+    binary = PREPROCESSED.get(key) if key else None
+    if binary is None:
+        binary = build()
+        if key:
+            PREPROCESSED.put(key, binary)
+    return binary
+
+
+def rasterize_pdf(source: Union[str, bytes], dpi: int = PDF_DPI) -> List[np.ndarray]:
+    """Render every PDF page to a grayscale image with poppler"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # pdftoppm reads the document from stdin when given "-"
+        in_memory = not isinstance(source, str)
+        subprocess.run(
+            ["pdftoppm", "-r", str(dpi), "-gray", "-png",
+             "-" if in_memory else source, os.path.join(tmp, "page")],
+            input=bytes(source) if in_memory else None,
+            check=True,
+            capture_output=True
+        )
+        # pdftoppm zero-pads page numbers, so name order is page order
+        return [
+            cv2.imread(os.path.join(tmp, name), cv2.IMREAD_GRAYSCALE)
+            for name in sorted(os.listdir(tmp))
+        ]
+
+
+def rasterize_pdf_page(path: str, page: int, dpi: int = PDF_DPI) -> np.ndarray:
+    """Render a single PDF page (1-based) to a grayscale image"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "page")
+        try:
+            subprocess.run(
+                ["pdftoppm", "-f", str(page), "-l", str(page), "-singlefile",
+                 "-r", str(dpi), "-gray", "-png", path, root],
+                check=True,
+                capture_output=True
+            )
+        except subprocess.CalledProcessError as e:
+            raise OCRError(f"Could not render page {page}: {e.stderr.decode(errors='replace').strip()}") from None
+        except OSError as e:
+            raise OCRError(f"Could not render page {page}: {e}") from None
+        image = cv2.imread(f"{root}.png", cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise OCRError(f"Could not render page {page}")
+    return image
+
+
+async def pdf_text_layer(path: str) -> List[str]:
+    """Embedded text of every page of a PDF; image-only pages come back empty
+
+    Runs poppler's pdftotext as a subprocess awaited on the event loop, so
+    it needs no pool worker.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *_PDFTOTEXT, path, "-",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    out, err = await process.communicate()
+    if process.returncode != 0:
+        raise OCRError(f"pdftotext failed: {err.decode(errors='replace').strip()}")
+    return _text_pages(out)
+
+
+def pdf_text_layer_sync(path: str) -> List[str]:
+    """pdf_text_layer for code already off the event loop, like pool workers"""
+    process = subprocess.run([*_PDFTOTEXT, path, "-"], capture_output=True)
+    if process.returncode != 0:
+        raise OCRError(f"pdftotext failed: {process.stderr.decode(errors='replace').strip()}")
+    return _text_pages(process.stdout)
+
+
+def _text_pages(out: bytes) -> List[str]:
+    # Every page, the last one included, ends with a form feed
+    pages = out.decode("utf-8", errors="replace").split("\f")
+    return pages[:-1] if len(pages) > 1 and not pages[-1].strip() else pages
+
+
+def has_text_layer(text: str) -> bool:
+    return sum(not c.isspace() for c in text) >= MIN_TEXT_CHARS
+
+
+def ocr_binary(binary: np.ndarray) -> str:
+    """Tesseract on an already preprocessed page image"""
+    try:
+        return pytesseract.image_to_string(binary, config=TESSERACT_CONFIG)
+    except pytesseract.TesseractNotFoundError as e:
+        # TesseractNotFoundError cannot be unpickled, which would break the pool
+        raise OCRError(str(e)) from None
+
+
+def ocr_image(image: np.ndarray) -> str:
+    return ocr_binary(preprocess(image))
+
+
+def ocr_file(source: Union[str, bytes], digest: Optional[str] = None) -> str:
+    """OCR every page of a report, pages separated by form feeds"""
+    return "\f".join(ocr_binary(page) for page in prepare_pages(source, digest))
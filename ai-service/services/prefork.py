@@ -0,0 +1,290 @@
+"""
+Pre-fork multi-process serving
+The master imports the app and warms its state once, freezes it out of
+the garbage collector and forks workers that share it copy-on-write and
+accept connections from one listening socket
+
+    python -m services.prefork --workers 4 --port 8000
+
+SIGHUP replaces the workers one at a time, each new one accepting before
+the old one stops; SIGTERM or SIGINT stops them all gracefully. A worker
+that dies is replaced, and workers stop on their own if the master dies.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+import argparse
+import asyncio
+import gc
+import importlib
+import os
+import select
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+import uvicorn
+from loguru import logger
+
+# A worker that dies sooner than this after starting is replaced only
+# after a pause, so a crash at startup does not become a fork loop
+MIN_WORKER_LIFETIME = 1.0
+POLL_INTERVAL = 0.2
+
+
+@dataclass
+class Worker:
+    pid: int
+    index: int
+    started_at: float
+    # Read end of the pipe the worker writes to once it is accepting
+    ready_fd: Optional[int] = None
+
+
+class Master:
+    """Forks and supervises the workers of one listening socket
+
+    ``app`` is a ``module:attribute`` path. The module may define
+    ``warm_up()`` and ``before_fork()``, run once in the master, and
+    ``init_worker()``, run first thing in every worker.
+    """
+
+    def __init__(
+        self,
+        app: str = "main:app",
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        workers: Optional[int] = None,
+        backlog: int = 2048,
+        graceful_timeout: Optional[float] = None,
+        freeze: bool = True
+    ):
+        self.app_path = app
+        self.host = host
+        self.port = port
+        self.workers = workers or int(os.getenv("WEB_WORKERS", os.cpu_count() or 1))
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout or float(os.getenv("WEB_GRACEFUL_TIMEOUT", 30))
+        self.freeze = freeze
+        self.module = None
+        self.app = None
+        self.sock: Optional[socket.socket] = None
+        self.current: Dict[int, Worker] = {}
+        self.retiring: Set[int] = set()
+        self._signals: List[int] = []
+        self._metrics_dir: Optional[str] = None
+
+    def run(self):
+        # Objects created and freed while importing would leave holes in
+        # pages the workers share; collect once, just before forking
+        gc.disable()
+        self._configure_env()
+        self.sock = self._bind()
+        module_name, attribute = self.app_path.split(":")
+        self.module = importlib.import_module(module_name)
+        self.app = getattr(self.module, attribute)
+        self._hook("warm_up")
+        self._hook("before_fork")
+        gc.collect()
+        if self.freeze:
+            gc.freeze()
+        else:
+            gc.enable()
+
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        for index in range(self.workers):
+            self._spawn(index)
+        for worker in list(self.current.values()):
+            self._wait_ready(worker)
+        logger.info("Pre-fork master serving", pid=os.getpid(), port=self.port, workers=self.workers)
+
+        try:
+            while True:
+                # Before reaping: Ctrl-C also reaches the workers, which
+                # must not be replaced as they exit
+                if self._stopping:
+                    break
+                self._reap()
+                if signal.SIGHUP in self._signals:
+                    self._signals.clear()
+                    self._restart()
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self._stop()
+
+    @property
+    def _stopping(self) -> bool:
+        return signal.SIGTERM in self._signals or signal.SIGINT in self._signals
+
+    def _configure_env(self):
+        # Set before the app is imported, since its services read them then
+        os.environ.setdefault("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // self.workers)))
+        if not os.getenv("METRICS_DIR"):
+            self._metrics_dir = tempfile.mkdtemp(prefix="metrics-")
+            os.environ["METRICS_DIR"] = self._metrics_dir
+
+    def _bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        return sock
+
+    def _hook(self, name: str):
+        hook = getattr(self.module, name, None)
+        if hook is not None:
+            hook()
+
+    def _spawn(self, index: int) -> Worker:
+        ready_read, ready_write = os.pipe()
+        master_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            self._child(ready_write, master_pid)
+        os.close(ready_write)
+        worker = self.current[pid] = Worker(pid, index, time.monotonic(), ready_read)
+        return worker
+
+    def _child(self, ready_fd: int, master_pid: int):
+        code = 1
+        try:
+            gc.enable()
+            for worker in self.current.values():
+                if worker.ready_fd is not None:
+                    os.close(worker.ready_fd)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            self._hook("init_worker")
+            asyncio.run(self._serve(ready_fd, master_pid))
+            code = 0
+        except BaseException:
+            logger.exception("Worker failed")
+        finally:
+            # Never return into the master's code
+            os._exit(code)
+
+    async def _serve(self, ready_fd: int, master_pid: int):
+        config = uvicorn.Config(
+            self.app, lifespan="on", log_level="warning",
+            timeout_graceful_shutdown=int(self.graceful_timeout)
+        )
+        server = uvicorn.Server(config)
+        serving = asyncio.create_task(server.serve(sockets=[self.sock]))
+        watching = asyncio.create_task(self._watch_master(server, master_pid))
+        while not server.started and not serving.done():
+            await asyncio.sleep(0.05)
+        if server.started:
+            os.write(ready_fd, b"1")
+        os.close(ready_fd)
+        await serving
+        watching.cancel()
+
+    @staticmethod
+    async def _watch_master(server: uvicorn.Server, master_pid: int):
+        # A master killed outright cannot stop its workers; they notice
+        # being reparented and shut down instead of serving unsupervised
+        while os.getppid() == master_pid:
+            await asyncio.sleep(POLL_INTERVAL)
+        logger.warning("Master exited, stopping worker", pid=os.getpid(), master=master_pid)
+        server.should_exit = True
+
+    def _wait_ready(self, worker: Worker, timeout: float = 60.0) -> bool:
+        readable, _, _ = select.select([worker.ready_fd], [], [], timeout)
+        ready = bool(readable) and os.read(worker.ready_fd, 1) == b"1"
+        os.close(worker.ready_fd)
+        worker.ready_fd = None
+        return ready
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            worker = self.current.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+            if self._stopping:
+                continue
+            logger.warning("Worker exited, replacing it", pid=pid, status=status)
+            if time.monotonic() - worker.started_at < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            self._spawn(worker.index)
+
+    def _restart(self):
+        """Replace every worker, starting each replacement before stopping its predecessor"""
+        logger.info("Restarting workers")
+        for old in sorted(self.current.values(), key=lambda w: w.index):
+            new = self._spawn(old.index)
+            if not self._wait_ready(new):
+                logger.error("Replacement worker did not start; keeping the old one", pid=new.pid)
+                self.current.pop(new.pid, None)
+                self.retiring.add(new.pid)
+                _signal(new.pid, signal.SIGKILL)
+                continue
+            # The listening socket stays open in the other workers, so
+            # connections waiting in the backlog are still accepted
+            del self.current[old.pid]
+            self.retiring.add(old.pid)
+            _signal(old.pid, signal.SIGTERM)
+
+    def _stop(self):
+        pids = set(self.current) | self.retiring
+        for pid in pids:
+            _signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while pids and time.monotonic() < deadline:
+            for pid in list(pids):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                        pids.discard(pid)
+                except ChildProcessError:
+                    pids.discard(pid)
+            time.sleep(0.05)
+        for pid in pids:
+            _signal(pid, signal.SIGKILL)
+        self.sock.close()
+        if self._metrics_dir is not None:
+            shutil.rmtree(self._metrics_dir, ignore_errors=True)
+        logger.info("Pre-fork master stopped")
+
+
+def _signal(pid: int, signum: int):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app from workers forked off one warmed master")
+    parser.add_argument("--app", default="main:app", help="module:attribute of the ASGI app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, help="worker processes (default: WEB_WORKERS or all cores)")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--graceful-timeout", type=float, help="seconds a stopping worker may finish requests")
+    parser.add_argument("--no-gc-freeze", action="store_true", help="skip gc.freeze() before forking")
+    args = parser.parse_args()
+    Master(
+        args.app, args.host, args.port, args.workers, args.backlog,
+        args.graceful_timeout, freeze=not args.no_gc_freeze
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
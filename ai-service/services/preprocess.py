@@ -0,0 +1,310 @@
+"""
+Image preprocessing ahead of OCR
+Scales page images to a target text height, deskews, binarizes and crops
+them to the text, and caches the result on disk by content hash
+"""
+
+from typing import Optional, Tuple, Union
+from dataclasses import dataclass
+import os
+import time
+
+import cv2
+import numpy as np
+from loguru import logger
+
+# Tesseract reads best when characters are roughly 20-40 px tall
+TARGET_TEXT_HEIGHT = 32
+# Text height and skew are measured on a copy with this long side
+PREVIEW_SIDE = 1000
+MAX_SKEW = 10.0  # degrees
+# Part of every cache key; bump whenever the output of preprocess() changes
+PREPROCESS_VERSION = "1"
+
+
+@dataclass
+class Layout:
+    """Where the text is on a page image, measured on a small preview"""
+    text_height: float  # median character height, in page image pixels
+    angle: float  # rotation in degrees that levels the text lines
+    box: Tuple[int, int, int, int]  # x0, y0, x1, y1 of the text, in page image pixels
+
+
+def _text_mask(preview: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pixels of character-shaped components and their bounding boxes (x, y, w, h)
+
+    Rules, table borders, the desk around the page and specks are left out.
+    """
+    binary = cv2.adaptiveThreshold(
+        preview, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10
+    )
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    height, width = binary.shape
+    w, h, area = stats[:, 2], stats[:, 3], stats[:, 4]
+    keep = (
+        (area >= 4) & (h >= 3) & (h <= height / 10) & (w <= width / 5)
+        & (w < 6 * h) & (h < 6 * w + 6)
+    )
+    keep[0] = False  # background
+    return keep[labels].astype(np.uint8), stats[keep, :4]
+
+
+def estimate_skew(mask: np.ndarray, max_angle: float = MAX_SKEW) -> float:
+    """Rotation in degrees that makes text lines horizontal
+
+    Projection-profile search: the angle at which the text pixels, rotated
+    and counted per row, pile up most sharply is the one where lines line
+    up. Only the coordinates of text pixels are rotated, not the image,
+    so each candidate angle costs one bincount. A coarse pass in 1 degree
+    steps is refined in 0.1 degree steps.
+    """
+    ys, xs = np.nonzero(mask)
+    if len(xs) == 0:
+        return 0.0
+    xs = xs.astype(np.float32)
+    ys = ys.astype(np.float32)
+    offset = float(np.hypot(*mask.shape))
+
+    def score(angle: float) -> float:
+        theta = np.deg2rad(angle)
+        # Row of each pixel after cv2.getRotationMatrix2D(..., angle, 1)
+        rows = (ys * np.cos(theta) - xs * np.sin(theta) + offset).astype(np.int64)
+        counts = np.bincount(rows)
+        # Same total over every angle, so the sum of squares ranks variance
+        return float(np.dot(counts, counts))
+
+    coarse = max(np.arange(-max_angle, max_angle + 0.5, 1.0), key=score)
+    return float(max(np.arange(coarse - 1.0, coarse + 1.05, 0.1), key=score))
+
+
+def analyze_layout(preview: np.ndarray, shape: Tuple[int, int]) -> Optional[Layout]:
+    """Text height, skew and text box of a page, or None if no text is found
+
+    Measured on ``preview``, a reduced copy of a page image of ``shape``.
+    """
+    factor = preview.shape[1] / shape[1]
+    mask, boxes = _text_mask(preview)
+    if len(boxes) < 20:
+        return None
+    margin = np.median(boxes[:, 3]) * 2
+    box = (
+        boxes[:, 0].min() - margin, boxes[:, 1].min() - margin,
+        (boxes[:, 0] + boxes[:, 2]).max() + margin, (boxes[:, 1] + boxes[:, 3]).max() + margin
+    )
+    height, width = shape
+    x0, y0, x1, y1 = (int(round(v / factor)) for v in box)
+    return Layout(
+        text_height=float(np.median(boxes[:, 3])) / factor,
+        angle=estimate_skew(mask),
+        box=(max(x0, 0), max(y0, 0), min(x1, width), min(y1, height))
+    )
+
+
+def rotate(gray: np.ndarray, angle: float) -> np.ndarray:
+    """Rotate, growing the canvas so no corner is cut off"""
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_width, new_height = int(height * sin + width * cos), int(height * cos + width * sin)
+    matrix[0, 2] += new_width / 2 - width / 2
+    matrix[1, 2] += new_height / 2 - height / 2
+    background = int(np.median(gray[::8, ::8]))
+    return cv2.warpAffine(
+        gray, matrix, (new_width, new_height),
+        flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=background
+    )
+
+
+def binarize(gray: np.ndarray) -> np.ndarray:
+    """Black text on white, robust to uneven lighting"""
+    gray = cv2.medianBlur(gray, 3)
+    return cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10
+    )
+
+
+def _scale_for(layout: Optional[Layout]) -> float:
+    if layout is None:
+        return 1.0
+    # Downscale freely, upscale small print at most twofold
+    return min(TARGET_TEXT_HEIGHT / layout.text_height, 2.0)
+
+
+def _finish(gray: np.ndarray, layout: Optional[Layout], reduction: int = 1) -> np.ndarray:
+    """Crop, scale, deskew and binarize a page image
+
+    ``gray`` may be a reduced decode of the page the layout was measured
+    on, ``reduction`` times smaller on each side.
+    """
+    if layout is not None:
+        x0, y0, x1, y1 = (v // reduction for v in layout.box)
+        # Slicing is a view; the full page is never copied
+        gray = gray[y0:y1, x0:x1]
+    scale = _scale_for(layout) * reduction
+    if abs(scale - 1.0) > 0.15:
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
+    if layout is not None and abs(layout.angle) >= 0.4:
+        gray = rotate(gray, layout.angle)
+    return binarize(gray)
+
+
+def preprocess(image: np.ndarray) -> np.ndarray:
+    """Turn a decoded page image into a clean binary image for Tesseract"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    factor = min(1.0, PREVIEW_SIDE / max(image.shape))
+    preview = image if factor == 1.0 else cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    return _finish(image, analyze_layout(preview, image.shape))
+
+
+# Decoder reductions OpenCV applies while decoding; JPEGs are scaled in
+# the DCT, so the full-size image is never allocated
+_REDUCED = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+def _decode(source: Union[str, bytes], reduction: int) -> Optional[np.ndarray]:
+    flags = _REDUCED.get(reduction, cv2.IMREAD_GRAYSCALE)
+    if isinstance(source, str):
+        return cv2.imread(source, flags)
+    # frombuffer wraps the upload without copying it
+    return cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flags)
+
+
+def load_and_preprocess(source: Union[str, bytes]) -> np.ndarray:
+    """Decode an image file at the resolution OCR needs and preprocess it
+
+    A quarter-resolution decode is enough to find the text and measure
+    its height and skew. The image is then decoded again at the largest
+    reduction that still leaves the text at least TARGET_TEXT_HEIGHT
+    tall, so a 12 MP phone photo is never held at full size when its
+    print is large.
+    """
+    preview = _decode(source, 4)
+    if preview is None:
+        raise ValueError("Unsupported or unreadable report file")
+    if max(preview.shape) < PREVIEW_SIDE:
+        # Small image: the quarter decode is too coarse to measure
+        return preprocess(_decode(source, 1))
+
+    # The layout is expressed in full-resolution pixels
+    layout = analyze_layout(preview, (preview.shape[0] * 4, preview.shape[1] * 4))
+    reduction = 1
+    for candidate in (8, 4, 2):
+        if _scale_for(layout) * candidate <= 1.0:
+            reduction = candidate
+            break
+    return _finish(_decode(source, reduction), layout, reduction)
+
+
+class PreprocessCache:
+    """Preprocessed page images on disk, keyed by content hash
+
+    Shared by every OCR worker process. Entries are 1-bit PNGs, typically
+    a few tens of KB per page; the least recently used are removed once
+    the directory exceeds ``max_bytes``.
+
+    Entries are images of patient reports, so the cache is off unless
+    OCR_CACHE_DIR is set. The directory is created with mode 0o700; one
+    owned by another user or open to other users is not used, since
+    anyone able to write there could plant the OCR input of someone
+    else's report.
+
+    Each process tracks the directory size from its own writes and only
+    scans it when that estimate crosses ``max_bytes``, or every
+    ``RESCAN_INTERVAL`` seconds to pick up other processes' writes. A scan
+    evicts down to ``LOW_WATER`` of the limit, so the next one is not due
+    on the following put.
+    """
+
+    RESCAN_INTERVAL = 60.0
+    LOW_WATER = 0.9
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        if directory is None:
+            directory = os.getenv("OCR_CACHE_DIR", "")
+        self.directory = directory or None
+        self._checked = False
+        self.max_bytes = max_bytes or int(os.getenv("OCR_CACHE_MB", 256)) * 1024 * 1024
+        self._size: Optional[int] = None  # unknown until the first scan
+        self._scanned_at = 0.0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key.replace(':', '-')}-v{PREPROCESS_VERSION}.png")
+
+    def _usable(self) -> bool:
+        """Whether the directory exists, or was created, private to this user"""
+        if not self._checked:
+            self._checked = True
+            try:
+                os.makedirs(self.directory, mode=0o700, exist_ok=True)
+                st = os.stat(self.directory)
+            except OSError as e:
+                logger.warning("OCR cache disabled: directory unusable", directory=self.directory, error=str(e))
+                self.directory = None
+                return False
+            if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                logger.warning(
+                    "OCR cache disabled: directory must be owned by this user with mode 0o700",
+                    directory=self.directory
+                )
+                self.directory = None
+        return self.directory is not None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        if not self.directory or not self._usable():
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                encoded = f.read()
+            # Touch for least-recently-used eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+    def put(self, key: str, binary: np.ndarray):
+        if not self.directory or not self._usable():
+            return
+        ok, encoded = cv2.imencode(".png", binary, [cv2.IMWRITE_PNG_BILEVEL, 1])
+        if not ok:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(encoded.tobytes())
+            os.replace(tmp, path)
+        except OSError:
+            return
+        if self._size is not None:
+            self._size += encoded.nbytes
+        if self._size is None or self._size > self.max_bytes or time.time() - self._scanned_at > self.RESCAN_INTERVAL:
+            try:
+                self._evict()
+            except OSError:
+                pass
+
+    def _evict(self):
+        self._scanned_at = time.time()
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        if total > self.max_bytes:
+            target = self.max_bytes * self.LOW_WATER
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        self._size = total
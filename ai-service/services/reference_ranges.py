@@ -0,0 +1,154 @@
+"""
+Reference ranges by test, sex and age band
+One structured array holds the resolved range of every combination, so a
+whole batch of values is classified with a few array operations
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+SEXES = ("any", "female", "male", "pregnant")
+AGE_BANDS = ("child", "adolescent", "adult", "older")
+# Lower edge, in years, of every band after the first
+AGE_EDGES = np.array([12.0, 18.0, 65.0])
+ADULT = AGE_BANDS.index("adult")
+
+# Status codes as stored in bulk ingestion output: below, inside, above
+STATUSES = {-1: "low", 0: "normal", 1: "high"}
+# Severity by distance outside the range; beyond half the range's width
+# is high. "low" is a value inside the range
+SEVERITIES = ("low", "moderate", "high")
+HIGH_SEVERITY_WIDTHS = 0.5
+
+BOUNDS = np.dtype([("low", "<f8"), ("high", "<f8")])
+CLASSIFIED = np.dtype([("status", "i1"), ("severity", "i1"), ("low", "<f8"), ("high", "<f8")])
+
+# Ranges that differ from a test's default, as (test, sex, age band, low,
+# high); None matches any sex or age band. Typical published intervals;
+# individual labs differ slightly
+DEMOGRAPHIC_RANGES = [
+    ("hemoglobin", "female", None, 12.0, 15.5),
+    ("hemoglobin", "male", None, 13.5, 17.5),
+    ("hemoglobin", "pregnant", None, 11.0, 14.0),
+    ("hemoglobin", None, "child", 11.5, 15.5),
+    ("hemoglobin", "female", "adolescent", 12.0, 16.0),
+    ("hemoglobin", "male", "adolescent", 13.0, 16.0),
+    ("wbc", None, "child", 5.0, 14.5),
+    ("wbc", "pregnant", None, 5.7, 13.6),
+    ("glucose_fasting", "pregnant", None, 60, 92),
+    ("cholesterol_total", None, "child", 0, 170),
+    ("cholesterol_total", None, "adolescent", 0, 170),
+    ("ldl", None, "child", 0, 110),
+    ("ldl", None, "adolescent", 0, 110),
+    ("hdl", "female", None, 50, 60),
+    ("hdl", None, "child", 45, 60),
+    ("hdl", None, "adolescent", 45, 60),
+    ("triglycerides", None, "child", 0, 75),
+    ("triglycerides", None, "adolescent", 0, 90),
+    ("creatinine", "female", None, 0.59, 1.04),
+    ("creatinine", "male", None, 0.74, 1.35),
+    ("creatinine", "pregnant", None, 0.4, 0.8),
+    ("creatinine", None, "child", 0.3, 0.7),
+    ("creatinine", None, "adolescent", 0.5, 1.0),
+    ("alt", "female", None, 7, 45),
+    ("alt", "male", None, 7, 56),
+]
+
+
+@dataclass(frozen=True)
+class Demographics:
+    """What a patient's reference ranges depend on; all optional"""
+    sex: Optional[str] = None
+    age: Optional[float] = None
+    pregnant: bool = False
+
+    @property
+    def sex_code(self) -> int:
+        sex = (self.sex or "").strip().lower()[:1]
+        if self.pregnant and sex != "m":
+            return SEXES.index("pregnant")
+        return {"f": SEXES.index("female"), "m": SEXES.index("male")}.get(sex, 0)
+
+    @property
+    def band(self) -> int:
+        return int(age_bands(self.age)) if self.age is not None else ADULT
+
+    @property
+    def key(self) -> str:
+        """Identifies the ranges in effect, for cache keys"""
+        return f"{SEXES[self.sex_code]}:{AGE_BANDS[self.band]}"
+
+
+def age_bands(ages: Union[float, np.ndarray]) -> np.ndarray:
+    """Age band index of each age in years; unknown (NaN) ages count as adult"""
+    ages = np.asarray(ages, dtype=np.float64)
+    return np.where(np.isnan(ages), ADULT, np.searchsorted(AGE_EDGES, ages, side="right"))
+
+
+class ReferenceRanges:
+    """Resolved ranges for every (test, sex, age band), as one array
+
+    ``table[test, sex, band]`` is the range that applies. Each cell is
+    filled once, at construction, from the most specific row that
+    covers it: an age band match beats a sex match, pregnancy falls back
+    to female, and a test's default range covers everything else. A
+    patient whose sex and age are unknown gets the defaults.
+    """
+
+    def __init__(self, defaults: Dict[str, Dict], rows: Iterable[Tuple] = DEMOGRAPHIC_RANGES):
+        self.tests = tuple(defaults)
+        self.codes = {test: code for code, test in enumerate(self.tests)}
+        specific = {(test, sex, band): (low, high) for test, sex, band, low, high in rows}
+
+        self.table = np.empty((len(self.tests), len(SEXES), len(AGE_BANDS)), dtype=BOUNDS)
+        for code, test in enumerate(self.tests):
+            default = (defaults[test]["normal_min"], defaults[test]["normal_max"])
+            for sex_code, sex in enumerate(SEXES):
+                sexes = [s for s in (sex, "female" if sex == "pregnant" else None) if s and s != "any"]
+                for band_code, band in enumerate(AGE_BANDS):
+                    candidates = [(s, band) for s in sexes] + [(None, band)] + [(s, None) for s in sexes]
+                    self.table[code, sex_code, band_code] = next(
+                        (specific[(test, *c)] for c in candidates if (test, *c) in specific), default
+                    )
+        # Flat, contiguous copies for gathering one range per value
+        self._low = np.ascontiguousarray(self.table["low"].ravel())
+        self._high = np.ascontiguousarray(self.table["high"].ravel())
+        self._high_severity = HIGH_SEVERITY_WIDTHS * (self._high - self._low)
+
+    def test_codes(self, tests: Sequence[str]) -> np.ndarray:
+        return np.fromiter((self.codes[test] for test in tests), dtype=np.int16, count=len(tests))
+
+    def classify(
+        self,
+        tests: np.ndarray,
+        values: np.ndarray,
+        sexes: Union[int, np.ndarray] = 0,
+        bands: Union[int, np.ndarray] = ADULT
+    ) -> np.ndarray:
+        """Status, severity and range of each value, as a CLASSIFIED array
+
+        ``tests`` are test codes; ``sexes`` and ``bands`` are codes per
+        value or one for the whole batch.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        index = (np.asarray(tests, dtype=np.intp) * len(SEXES) + sexes) * len(AGE_BANDS) + bands
+        low, high = self._low.take(index), self._high.take(index)
+
+        # Positive on the side the value is out of range, if any
+        below = low - values
+        above = values - high
+        distance = np.maximum(below, above)
+        result = np.empty(len(values), dtype=CLASSIFIED)
+        result["status"] = (above > 0).view(np.int8) - (below > 0).view(np.int8)
+        result["severity"] = (distance > 0).view(np.int8) + (distance > self._high_severity.take(index)).view(np.int8)
+        result["low"] = low
+        result["high"] = high
+        return result
+
+    def ranges(self, demographics: Optional[Demographics] = None) -> Dict[str, Tuple[float, float]]:
+        """(low, high) of every test for one patient"""
+        demographics = demographics or Demographics()
+        cells = self.table[:, demographics.sex_code, demographics.band]
+        return {test: (float(low), float(high)) for test, (low, high) in zip(self.tests, cells.tolist())}
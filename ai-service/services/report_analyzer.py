@@ -2,9 +2,29 @@
 Medical report analyzer using OCR and pattern matching
 """
 
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple, Union
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
+import asyncio
 import re
+import tempfile
+import time
+
+from services import metrics
+from services.ocr import (
+    OCRError, OCRPool, cached_preprocess, has_text_layer, is_pdf, ocr_binary, pdf_text_layer,
+    prepare_pages, preprocess, rasterize_pdf_page
+)
+from services.reference_ranges import SEVERITIES, STATUSES, Demographics, ReferenceRanges
+
+# One histogram for every stage of a report analysis, including the
+# upload and serialization stages timed in main.py
+STAGE_SECONDS = metrics.histogram(
+    "report_stage_seconds", "Time spent in each stage of report analysis", ("stage",)
+)
+REPORT_PAGES = metrics.counter(
+    "report_pages_total", "PDF pages by how their text was obtained: text layer, OCR, skipped or failed", ("method",)
+)
 
 @dataclass
 class LabValue:
@@ -22,9 +42,128 @@ class LabValue:
             return "high"
         return "normal"
 
+class LabPatternMatcher:
+    """Single-pass matcher over every lab test pattern.
+
+    The literal prefix of each pattern (``hemoglobin``, ``hgb``, ``wbc``...)
+    is folded into one trie-shaped regex that is run once over the text.
+    Only positions where a prefix occurs are verified against the full
+    precompiled patterns, so the cost of a scan no longer grows with the
+    number of tests. Results keep the semantics of searching each test's
+    patterns in order: the first pattern that matches anywhere in the text
+    wins, at its leftmost position.
+    """
+
+    PREFIX_RE = re.compile(r"^[A-Za-z0-9]+")
+
+    def __init__(self, lab_patterns: Dict[str, Dict]):
+        self.tests = list(lab_patterns)
+        # (test name, pattern index, literal prefix, compiled pattern)
+        self._prefixed: List[Tuple[str, int, str, re.Pattern]] = []
+        self._unprefixed: List[Tuple[str, int, re.Pattern]] = []
+
+        for test_name, config in lab_patterns.items():
+            for index, pattern in enumerate(config["patterns"]):
+                compiled = re.compile(pattern, re.IGNORECASE)
+                prefix = self._literal_prefix(pattern)
+                if prefix:
+                    self._prefixed.append((test_name, index, prefix, compiled))
+                else:
+                    self._unprefixed.append((test_name, index, compiled))
+
+        trie = self._trie_regex([prefix for _, _, prefix, _ in self._prefixed])
+        self._trigger = re.compile(trie) if trie else None
+        self._trigger_ignorecase = re.compile(trie, re.IGNORECASE) if trie else None
+
+    @classmethod
+    def _literal_prefix(cls, pattern: str) -> str:
+        """Leading run of plain characters every match must start with"""
+        match = cls.PREFIX_RE.match(pattern)
+        if not match:
+            return ""
+        prefix = match.group(0)
+        # A quantifier applies to the last character, so it is optional
+        if pattern[len(prefix):len(prefix) + 1] in ("?", "*", "{"):
+            prefix = prefix[:-1]
+        return prefix.lower()
+
+    @staticmethod
+    def _trie_regex(words: List[str]) -> str:
+        """Build a prefix-factored alternation matching any of words"""
+        root: Dict = {}
+        for word in words:
+            node = root
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        def build(node: Dict) -> str:
+            branches = [
+                re.escape(char) + build(child)
+                for char, child in sorted(node.items())
+                if char
+            ]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+            return f"(?:{body})?" if "" in node else body
+
+        return build(root)
+
+    def search(self, text: str) -> Dict[str, re.Match]:
+        """Return the winning match for every test found in text"""
+        best: Dict[str, Tuple[int, re.Match]] = {}
+        unsettled = len(self.tests)
+
+        def offer(test_name: str, index: int, match: re.Match):
+            nonlocal unsettled
+            best[test_name] = (index, match)
+            if index == 0:
+                unsettled -= 1
+
+        for test_name, index, compiled in self._unprefixed:
+            match = compiled.search(text)
+            if match:
+                current = best.get(test_name)
+                if current is None or index < current[0]:
+                    offer(test_name, index, match)
+
+        if self._trigger is not None:
+            lowered = text.lower()
+            trigger = self._trigger
+            if len(lowered) != len(text):
+                # Case mapping shifted offsets; scan the original instead
+                lowered, trigger = None, self._trigger_ignorecase
+
+            hit = trigger.search(lowered if lowered is not None else text)
+            while hit is not None and unsettled:
+                pos = hit.start()
+                for test_name, index, prefix, compiled in self._prefixed:
+                    current = best.get(test_name)
+                    if current is not None and current[0] <= index:
+                        continue
+                    if lowered is not None and not lowered.startswith(prefix, pos):
+                        continue
+                    match = compiled.match(text, pos)
+                    if match:
+                        offer(test_name, index, match)
+                # Resume one character on so overlapping prefixes are seen
+                hit = trigger.search(lowered if lowered is not None else text, pos + 1)
+
+        return {
+            test_name: best[test_name][1]
+            for test_name in self.tests
+            if test_name in best
+        }
+
+
 class ReportAnalyzer:
     """Analyze medical reports using OCR and pattern matching"""
     
+    # Part of every cached result's key; bump whenever OCR, extraction or
+    # interpretation changes so stale analyses are not served
+    VERSION = "5"
+    
     # Common lab test patterns and normal ranges
     LAB_PATTERNS = {
         "hemoglobin": {
@@ -112,84 +251,311 @@ class ReportAnalyzer:
             "explanation": "Liver enzyme - elevated may indicate liver damage"
         }
     }
+
+    # Compiled once at class load and shared by every instance
+    matcher = LabPatternMatcher(LAB_PATTERNS)
+    # The normal_min/normal_max above are the defaults, used when the
+    # patient's sex and age are unknown
+    ranges = ReferenceRanges(LAB_PATTERNS)
     
-    async def analyze(self, file_path: str, report_type: str) -> Dict:
-        """Analyze medical report and extract values"""
+    def __init__(self, ocr_pool: Optional[OCRPool] = None):
+        self.ocr_pool = ocr_pool or OCRPool()
+    
+    async def analyze(
+        self,
+        source: Union[str, bytes],
+        report_type: str,
+        digest: Optional[str] = None,
+        demographics: Optional[Demographics] = None
+    ) -> Dict:
+        """Analyze a medical report given as a file path or raw bytes
+        
+        ``digest`` is the upload's content hash; with it, preprocessed
+        page images are cached and reused across report types. Values
+        are classified against the ranges for ``demographics``.
+        """
         
-        # In production, this would:
-        # 1. Use OCR (pytesseract, AWS Textract, or Google Vision)
-        # 2. Process the extracted text
-        # 3. Match patterns against known lab values
+        if is_pdf(source):
+            return await self._analyze_pdf(source, digest, demographics)
         
-        # For demo, return mock analysis
-        return self._mock_analysis()
+        # OCR and extraction are CPU-bound, so they run in the process
+        # pool; raises OCRPoolSaturated when the pool is full
+        result = await self._run(_ocr_and_extract, source, digest, demographics)
+        with STAGE_SECONDS.labels("interpret").time():
+            return self._build_analysis(result["values"], result["raw_text"])
     
-    def extract_values(self, text: str) -> List[Dict]:
-        """Extract lab values from text"""
-        results = []
+    async def _run(self, func: Callable, *args, admitted: bool = False) -> Dict:
+        start = time.perf_counter()
+        result = await self.ocr_pool.run(func, *args, admitted=admitted)
+        elapsed = time.perf_counter() - start
         
-        for test_name, config in self.LAB_PATTERNS.items():
-            for pattern in config["patterns"]:
-                match = re.search(pattern, text, re.IGNORECASE)
-                if match:
-                    value = float(match.group(1).replace(",", ""))
-                    status = "normal"
-                    if value < config["normal_min"]:
-                        status = "low"
-                    elif value > config["normal_max"]:
-                        status = "high"
-                    
-                    results.append({
-                        "name": test_name,
-                        "value": value,
-                        "unit": config["unit"],
-                        "normal_range": f"{config['normal_min']}-{config['normal_max']}",
-                        "status": status,
-                        "explanation": config["explanation"]
-                    })
+        # Worker-side timings come back with the result; the rest of the
+        # round trip is queueing and pickling
+        timings = result["timings"]
+        for stage, seconds in timings.items():
+            STAGE_SECONDS.labels(stage).observe(seconds)
+        STAGE_SECONDS.labels("pool_wait").observe(max(elapsed - sum(timings.values()), 0.0))
+        return result
+    
+    async def _analyze_pdf(
+        self,
+        source: Union[str, bytes],
+        digest: Optional[str],
+        demographics: Optional[Demographics]
+    ) -> Dict:
+        """Page-level pipeline: text layer first, OCR only for image-only pages
+        
+        Pages that carry embedded text are read with pdftotext and never
+        rasterized. Image-only pages are rendered and OCR'd one page per
+        pool job, several at once, and no further pages are started once
+        every test in LAB_PATTERNS has been seen. Values are extracted
+        from the text of all processed pages joined in page order, so
+        they merge exactly as they would for a single page. A page that
+        fails OCR is left out and the analysis is marked partial; only
+        when no values were found at all does the failure propagate.
+        """
+        async with _staged_pdf(source) as path:
+            try:
+                with STAGE_SECONDS.labels("text_layer").time():
+                    texts = await pdf_text_layer(path)
+            except (OSError, OCRError):
+                # No usable text layer tool or an unreadable document:
+                # OCR the whole file the way images are handled
+                result = await self._run(_ocr_and_extract, path, None, demographics)
+                with STAGE_SECONDS.labels("interpret").time():
+                    return self._build_analysis(result["values"], result["raw_text"])
+            
+            # Tests seen on each page; None for pages still to be OCR'd
+            found: List[Optional[Set[str]]] = [
+                set(self.matcher.search(text)) if has_text_layer(text) else None
+                for text in texts
+            ]
+            scanned = [page for page, tests in enumerate(found) if tests is None]
+            REPORT_PAGES.labels("text").inc(len(texts) - len(scanned))
+            failed: Dict[int, OCRError] = {}
+            if scanned and not self._all_found(found):
+                failed = await self._ocr_pages(path, digest, scanned, texts, found)
+            REPORT_PAGES.labels("skipped").inc(sum(1 for page in scanned if found[page] is None))
+        
+        raw_text = "\f".join(texts)
+        with STAGE_SECONDS.labels("extract").time():
+            values = self.extract_values(raw_text, demographics)
+        if failed and not values:
+            raise next(iter(failed.values()))
+        with STAGE_SECONDS.labels("interpret").time():
+            analysis = self._build_analysis(values, raw_text)
+        if failed:
+            analysis = self._partial(analysis, sorted(page + 1 for page in failed))
+        return analysis
+    
+    async def _ocr_pages(
+        self,
+        path: str,
+        digest: Optional[str],
+        pages: List[int],
+        texts: List[str],
+        found: List[Optional[Set[str]]]
+    ) -> Dict[int, OCRError]:
+        """OCR pages in order, up to one per pool worker at a time, until every test is found
+        
+        Returns the pages that failed, by index, with their errors; the
+        other pages' text is kept.
+        """
+        pending = iter(pages)
+        started = 0
+        failed: Dict[int, OCRError] = {}
+        
+        async def worker() -> bool:
+            nonlocal started
+            for page in pending:
+                # Only the first page job is subject to admission control
+                admitted = started > 0
+                started += 1
+                try:
+                    result = await self._run(_ocr_page, path, page + 1, digest, admitted=admitted)
+                except OCRError as e:
+                    failed[page] = e
+                    found[page] = set()
+                    REPORT_PAGES.labels("failed").inc()
+                    continue
+                texts[page] = result["text"]
+                found[page] = set(result["found"])
+                REPORT_PAGES.labels("ocr").inc()
+                if self._all_found(found):
+                    return True
+            return False
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.ocr_pool.workers, len(pages)))]
+        try:
+            for finished in asyncio.as_completed(workers):
+                if await finished:
                     break
+        finally:
+            # On early exit, pages still being OCR'd are abandoned
+            for task in workers:
+                task.cancel()
+        return failed
+    
+    def _all_found(self, found: List[Optional[Set[str]]]) -> bool:
+        seen: Set[str] = set()
+        for tests in found:
+            if tests:
+                seen |= tests
+        return len(seen) == len(self.LAB_PATTERNS)
+    
+    def shutdown(self):
+        self.ocr_pool.shutdown()
+    
+    @classmethod
+    def extract_values(cls, text: str, demographics: Optional[Demographics] = None) -> List[Dict]:
+        """Extract lab values from text and classify them in one batch"""
+        # OCR noise such as "Glucose: ." or "HGB: 1.2.3" matches a pattern
+        # without being a number; such values are skipped
+        parsed = {
+            test_name: value
+            for test_name, match in cls.matcher.search(text).items()
+            if (value := _parse_value(match.group(1))) is not None
+        }
+        values = list(parsed.values())
+        demographics = demographics or Demographics()
+        classified = cls.ranges.classify(
+            cls.ranges.test_codes(list(parsed)), values, demographics.sex_code, demographics.band
+        )
+        
+        results = []
+        for test_name, value, (status, severity, low, high) in zip(parsed, values, classified.tolist()):
+            config = cls.LAB_PATTERNS[test_name]
+            results.append({
+                "name": test_name,
+                "value": value,
+                "unit": config["unit"],
+                "normal_range": f"{_format_value(low)}-{_format_value(high)}",
+                "status": STATUSES[status],
+                "severity": SEVERITIES[severity],
+                "explanation": config["explanation"]
+            })
         
         return results
     
-    def _mock_analysis(self) -> Dict:
-        """Return mock analysis for demo"""
+    @staticmethod
+    def _partial(analysis: Dict, failed_pages: List[int]) -> Dict:
+        """Mark an analysis as missing the values of pages that could not be read"""
+        pages = ", ".join(map(str, failed_pages))
+        return {
+            **analysis,
+            "status": "partial",
+            "failed_pages": failed_pages,
+            "summary": f"{analysis['summary']} Page(s) {pages} could not be read, so values on them are missing.",
+            "recommendations": [*analysis["recommendations"], f"Upload a clearer copy of page(s) {pages}"]
+        }
+    
+    def _build_analysis(self, values: List[Dict], raw_text: str) -> Dict:
+        """Turn extracted lab values into a patient-facing analysis"""
+        flagged_values = [{**item, "value": _format_value(item["value"])} for item in values]
+        
+        abnormal = [fv for fv in flagged_values if fv["status"] != "normal"]
+        overall_status = max(
+            (fv["severity"] for fv in flagged_values),
+            key=SEVERITIES.index,
+            default="low"
+        )
+        
+        if not flagged_values:
+            summary = "No recognizable lab values were found in this report. Please make sure the upload is legible, or review it with your healthcare provider."
+            recommendations = ["Review the report with your healthcare provider"]
+        elif abnormal:
+            listed = ", ".join(f"{fv['name']} ({fv['status']})" for fv in abnormal)
+            summary = f"{len(abnormal)} of {len(flagged_values)} recognized values are outside the normal range: {listed}. These findings should be reviewed with your healthcare provider."
+            recommendations = ["Follow up on abnormal results with your doctor"]
+            if overall_status == "high":
+                recommendations.insert(0, "Schedule appointment with primary care physician within 1-2 weeks")
+        else:
+            summary = f"All {len(flagged_values)} recognized values are within the normal range."
+            recommendations = ["Continue routine check-ups with your healthcare provider"]
+        
         return {
-            "overall_status": "attention_needed",
-            "summary": "Your blood test results show elevated glucose and white blood cell count. These findings warrant attention and should be reviewed with your healthcare provider.",
-            "flagged_values": [
-                {
-                    "name": "White Blood Cell Count",
-                    "value": 11.5,
-                    "unit": "10³/µL",
-                    "normal_range": "4.5-11.0",
-                    "status": "high",
-                    "explanation": "Slightly elevated - may indicate infection or inflammation",
-                    "severity": "medium"
-                },
-                {
-                    "name": "Fasting Glucose",
-                    "value": 126,
-                    "unit": "mg/dL",
-                    "normal_range": "70-100",
-                    "status": "high",
-                    "explanation": "Above normal range - may indicate prediabetes or diabetes",
-                    "severity": "high"
-                },
-                {
-                    "name": "Hemoglobin",
-                    "value": 14.2,
-                    "unit": "g/dL",
-                    "normal_range": "12.0-17.5",
-                    "status": "normal",
-                    "explanation": "Within healthy range",
-                    "severity": "low"
-                }
-            ],
-            "recommendations": [
-                "Schedule appointment with primary care physician within 1-2 weeks",
-                "Request HbA1c test for diabetes screening",
-                "Monitor for signs of infection (fever, fatigue)",
-                "Follow up on abnormal results with your doctor"
-            ],
-            "confidence": 0.85
+            "overall_status": overall_status,
+            "summary": summary,
+            "flagged_values": flagged_values,
+            # Unformatted, for recording lab history
+            "values": {item["name"]: item["value"] for item in values},
+            "recommendations": recommendations,
+            "raw_text": raw_text,
+            "confidence": 0.85 if flagged_values else 0.3
         }
+
+
+def _parse_value(text: str) -> Optional[float]:
+    try:
+        return float(text.replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _format_value(value: float) -> str:
+    # Shortest text that reads back as the same float, so no digit of a
+    # parsed value is lost; whole numbers drop the ".0"
+    text = repr(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+@asynccontextmanager
+async def _staged_pdf(source: Union[str, bytes]) -> AsyncIterator[str]:
+    """A path to the PDF; in-memory uploads are written to a temp file once
+    so page jobs receive a path instead of a pickled copy of the document"""
+    if isinstance(source, str):
+        yield source
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        await asyncio.to_thread(tmp.write, source)
+        await asyncio.to_thread(tmp.flush)
+        yield tmp.name
+
+
+def _ocr_page(path: str, page: int, digest: Optional[str] = None) -> Dict:
+    """Process pool entry point: OCR one PDF page and list the tests on it"""
+    start = time.perf_counter()
+    key = f"{digest}:{page}" if digest else None
+    try:
+        binary = cached_preprocess(key, lambda: preprocess(rasterize_pdf_page(path, page)))
+    except OCRError:
+        raise
+    except Exception as e:
+        # A page image preprocessing cannot handle fails that page alone
+        raise OCRError(f"Could not preprocess page {page}: {e}") from None
+    preprocessed = time.perf_counter()
+    text = ocr_binary(binary)
+    ocr_done = time.perf_counter()
+    found = list(ReportAnalyzer.matcher.search(text))
+    return {
+        "text": text,
+        "found": found,
+        "timings": {
+            "preprocess": preprocessed - start,
+            "ocr": ocr_done - preprocessed,
+            "extract": time.perf_counter() - ocr_done
+        }
+    }
+
+
+def _ocr_and_extract(
+    source: Union[str, bytes],
+    digest: Optional[str] = None,
+    demographics: Optional[Demographics] = None
+) -> Dict:
+    """Process pool entry point: OCR a report and extract its lab values"""
+    start = time.perf_counter()
+    pages = prepare_pages(source, digest)
+    preprocessed = time.perf_counter()
+    raw_text = "\f".join(ocr_binary(page) for page in pages)
+    ocr_done = time.perf_counter()
+    values = ReportAnalyzer.extract_values(raw_text, demographics)
+    return {
+        "raw_text": raw_text,
+        "values": values,
+        "timings": {
+            "preprocess": preprocessed - start,
+            "ocr": ocr_done - preprocessed,
+            "extract": time.perf_counter() - ocr_done
+        }
+    }
@@ -0,0 +1,435 @@
+"""
+Persistent job queue for report analysis
+Uploads are queued in sqlite and analyzed by a bounded pool of workers;
+results are polled by job id or posted to a callback URL
+"""
+
+from typing import Awaitable, BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass
+from urllib.parse import urlparse
+import asyncio
+import ipaddress
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import httpx
+from loguru import logger
+
+from services import metrics
+from services.ocr import OCRPoolSaturated
+
+# Small uploads are served ahead of large ones, which only get every
+# LARGE_SHARE-th pick while both lanes have work
+LANES = ("small", "large")
+
+JOBS_FINISHED = metrics.counter(
+    "report_jobs_total", "Report analysis jobs finished, by lane and outcome", ("lane", "status")
+)
+JOB_WAIT_SECONDS = metrics.histogram(
+    "report_job_wait_seconds", "Time from submission until a worker picked the job up", ("lane",)
+)
+JOBS_QUEUED = metrics.gauge("report_jobs_queued", "Jobs waiting for a worker", ("lane",))
+
+
+class JobQueueFull(Exception):
+    """Raised when the queue already holds max_queued jobs"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class Job:
+    id: str
+    lane: str
+    report_type: str
+    digest: str
+    path: str
+    callback_url: Optional[str]
+    created_at: float
+    # Submitter's per-job settings, passed to the handler as given
+    options: Dict
+
+
+# Runs one job: (upload path, report_type, digest, options) -> serialized result
+JobHandler = Callable[[str, str, str, Dict], Awaitable[bytes]]
+
+
+def valid_callback_url(url: str, allowed_hosts: Optional[Iterable[str]] = None) -> bool:
+    """Whether finished jobs, lab results included, may be POSTed to url
+
+    Only http(s) URLs qualify. When JOB_CALLBACK_HOSTS (comma-separated)
+    or ``allowed_hosts`` is given, the host must be one of those.
+    Otherwise the host must resolve, and every address it resolves to must
+    be public: loopback, private, link-local (cloud metadata) and other
+    reserved ranges are refused. Resolves the host, so it blocks.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    host = parsed.hostname.lower()
+
+    if allowed_hosts is None:
+        allowed_hosts = [h for h in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if h.strip()]
+    allowed = {h.strip().lower() for h in allowed_hosts}
+    if allowed:
+        return host in allowed
+
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError, UnicodeError):
+        return False
+    for _, _, _, _, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if getattr(address, "ipv4_mapped", None):
+            address = address.ipv4_mapped
+        if not address.is_global:
+            return False
+    return bool(addresses)
+
+
+class JobQueue:
+    """Report analysis jobs, persisted so they survive a restart
+
+    Each upload is written to ``directory`` and a row is added to a sqlite
+    queue in the same directory. Up to ``workers`` jobs run at once in
+    this process; other processes sharing the directory claim jobs from
+    the same table, with a single UPDATE so no job runs twice. A job
+    rejected by a saturated OCR pool goes back to the queue until the
+    pool's retry-after has passed. Finished jobs keep their result for
+    ``ttl`` seconds.
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        directory: Optional[str] = None,
+        workers: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        small_bytes: Optional[int] = None,
+        large_share: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        self.handler = handler
+        self.directory = directory or os.getenv("JOBS_DIR", "jobs")
+        self.workers = workers or int(os.getenv("JOB_WORKERS", os.getenv("OCR_WORKERS", os.cpu_count() or 1)))
+        self.max_queued = max_queued or int(os.getenv("JOB_MAX_QUEUED", 1000))
+        self.small_bytes = small_bytes or int(os.getenv("JOB_SMALL_BYTES", 2 * 1024 * 1024))
+        self.large_share = large_share or int(os.getenv("JOB_LARGE_SHARE", 4))
+        self.ttl = ttl or float(os.getenv("JOB_TTL", 24 * 3600))
+        self.poll_interval = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+        self.retry_after = int(os.getenv("JOB_RETRY_AFTER", 30))
+
+        self._db: Optional[sqlite3.Connection] = None
+        # One connection shared by the threads sqlite calls run in
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tasks: List[asyncio.Task] = []
+        self._callbacks: set = set()
+        self._wakeup = asyncio.Event()
+        self._claims = 0
+        self._purged_at = 0.0
+
+    @property
+    def upload_dir(self) -> str:
+        return os.path.join(self.directory, "uploads")
+
+    async def start(self):
+        """Open the queue and start the workers; called from the app lifespan"""
+        await asyncio.to_thread(self._open)
+        self._set_gauges(await asyncio.to_thread(self._queued_by_lane))
+
+        # Bound to the loop it is first awaited on; a queue restarted on
+        # another loop (a new lifespan) needs a fresh one
+        self._wakeup = asyncio.Event()
+
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(10.0))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _open(self):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(self.directory, "queue.db"), check_same_thread=False, isolation_level=None, timeout=5
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, lane TEXT NOT NULL, status TEXT NOT NULL, report_type TEXT NOT NULL, "
+            "digest TEXT NOT NULL, path TEXT, callback_url TEXT, callback_status TEXT, "
+            "result BLOB, error TEXT, pid INTEGER, created_at REAL NOT NULL, not_before REAL NOT NULL, "
+            "started_at REAL, finished_at REAL, options TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "options" not in columns:
+            # Queues created before jobs had options
+            try:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN options TEXT")
+            except sqlite3.OperationalError:
+                pass  # added by another process meanwhile
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, lane, created_at)")
+        self._recover()
+
+    async def close(self):
+        """Stop the workers; jobs they were running are queued again"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._callbacks:
+            await asyncio.wait(self._callbacks, timeout=5)
+        if self._client is not None:
+            await self._client.aclose()
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Run one statement and fetch its rows; blocks, so called in a thread"""
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _recover(self):
+        """Requeue jobs left running by a process that is gone"""
+        rows = self._query("SELECT id, pid FROM jobs WHERE status = 'running'")
+        for job_id, pid in rows:
+            if pid == os.getpid() or not _alive(pid):
+                self._query(
+                    "UPDATE jobs SET status = 'queued', pid = NULL, started_at = NULL WHERE id = ?", (job_id,)
+                )
+                logger.info("Requeued interrupted report job", job_id=job_id)
+
+    async def submit(
+        self,
+        fileobj: BinaryIO,
+        size: int,
+        report_type: str,
+        digest: str,
+        callback_url: Optional[str] = None,
+        options: Optional[Dict] = None
+    ) -> Dict:
+        """Persist an upload and queue it; raises JobQueueFull"""
+        if await asyncio.to_thread(self._queued) >= self.max_queued:
+            raise JobQueueFull(self.retry_after)
+
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.upload_dir, job_id)
+        await asyncio.to_thread(_spool, fileobj, path)
+        lane = "small" if size <= self.small_bytes else "large"
+        now = time.time()
+        await asyncio.to_thread(
+            self._query,
+            "INSERT INTO jobs (id, lane, status, report_type, digest, path, callback_url, created_at, not_before, options) "
+            "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, lane, report_type, digest, path, callback_url, now, now, json.dumps(options or {}))
+        )
+        JOBS_QUEUED.labels(lane).inc()
+        self._wakeup.set()
+        return await self.get(job_id)
+
+    async def add_finished(
+        self,
+        report_type: str,
+        digest: str,
+        result: bytes,
+        callback_url: Optional[str] = None
+    ) -> Dict:
+        """Record a job whose result was already cached, so clients see one flow"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        await asyncio.to_thread(
+            self._query,
+            "INSERT INTO jobs (id, lane, status, report_type, digest, callback_url, result, "
+            "created_at, not_before, started_at, finished_at) VALUES (?, 'small', 'complete', ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, report_type, digest, callback_url, result, now, now, now, now)
+        )
+        JOBS_FINISHED.labels("small", "complete").inc()
+        if callback_url:
+            self._notify(job_id, callback_url)
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        """A job's state; ``result`` is the serialized analysis once complete"""
+        return await asyncio.to_thread(self._get, job_id)
+
+    def _get(self, job_id: str) -> Optional[Dict]:
+        rows = self._query(
+            "SELECT id, lane, status, result, error, callback_status, created_at, started_at, finished_at "
+            "FROM jobs WHERE id = ?", (job_id,)
+        )
+        if not rows:
+            return None
+        keys = ("job_id", "lane", "status", "result", "error", "callback_status", "created_at", "started_at", "finished_at")
+        return dict(zip(keys, rows[0]))
+
+    def stats(self) -> Dict:
+        counts = self._query("SELECT lane, status, COUNT(*) FROM jobs GROUP BY lane, status")
+        return {
+            "workers": self.workers,
+            "running": len([task for task in self._tasks if not task.done()]),
+            "jobs": {f"{lane}:{status}": count for lane, status, count in counts}
+        }
+
+    def _queued(self) -> int:
+        return self._query("SELECT COUNT(*) FROM jobs WHERE status = 'queued'")[0][0]
+
+    def _queued_by_lane(self) -> Dict[str, int]:
+        return dict(self._query("SELECT lane, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY lane"))
+
+    def _set_gauges(self, counts: Dict[str, int]):
+        for lane in LANES:
+            JOBS_QUEUED.labels(lane).set(counts.get(lane, 0))
+
+    def _claim(self, lanes: Tuple[str, ...]) -> Optional[Job]:
+        """Atomically take the next runnable job from the first lane that has one"""
+        now = time.time()
+        for lane in lanes:
+            rows = self._query(
+                "UPDATE jobs SET status = 'running', pid = ?, started_at = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE status = 'queued' AND lane = ? AND not_before <= ? "
+                "ORDER BY created_at LIMIT 1) AND status = 'queued' "
+                "RETURNING id, lane, report_type, digest, path, callback_url, created_at, options",
+                (os.getpid(), now, lane, now)
+            )
+            if rows:
+                row = rows[0]
+                return Job(*row[:-1], json.loads(row[-1] or "{}"))
+        return None
+
+    async def _worker(self):
+        while True:
+            # Small lane first, except every large_share-th claim
+            self._claims += 1
+            lanes = LANES[::-1] if self._claims % self.large_share == 0 else LANES
+            try:
+                job = await asyncio.to_thread(self._claim, lanes)
+            except sqlite3.Error as e:
+                # Most likely another process holding the write lock
+                logger.warning("Report job claim failed", error=str(e))
+                job = None
+            if job is None:
+                await asyncio.to_thread(self._purge)
+                self._wakeup.clear()
+                try:
+                    # Jobs queued by other processes are only seen by polling
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            JOBS_QUEUED.labels(job.lane).dec()
+            JOB_WAIT_SECONDS.labels(job.lane).observe(time.time() - job.created_at)
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        try:
+            result = await self.handler(job.path, job.report_type, job.digest, job.options)
+        except OCRPoolSaturated as e:
+            # Not a failure: wait for OCR capacity without holding a worker slot
+            await self._requeue(job, delay=e.retry_after)
+            return
+        except asyncio.CancelledError:
+            # Shutting down: put the job back without waiting on a thread
+            self._requeue_row(job, 0.0)
+            JOBS_QUEUED.labels(job.lane).inc()
+            raise
+        except Exception as e:
+            logger.error("Report job failed", job_id=job.id, error=str(e))
+            await self._finish(job, "failed", error="Report analysis failed")
+            return
+        await self._finish(job, "complete", result=result)
+
+    async def _requeue(self, job: Job, delay: float = 0.0):
+        await asyncio.to_thread(self._requeue_row, job, delay)
+        JOBS_QUEUED.labels(job.lane).inc()
+
+    def _requeue_row(self, job: Job, delay: float):
+        self._query(
+            "UPDATE jobs SET status = 'queued', pid = NULL, started_at = NULL, not_before = ? WHERE id = ?",
+            (time.time() + delay, job.id)
+        )
+
+    async def _finish(self, job: Job, status: str, result: Optional[bytes] = None, error: Optional[str] = None):
+        await asyncio.to_thread(self._finish_row, job, status, result, error)
+        JOBS_FINISHED.labels(job.lane, status).inc()
+        if job.callback_url:
+            self._notify(job.id, job.callback_url)
+
+    def _finish_row(self, job: Job, status: str, result: Optional[bytes], error: Optional[str]):
+        self._query(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, path = NULL, finished_at = ? WHERE id = ?",
+            (status, result, error, time.time(), job.id)
+        )
+        _remove(job.path)
+
+    def _notify(self, job_id: str, url: str):
+        task = asyncio.create_task(self._deliver(job_id, url))
+        self._callbacks.add(task)
+        task.add_done_callback(self._callbacks.discard)
+
+    async def _deliver(self, job_id: str, url: str, attempts: int = 3):
+        """POST the finished job to its callback URL, retrying with backoff"""
+        job = await self.get(job_id)
+        result = job.pop("result")
+        payload = {**job, "result": json.loads(result) if result else None}
+        status = "failed"
+        # Checked again at delivery, since what the host resolves to may
+        # have changed since the job was submitted
+        if not await asyncio.to_thread(valid_callback_url, url):
+            logger.warning("Report job callback refused: host not allowed", job_id=job_id)
+            attempts, status = 0, "refused"
+        for attempt in range(attempts):
+            try:
+                response = await self._client.post(url, json=payload)
+                if response.status_code < 500:
+                    status = "delivered" if response.is_success else f"rejected ({response.status_code})"
+                    break
+            except httpx.HTTPError as e:
+                logger.warning("Report job callback failed", job_id=job_id, attempt=attempt + 1, error=str(e))
+            if attempt + 1 < attempts:
+                await asyncio.sleep(2 ** attempt)
+        if self._db is not None:
+            await asyncio.to_thread(self._query, "UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+
+    def _purge(self):
+        """Drop finished jobs older than the TTL, at most once a minute"""
+        now = time.time()
+        if now - self._purged_at < 60:
+            return
+        self._purged_at = now
+        self._query(
+            "DELETE FROM jobs WHERE status IN ('complete', 'failed') AND finished_at <= ?", (now - self.ttl,)
+        )
+
+
+def _spool(fileobj: BinaryIO, path: str):
+    with open(path, "wb") as f:
+        shutil.copyfileobj(fileobj, f, 1024 * 1024)
+
+
+def _remove(path: Optional[str]):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
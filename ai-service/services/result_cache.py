@@ -0,0 +1,189 @@
+"""
+Content-addressed cache for finished analysis results
+A bounded in-process LRU tier backed by an optional sqlite tier,
+both with size-based eviction and TTL
+"""
+
+from typing import Dict, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResultCache:
+    """Two-tier cache of serialized responses keyed by content hash
+
+    Values are stored as the final serialized response body, so a hit can
+    be returned without rebuilding or revalidating the response model.
+    Lookups block on sqlite, so callers on the event loop run them in a
+    thread; the lock serializes them.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        disk_path: Optional[str] = None,
+        disk_bytes: Optional[int] = None
+    ):
+        self.memory_bytes = memory_bytes or int(os.getenv("REPORT_CACHE_MEMORY_MB", 64)) * 1024 * 1024
+        self.ttl = ttl or float(os.getenv("REPORT_CACHE_TTL", 24 * 3600))
+        self.disk_bytes = disk_bytes or int(os.getenv("REPORT_CACHE_DISK_MB", 512)) * 1024 * 1024
+        disk_path = disk_path or os.getenv("REPORT_CACHE_PATH")
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_size = 0
+        self._stats = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0,
+            "memory_evictions": 0, "disk_evictions": 0, "expired": 0
+        }
+
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        # WAL without fsync per commit keeps writes off the critical path
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+            # The file may be shared by several processes (pre-fork
+            # workers), so the tier's size is kept in the database by
+            # triggers rather than counted by each process
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)"
+            )
+            self._db.execute(
+                "INSERT OR IGNORE INTO results_size VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM results))"
+            )
+            self._db.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_added AFTER INSERT ON results "
+                "BEGIN UPDATE results_size SET bytes = bytes + NEW.size; END"
+            )
+            self._db.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_removed AFTER DELETE ON results "
+                "BEGIN UPDATE results_size SET bytes = bytes - OLD.size; END"
+            )
+            self._db.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction, taking the database lock up front"""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _disk_size(self) -> int:
+        return self._db.execute("SELECT bytes FROM results_size").fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+            self._drop_memory(key)
+            self._stats["expired"] += 1
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                value, expires_at = row
+                if expires_at > now:
+                    self._db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._put_memory(key, value, expires_at)
+                    self._stats["disk_hits"] += 1
+                    return value
+                self._drop_disk(key)
+                self._stats["expired"] += 1
+
+        self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, value: bytes):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._put_memory(key, value, expires_at)
+            if self._db is not None:
+                with self._transaction():
+                    self._put_disk(key, value, expires_at)
+
+    def _put_memory(self, key: str, value: bytes, expires_at: float):
+        if len(value) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (expires_at, value)
+        self._memory_size += len(value)
+
+        while self._memory_size > self.memory_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self._stats["memory_evictions"] += 1
+
+    def _drop_memory(self, key: str):
+        _, value = self._memory.pop(key)
+        self._memory_size -= len(value)
+
+    def _put_disk(self, key: str, value: bytes, expires_at: float):
+        self._drop_disk(key)
+        self._db.execute(
+            "INSERT INTO results (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), expires_at, time.time())
+        )
+
+        while self._disk_size() > self.disk_bytes:
+            row = self._db.execute(
+                "SELECT key FROM results ORDER BY accessed_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._drop_disk(row[0])
+            self._stats["disk_evictions"] += 1
+
+    def _drop_disk(self, key: str):
+        self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_enabled": self._db is not None,
+                "disk_bytes": self._disk_size() if self._db is not None else 0
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
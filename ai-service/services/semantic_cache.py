@@ -0,0 +1,135 @@
+"""
+Two-level response cache for LLM calls
+Exact match on the normalized prompt, then cosine similarity over hashed
+character n-gram embeddings held in a NumPy matrix
+"""
+
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional
+from collections import OrderedDict
+import copy
+import os
+import re
+import time
+import zlib
+
+import numpy as np
+
+from services.knowledge_base import contrast_markers
+
+# Tokens that change meaning without changing the wording much; a
+# similarity hit is only served when both texts agree on all of them, on
+# which side of contrast pairs such as hyper-/hypo- or left/right they
+# are, and on the medical terms they name
+NEGATIONS = frozenset(["no", "not", "never", "without", "don't", "dont", "can't", "cant", "isn't", "didn't"])
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^a-z0-9']+", " ", text.lower()).split())
+
+
+class SemanticCache:
+    """LRU/TTL cache with an exact tier and a similarity tier
+
+    Entries live in fixed rows of a preallocated embedding matrix, so a
+    similarity lookup is one matrix-vector product and an argmax.
+    ``find_terms`` returns the medical terms a normalized text names.
+    """
+
+    def __init__(
+        self,
+        capacity: Optional[int] = None,
+        ttl: Optional[float] = None,
+        threshold: Optional[float] = None,
+        dim: int = 1024,
+        find_terms: Optional[Callable[[str], Iterable[str]]] = None
+    ):
+        self.capacity = capacity or int(os.getenv("LLM_CACHE_SIZE", 2048))
+        self.ttl = ttl or float(os.getenv("LLM_CACHE_TTL", 3600))
+        self.threshold = threshold or float(os.getenv("LLM_CACHE_THRESHOLD", 0.85))
+        self.dim = dim
+        self.find_terms = find_terms
+
+        self._matrix = np.zeros((self.capacity, dim), dtype=np.float32)
+        # exact key -> row, in LRU order
+        self._keys: "OrderedDict[str, int]" = OrderedDict()
+        self._rows: Dict[int, tuple] = {}
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def embed(self, text: str) -> np.ndarray:
+        """Hashed character trigram and word vector, L2-normalized"""
+        padded = f" {text} "
+        buckets = [zlib.crc32(padded[i:i + 3].encode()) % self.dim for i in range(len(padded) - 2)]
+        buckets += [zlib.crc32(f"w:{word}".encode()) % self.dim for word in text.split()]
+        vector = np.bincount(buckets, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _guard(self, text: str) -> FrozenSet[str]:
+        guard = {word for word in text.split() if word in NEGATIONS or any(c.isdigit() for c in word)}
+        guard.update(f"contrast:{marker}" for marker in contrast_markers(text))
+        if self.find_terms is not None:
+            guard.update(f"term:{term}" for term in self.find_terms(text))
+        return frozenset(guard)
+
+    def get(self, key: str, semantic_text: str) -> Optional[Any]:
+        """Look up by exact key, then by similarity of semantic_text"""
+        now = time.time()
+        key = normalize(key)
+
+        row = self._keys.get(key)
+        if row is not None:
+            if self._rows[row][1] > now:
+                self._keys.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return copy.deepcopy(self._rows[row][0])
+            self._evict(row)
+            self._stats["expired"] += 1
+
+        if self._keys:
+            text = normalize(semantic_text)
+            scores = self._matrix @ self.embed(text)
+            row = int(np.argmax(scores))
+            if scores[row] >= self.threshold and row in self._rows:
+                value, expires_at, row_key, guard = self._rows[row]
+                if expires_at <= now:
+                    self._evict(row)
+                    self._stats["expired"] += 1
+                elif guard == self._guard(text):
+                    self._keys.move_to_end(row_key)
+                    self._stats["similar_hits"] += 1
+                    return copy.deepcopy(value)
+
+        self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, semantic_text: str, value: Any):
+        key = normalize(key)
+        if key in self._keys:
+            self._evict(self._keys[key])
+        if not self._free:
+            self._evict(next(iter(self._keys.values())))
+            self._stats["evictions"] += 1
+
+        text = normalize(semantic_text)
+        row = self._free.pop()
+        self._matrix[row] = self.embed(text)
+        self._rows[row] = (copy.deepcopy(value), time.time() + self.ttl, key, self._guard(text))
+        self._keys[key] = row
+
+    def _evict(self, row: int):
+        _, _, key, _ = self._rows.pop(row)
+        del self._keys[key]
+        # A zero row can never reach the similarity threshold
+        self._matrix[row] = 0
+        self._free.append(row)
+
+    def stats(self) -> Dict:
+        hits = self._stats["exact_hits"] + self._stats["similar_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self._keys),
+            "capacity": self.capacity
+        }
@@ -0,0 +1,77 @@
+"""
+Single-flight coalescing of concurrent identical calls
+Callers that ask for a key already being fetched wait on the same task
+instead of starting their own
+"""
+
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates in-flight async calls by key
+
+    The first caller for a key starts ``func()`` as a task; callers that
+    arrive before it finishes await the same task and receive the same
+    result or exception. Nothing is kept once the task is done, so this
+    only merges work that overlaps in time; it is not a cache.
+
+    Each caller awaits the task through ``asyncio.shield``, so a caller
+    being cancelled (a client disconnecting) does not cancel the call for
+    the others. The shared call is cancelled only when every caller
+    waiting on it has been cancelled.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Return func()'s result, sharing it with concurrent callers of key"""
+        self._stats["calls"] += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+        else:
+            self._stats["coalesced"] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                # Later callers for the key start a fresh call rather
+                # than join one that is being cancelled
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether a call for key is in flight, so do() would join it"""
+        return key in self._flights
+
+    def _finish(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Retrieve the outcome so an error nobody is left to await is not
+        # reported as "exception was never retrieved"
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self) -> Dict:
+        return {**self._stats, "in_flight": len(self._flights)}
@@ -2,9 +2,21 @@
 Rule-based symptom analyzer for fallback and quick analysis
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 
+import numpy as np
+
+from services import metrics
+from services.keyword_matcher import KeywordHit, KeywordMatcher
+
+SEVERITY_RANK = {"unknown": -1, "low": 0, "moderate": 1, "high": 2, "emergency": 3}
+
+STAGE_SECONDS = metrics.histogram(
+    "symptom_analysis_stage_seconds", "Time spent in each stage of rule-based symptom analysis", ("stage",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01, 0.05)
+)
+
 @dataclass
 class SymptomPattern:
     keywords: List[str]
@@ -15,8 +27,12 @@ class SymptomPattern:
 class SymptomAnalyzer:
     """Rule-based symptom analysis using pattern matching"""
     
-    def __init__(self):
-        self.patterns = {
+    def __init__(
+        self,
+        matcher: Optional[KeywordMatcher] = None,
+        patterns: Optional[Dict[str, SymptomPattern]] = None
+    ):
+        self.patterns = patterns if patterns is not None else {
             "headache": SymptomPattern(
                 keywords=["headache", "head pain", "migraine", "head hurts"],
                 severity="low",
@@ -108,13 +124,113 @@ class SymptomAnalyzer:
             "severe bleeding", "unconscious", "cant breathe", "can't breathe",
             "slurred speech", "face drooping", "arm weakness"
         ]
+        
+        # May be replaced by an automaton shared with other services
+        self.matcher = matcher or KeywordMatcher(self.keyword_sets())
+        self._build_index()
     
-    def analyze(self, message: str) -> Dict:
-        """Analyze message for symptoms"""
-        message_lower = message.lower()
+    def _build_index(self):
+        """Precompute the sparse keyword -> pattern incidence matrix (CSR)"""
+        self._pattern_names = list(self.patterns)
+        self._severity_ranks = np.array(
+            [SEVERITY_RANK[pattern.severity] for pattern in self.patterns.values()]
+        )
+        
+        columns: Dict[str, List[int]] = {}
+        for index, pattern in enumerate(self.patterns.values()):
+            for keyword in dict.fromkeys(kw.lower() for kw in pattern.keywords):
+                columns.setdefault(keyword, []).append(index)
+        
+        self._keyword_ids = {keyword: row for row, keyword in enumerate(columns)}
+        self._indptr = np.zeros(len(columns) + 1, dtype=np.int64)
+        np.cumsum([len(cols) for cols in columns.values()], out=self._indptr[1:])
+        self._indices = np.array(
+            [col for cols in columns.values() for col in cols], dtype=np.int64
+        )
+    
+    def keyword_sets(self) -> Dict[str, List[str]]:
+        """Keyword sets this analyzer needs from a KeywordMatcher"""
+        return {
+            "emergency": self.emergency_keywords,
+            **{f"symptom:{name}": pattern.keywords for name, pattern in self.patterns.items()}
+        }
+    
+    def is_emergency(self, message: str, hits: Optional[List[KeywordHit]] = None) -> bool:
+        if hits is None:
+            hits = self.matcher.find_all(message)
+        return any(hit.pattern_id == "emergency" for hit in hits)
+    
+    def score(self, hits: List[KeywordHit]) -> List[Tuple[str, int]]:
+        """Rank patterns by the number of their keywords found in the message"""
+        return self.score_batch([hits])[0]
+    
+    def score_batch(self, hits_list: List[List[KeywordHit]]) -> List[List[Tuple[str, int]]]:
+        """Rank patterns for many messages in one vectorized pass
+        
+        Only the incidence rows of matched keywords are touched, so the
+        cost depends on the hits, not on the size of the pattern library.
+        """
+        ranked: List[List[Tuple[str, int]]] = [[] for _ in hits_list]
+        
+        # (message, keyword) pairs encoded as one integer, each counted once
+        n_keywords = len(self._keyword_ids)
+        pairs = np.unique(np.fromiter(
+            (
+                message * n_keywords + self._keyword_ids[hit.keyword]
+                for message, hits in enumerate(hits_list)
+                for hit in hits
+                if hit.pattern_id.startswith("symptom:") and hit.keyword in self._keyword_ids
+            ),
+            dtype=np.int64
+        ))
+        if not pairs.size:
+            return ranked
+        messages, keyword_ids = np.divmod(pairs, n_keywords)
+        
+        # Gather the CSR rows of every matched keyword in one vectorized step
+        starts = self._indptr[keyword_ids]
+        counts = self._indptr[keyword_ids + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        n_patterns = len(self._pattern_names)
+        cells = np.repeat(messages, counts) * n_patterns + self._indices[offsets]
+        cells, scores = np.unique(cells, return_counts=True)
+        messages, matched = np.divmod(cells, n_patterns)
+        
+        # Per message: highest score first, then most severe, then library order
+        order = np.lexsort((matched, -self._severity_ranks[matched], -scores, messages))
+        for i in order:
+            ranked[messages[i]].append((self._pattern_names[matched[i]], int(scores[i])))
+        return ranked
+    
+    def analyze(self, message: str, hits: Optional[List[KeywordHit]] = None) -> Dict:
+        """Analyze message for symptoms, reusing keyword hits if already scanned"""
+        if hits is None:
+            with STAGE_SECONDS.labels("scan").time():
+                hits = self.matcher.find_all(message)
+        with STAGE_SECONDS.labels("score").time():
+            ranked = self.score(hits)
+        with STAGE_SECONDS.labels("summarize").time():
+            return self._summarize(hits, ranked)
+    
+    def analyze_batch(
+        self,
+        messages: List[str],
+        hits_list: Optional[List[List[KeywordHit]]] = None
+    ) -> List[Dict]:
+        """Analyze many messages, scoring all of them in a single pass"""
+        if hits_list is None:
+            with STAGE_SECONDS.labels("scan").time():
+                hits_list = [self.matcher.find_all(message) for message in messages]
+        with STAGE_SECONDS.labels("score").time():
+            ranked_list = self.score_batch(hits_list)
+        with STAGE_SECONDS.labels("summarize").time():
+            return [self._summarize(hits, ranked) for hits, ranked in zip(hits_list, ranked_list)]
+    
+    def _summarize(self, hits: List[KeywordHit], ranked: List[Tuple[str, int]]) -> Dict:
+        matched = KeywordMatcher.pattern_ids(hits)
         
         # Check for emergency
-        if any(kw in message_lower for kw in self.emergency_keywords):
+        if "emergency" in matched:
             return {
                 "severity": "emergency",
                 "conditions": ["Medical emergency suspected"],
@@ -126,15 +242,16 @@ class SymptomAnalyzer:
                 "is_emergency": True
             }
         
-        # Match symptoms
-        for symptom_name, pattern in self.patterns.items():
-            if any(kw in message_lower for kw in pattern.keywords):
-                return {
-                    "severity": pattern.severity,
-                    "conditions": pattern.conditions,
-                    "recommendations": pattern.recommendations,
-                    "matched_symptom": symptom_name
-                }
+        # Merge every matched symptom pattern by rank
+        if ranked:
+            patterns = [self.patterns[name] for name, _ in ranked]
+            return {
+                "severity": max((p.severity for p in patterns), key=SEVERITY_RANK.get),
+                "conditions": list(dict.fromkeys(c for p in patterns for c in p.conditions)),
+                "recommendations": list(dict.fromkeys(r for p in patterns for r in p.recommendations)),
+                "matched_symptom": ranked[0][0],
+                "matched_symptoms": [{"symptom": name, "score": score} for name, score in ranked]
+            }
         
         # No match
         return {
@@ -0,0 +1,314 @@
+"""
+Term lookup index for medical term explanations
+Prefix completion over a sorted vocabulary and typo-tolerant matching with
+a SymSpell-style deletion index, both built on first use or read in place
+from a compiled knowledge base
+"""
+
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple, Union
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+import heapq
+import threading
+import zlib
+
+import numpy as np
+
+from services.knowledge_base import KnowledgeBase, MappedTable, contrasting
+
+# Prefix ranges larger than this get their completions precomputed, so a
+# one- or two-letter prefix over a large vocabulary costs a dict lookup;
+# enough are kept for the largest limit /api/terms/suggest accepts
+HEAVY_PREFIX = 256
+MAX_COMPLETIONS = 50
+# resolve() picks one term for the caller, so it only corrects a single
+# typo; suggest() lists candidates and allows up to max_distance
+RESOLVE_MAX_DISTANCE = 1
+
+
+@dataclass(frozen=True)
+class TermMatch:
+    term: str
+    match: str  # "exact", "abbreviation", "prefix" or "fuzzy"
+    distance: int
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance, or limit + 1 once it exceeds limit
+
+    Only the diagonal band of width 2 * limit + 1 is computed, since any
+    cell outside it already costs more than limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    over = limit + 1
+    previous2: List[int] = []
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        best = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = a[i - 1] != b[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            best = min(best, value)
+        if best > limit:
+            return over
+        previous2, previous = previous, current
+    return min(previous[-1], over)
+
+
+def _variant_key(variant: str) -> int:
+    # Unlike hash(), the same in every process, so the index can be
+    # compiled into a file; a collision only adds a candidate to verify
+    return zlib.crc32(variant.encode())
+
+
+class _MappedTerms(Sequence):
+    """Sorted terms stored back to back in a knowledge base, decoded on access"""
+
+    def __init__(self, text: np.ndarray, bounds: np.ndarray):
+        self._text = text
+        self._bounds = bounds
+
+    def __len__(self) -> int:
+        return len(self._bounds) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._text[self._bounds[index]:self._bounds[index + 1]].tobytes().decode()
+
+
+class _MappedCompletions:
+    """Precomputed completions of heavy prefixes, read from a mapped table"""
+
+    def __init__(self, table: MappedTable):
+        self._table = table
+
+    def get(self, prefix: str) -> Optional[List[str]]:
+        value = self._table.get(prefix)
+        return None if value is None else value.split("\n")
+
+
+class TermIndex:
+    """Prefix, abbreviation and bounded edit-distance lookup over a vocabulary
+
+    Completion uses the sorted term list as a flattened trie: a prefix is
+    a contiguous range found by binary search. Fuzzy matching hashes every
+    deletion of up to ``max_distance`` characters from the first
+    ``prefix_length`` characters of each term into a sorted NumPy array,
+    so a query only generates its own deletions and verifies the few
+    candidates that share one. Typo matches never cross a contrast pair
+    such as hyper-/hypo-.
+
+    Both structures are built from ``terms`` on first use; the pre-fork
+    master builds them once, before forking. A compiled knowledge base
+    carries them prebuilt (see ``from_knowledge_base``), so workers read
+    them from the shared mapping and never build their own.
+    """
+
+    def __init__(
+        self,
+        terms: Iterable[str],
+        abbreviations: Optional[Mapping[str, str]] = None,
+        max_distance: int = 2,
+        prefix_length: int = 7
+    ):
+        self.terms: Sequence[str] = []
+        self.abbreviations: Union[Dict[str, str], MappedTable] = {}
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self._sources = (terms, abbreviations)
+        self._built = False
+        self._lock = threading.Lock()
+
+    def build(self):
+        """Build the index, if not built yet; safe to call from any thread"""
+        if self._built:
+            return
+        with self._lock:
+            if not self._built:
+                self._build(*self._sources)
+                self._sources = None
+                self._built = True
+
+    @classmethod
+    def from_knowledge_base(cls, kb: KnowledgeBase) -> "TermIndex":
+        """The index compiled into ``kb``, used in place from the mapping"""
+        params = kb.table("term_index")
+        index = cls((), max_distance=int(params.get("max_distance")), prefix_length=int(params.get("prefix_length")))
+        index.terms = _MappedTerms(kb.array("term_text", "u1"), kb.array("term_bounds", "<u8"))
+        index.abbreviations = kb.tables.get("abbreviations", {})
+        index._top = _MappedCompletions(kb.table("term_prefixes"))
+        index._hashes = kb.array("term_deletes", "<u4")
+        index._ids = kb.array("term_delete_ids", "<i4")
+        index._sources = None
+        index._built = True
+        return index
+
+    def export(self) -> Dict[str, Iterator[Tuple[str, str]]]:
+        """String tables for the compiled knowledge base; see ``export_arrays``"""
+        self.build()
+        return {
+            "term_index": iter([("max_distance", str(self.max_distance)), ("prefix_length", str(self.prefix_length))]),
+            "term_prefixes": ((prefix, "\n".join(top)) for prefix, top in self._top.items())
+        }
+
+    def export_arrays(self) -> Dict[str, bytes]:
+        """The sorted terms and the deletion index as raw arrays"""
+        self.build()
+        encoded = [term.encode() for term in self.terms]
+        bounds = np.zeros(len(encoded) + 1, dtype="<u8")
+        np.cumsum([len(term) for term in encoded], out=bounds[1:])
+        return {
+            "term_text": b"".join(encoded),
+            "term_bounds": bounds.tobytes(),
+            "term_deletes": self._hashes.astype("<u4").tobytes(),
+            "term_delete_ids": self._ids.astype("<i4").tobytes()
+        }
+
+    def _build(self, terms: Iterable[str], abbreviations: Optional[Mapping[str, str]]):
+        self.terms = sorted(set(terms))
+        self.abbreviations = dict(abbreviations.items()) if abbreviations else {}
+
+        self._top: Dict[str, List[str]] = {}
+        self._precompute(0, len(self.terms), 0)
+
+        counts = np.zeros(len(self.terms), dtype=np.int64)
+
+        def variants():
+            for term_id, term in enumerate(self.terms):
+                deletes = self._deletes(term)
+                counts[term_id] = len(deletes)
+                yield from map(_variant_key, deletes)
+
+        hashes = np.fromiter(variants(), dtype=np.uint32)
+        order = np.argsort(hashes)
+        self._hashes = hashes[order]
+        self._ids = np.repeat(np.arange(len(self.terms), dtype=np.int32), counts)[order]
+
+    @staticmethod
+    def _rank(term: str):
+        # Shorter, more general terms complete first
+        return (len(term), term)
+
+    def _precompute(self, lo: int, hi: int, depth: int):
+        i = lo
+        while i < hi:
+            if len(self.terms[i]) <= depth:
+                i += 1
+                continue
+            prefix = self.terms[i][:depth + 1]
+            j = bisect_right(self.terms, prefix + "\uffff", i, hi)
+            if j - i > HEAVY_PREFIX:
+                self._top[prefix] = heapq.nsmallest(MAX_COMPLETIONS, self.terms[i:j], key=self._rank)
+                self._precompute(i, j, depth + 1)
+            i = j
+
+    def _deletes(self, word: str, distance: Optional[int] = None) -> Set[str]:
+        variants = {word[:self.prefix_length]}
+        frontier = variants
+        for _ in range(self.max_distance if distance is None else distance):
+            frontier = {v[:k] + v[k + 1:] for v in frontier for k in range(len(v))}
+            variants |= frontier
+        return variants
+
+    def __contains__(self, term: str) -> bool:
+        self.build()
+        i = bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def __len__(self) -> int:
+        self.build()
+        return len(self.terms)
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        """Terms starting with prefix, shortest first"""
+        if not prefix:
+            return []
+        self.build()
+        top = self._top.get(prefix)
+        if top is not None and limit <= MAX_COMPLETIONS:
+            return top[:limit]
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_right(self.terms, prefix + "\uffff", lo)
+        return heapq.nsmallest(limit, self.terms[lo:hi], key=self._rank)
+
+    def fuzzy(self, query: str, max_distance: Optional[int] = None, limit: int = 10) -> List[TermMatch]:
+        """Terms within max_distance edits of query, closest first"""
+        self.build()
+        limit_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        keys = np.array([_variant_key(variant) for variant in self._deletes(query, limit_distance)], dtype=np.uint32)
+        lo = np.searchsorted(self._hashes, keys, side="left")
+        hi = np.searchsorted(self._hashes, keys, side="right")
+        candidates = np.unique(np.concatenate([self._ids[a:b] for a, b in zip(lo, hi)] or [self._ids[:0]]))
+
+        matches = []
+        for term_id in candidates:
+            term = self.terms[term_id]
+            if contrasting(query, term):
+                continue
+            distance = edit_distance(query, term, limit_distance)
+            if distance <= limit_distance:
+                matches.append(TermMatch(term, "fuzzy", distance))
+        matches.sort(key=lambda m: (m.distance, len(m.term), m.term))
+        return matches[:limit]
+
+    @staticmethod
+    def typo_allowance(query: str) -> int:
+        # Short words tolerate fewer typos, or abbreviations and short
+        # prefixes would match large parts of the vocabulary
+        if len(query) <= 2:
+            return 0
+        return 1 if len(query) <= 5 else 2
+
+    def resolve(self, query: str) -> Optional[str]:
+        """Best single term for a query: exact, then abbreviation, then a typo
+
+        A typo resolves only to a term within RESOLVE_MAX_DISTANCE edits
+        that no other term is as close to; anything else is left unresolved
+        rather than guessed.
+        """
+        if query in self:
+            return query
+        expanded = self.abbreviations.get(query)
+        if expanded is not None:
+            return expanded
+        allowance = min(self.typo_allowance(query), RESOLVE_MAX_DISTANCE)
+        matches = self.fuzzy(query, max_distance=allowance, limit=2)
+        if len(matches) == 1 or (len(matches) == 2 and matches[0].distance < matches[1].distance):
+            return matches[0].term
+        return None
+
+    def suggest(self, query: str, limit: int = 10) -> List[TermMatch]:
+        """Ranked candidates: exact and abbreviation hits, completions, then typo matches"""
+        self.build()
+        ranked: Dict[str, TermMatch] = {}
+
+        def add(match: TermMatch):
+            if match.term not in ranked and len(ranked) < limit:
+                ranked[match.term] = match
+
+        if query in self:
+            add(TermMatch(query, "exact", 0))
+        expanded = self.abbreviations.get(query)
+        if expanded is not None:
+            add(TermMatch(expanded, "abbreviation", 0))
+        for term in self.complete(query, limit):
+            add(TermMatch(term, "prefix", 0))
+        allowance = self.typo_allowance(query)
+        if len(ranked) < limit and allowance:
+            for match in self.fuzzy(query, max_distance=allowance, limit=limit):
+                add(match)
+        return list(ranked.values())
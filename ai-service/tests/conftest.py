@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# State directories of the app under test, set before main is imported
+STATE = tempfile.mkdtemp(prefix="medvision-tests-")
+for name in ("JOBS_DIR", "LAB_HISTORY_DIR", "INGEST_DIR", "OCR_CACHE_DIR"):
+    os.environ[name] = os.path.join(STATE, name.lower())
+os.environ["LOG_MODE"] = "off"
+os.environ["JOB_POLL_INTERVAL"] = "0.05"
+for name in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "KNOWLEDGE_BASE_PATH", "METRICS_DIR", "REPORT_CACHE_PATH"):
+    os.environ.pop(name, None)
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import main
+    return main
+
+
+@pytest.fixture
+def client(app_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_module.app) as client:
+        yield client
+
+
+@pytest.fixture
+def text_reports(app_module, monkeypatch):
+    """Analyze uploads as plain text, without OCR"""
+    from services.report_analyzer import ReportAnalyzer
+
+    async def analyze(source, report_type, digest=None, demographics=None):
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        text = source.decode()
+        return app_module.report_analyzer._build_analysis(ReportAnalyzer.extract_values(text, demographics), text)
+
+    monkeypatch.setattr(app_module.report_analyzer, "analyze", analyze)
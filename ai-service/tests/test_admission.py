@@ -0,0 +1,265 @@
+import asyncio
+
+import httpx
+
+from services.admission import AdmissionMiddleware, GradientLimit, RouteClass, _Lane
+
+
+class GatedApp:
+    """Reads the whole body, records it, then waits for the gate to open"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.seen = []
+
+    async def __call__(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        self.seen.append(body.decode())
+        await self.gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+
+
+def serve(route_class: RouteClass, body):
+    """Run ``body(client, app, lane)`` against a gated app behind admission control"""
+
+    async def main():
+        app = GatedApp()
+        middleware = AdmissionMiddleware(
+            app, [route_class], exempt=["/health"], is_urgent=lambda text: "chest pain" in text
+        )
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await body(client, app, middleware.lanes[0])
+    return asyncio.run(main())
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_full_queue_is_shed_and_the_rest_served_in_order():
+    async def body(client, app, lane):
+        requests = []
+        for i in range(4):
+            requests.append(asyncio.create_task(client.post("/work", content=f"r{i}")))
+            await settle()
+        assert lane.in_flight == 1 and len(lane.waiting) == 2
+        rejected = await requests[3]
+        app.gate.set()
+        return rejected, await asyncio.gather(*requests[:3]), app.seen
+
+    rejected, served, seen = serve(RouteClass("work", max_limit=1, initial_limit=1, max_queue=2), body)
+    assert rejected.status_code == 429
+    assert int(rejected.headers["retry-after"]) >= 1
+    assert [r.status_code for r in served] == [200, 200, 200]
+    # The shed request never reached the app
+    assert seen == ["r0", "r1", "r2"]
+
+
+def test_waiting_past_max_wait_is_shed():
+    async def body(client, app, lane):
+        first = asyncio.create_task(client.post("/work", content="r0"))
+        await settle()
+        late = await client.post("/work", content="r1")
+        assert not lane.waiting
+        app.gate.set()
+        await first
+        return late, app.seen
+
+    late, seen = serve(RouteClass("work", max_limit=1, initial_limit=1, max_wait=0.05), body)
+    assert late.status_code == 503 and "retry-after" in late.headers
+    assert seen == ["r0"]
+
+
+def test_emergencies_use_headroom_beyond_the_limit():
+    async def body(client, app, lane):
+        first = asyncio.create_task(client.post("/work", content="cough"))
+        await settle()
+        queued = asyncio.create_task(client.post("/work", content="sneezing"))
+        urgent = asyncio.create_task(client.post("/work", content="crushing chest pain"))
+        await settle()
+        # Admitted past the limit while the earlier request still waits
+        assert app.seen == ["cough", "crushing chest pain"]
+        assert len(lane.waiting) == 1
+        app.gate.set()
+        responses = await asyncio.gather(first, queued, urgent)
+        return [r.text for r in responses]
+
+    texts = serve(RouteClass("work", max_limit=1, initial_limit=1, triage=True, urgent_headroom=4), body)
+    # The peeked body is replayed to the app in full
+    assert texts == ["cough", "sneezing", "crushing chest pain"]
+
+
+def test_emergencies_jump_the_queue_without_headroom():
+    async def body(client, app, lane):
+        first = asyncio.create_task(client.post("/work", content="cough"))
+        await settle()
+        queued = asyncio.create_task(client.post("/work", content="sneezing"))
+        await settle()
+        urgent = asyncio.create_task(client.post("/work", content="chest pain since noon"))
+        await settle()
+        assert len(lane.urgent) == 1 and len(lane.waiting) == 1
+        app.gate.set()
+        await asyncio.gather(first, queued, urgent)
+        return app.seen
+
+    seen = serve(RouteClass("work", max_limit=1, initial_limit=1, triage=True, urgent_headroom=0), body)
+    assert seen == ["cough", "chest pain since noon", "sneezing"]
+
+
+def test_exempt_and_unclassified_paths_bypass_admission():
+    async def body(client, app, lane):
+        app.gate.set()
+        lane.in_flight = lane.limit.value  # as if full
+        health = await client.get("/health")
+        other = await client.post("/other", content="r0")
+        return health, other, lane.in_flight
+
+    # A class with routes takes no other requests; none is the default
+    route_class = RouteClass("work", routes=["POST /work"], max_limit=1, initial_limit=1, max_wait=0.05)
+    health, other, in_flight = serve(route_class, body)
+    assert health.status_code == 200 and other.status_code == 200
+    assert in_flight == 1
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        lane = _Lane(RouteClass("work", max_limit=1, initial_limit=1))
+        await lane.acquire(False)
+        waiter = asyncio.create_task(lane.acquire(False))
+        await settle()
+        assert len(lane.waiting) == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert not lane.waiting
+        lane.release()
+        return lane.in_flight
+
+    assert asyncio.run(main()) == 0
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def main():
+        lane = _Lane(RouteClass("work", max_limit=1, initial_limit=1))
+        await lane.acquire(False)
+        waiter = asyncio.create_task(lane.acquire(False))
+        await settle()
+        # Admitted and cancelled before it got to run
+        lane.release()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return lane.in_flight
+
+    assert asyncio.run(main()) == 0
+
+
+def test_gradient_limit_shrinks_with_latency_and_grows_only_in_use():
+    limit = GradientLimit(initial=20, minimum=2, maximum=40)
+    for _ in range(20):
+        limit.update(0.1, in_flight=20)
+    grown = limit.value
+    assert 20 < grown <= 40
+
+    for _ in range(20):
+        limit.update(0.1, in_flight=1)
+    assert limit.value == grown
+
+    # One slow sample moves the limit only a little
+    limit.update(2.0, in_flight=grown)
+    assert limit.value >= 0.9 * grown
+    for _ in range(50):
+        limit.update(2.0, in_flight=grown)
+    # Settles where halving is balanced by the square-root headroom
+    assert limit.minimum <= limit.value <= 5
+
+
+def call(middleware, body: bytes, headers=None):
+    """One raw ASGI request; returns the response status and how often the body was read"""
+    reads = []
+    sent = []
+
+    async def receive():
+        reads.append(1)
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    if headers is None:
+        headers = [(b"content-length", str(len(body)).encode())]
+    scope = {"type": "http", "method": "POST", "path": "/work", "headers": headers}
+    return asyncio.create_task(middleware(scope, receive, send)), sent, reads
+
+
+def status(sent) -> int:
+    return next(m["status"] for m in sent if m["type"] == "http.response.start")
+
+
+def test_malformed_content_length_is_a_bad_request():
+    async def main():
+        app = GatedApp()
+        app.gate.set()
+        middleware = AdmissionMiddleware(
+            app, [RouteClass("work", triage=True)], is_urgent=lambda text: "chest pain" in text
+        )
+        results = []
+        for value in (b"abc", b"-5"):
+            task, sent, reads = call(middleware, b"cough", [(b"content-length", value)])
+            await task
+            results.append((status(sent), reads, middleware.lanes[0].in_flight))
+        return results
+
+    assert asyncio.run(main()) == [(400, [], 0), (400, [], 0)]
+
+
+def test_bodies_are_not_read_once_every_queue_is_full():
+    async def main():
+        app = GatedApp()
+        route_class = RouteClass("work", max_limit=1, initial_limit=1, max_queue=1, triage=True, urgent_headroom=0)
+        middleware = AdmissionMiddleware(app, [route_class], is_urgent=lambda text: "chest pain" in text)
+        lane = middleware.lanes[0]
+        running = [call(middleware, b"cough")[0]]
+        await settle()
+        running.append(call(middleware, b"sneezing")[0])
+        await settle()
+        # The normal queue is full: an emergency still gets a place
+        running.append(call(middleware, b"chest pain")[0])
+        await settle()
+        assert len(lane.waiting) == 1 and len(lane.urgent) == 1
+
+        # Both queues full: turned away without reading the body
+        task, sent, reads = call(middleware, b"chest pain again")
+        await task
+        shed = (status(sent), reads)
+        app.gate.set()
+        await asyncio.gather(*running)
+        return shed, app.seen
+
+    shed, seen = asyncio.run(main())
+    assert shed == (429, [])
+    assert seen == ["cough", "chest pain", "sneezing"]
+
+
+def test_non_urgent_request_is_shed_when_the_normal_queue_is_full():
+    async def main():
+        app = GatedApp()
+        route_class = RouteClass("work", max_limit=1, initial_limit=1, max_queue=1, triage=True)
+        middleware = AdmissionMiddleware(app, [route_class], is_urgent=lambda text: "chest pain" in text)
+        running = [call(middleware, b"cough")[0]]
+        await settle()
+        running.append(call(middleware, b"sneezing")[0])
+        await settle()
+        task, sent, reads = call(middleware, b"itchy eyes")
+        await task
+        app.gate.set()
+        await asyncio.gather(*running)
+        return status(sent), middleware.lanes[0].classifying
+
+    assert asyncio.run(main()) == (429, 0)
@@ -0,0 +1,38 @@
+import asyncio
+
+import httpx
+
+from benchmarks.bench_endpoints import SCENARIOS, compare, run_scenario
+
+BASELINE = {"throughput_rps": 100.0, "p95_ms": 10.0, "p99_ms": 20.0, "errors": 0, "rss_mb": 100.0}
+
+
+def result(**changes):
+    return {**BASELINE, **changes}
+
+
+def test_compare_flags_only_changes_beyond_the_tolerance():
+    results = {
+        "steady": result(throughput_rps=95.0, p95_ms=11.0),
+        "slower": result(throughput_rps=80.0),
+        "tail": result(p99_ms=25.0),
+        "errors": result(errors=1),
+        "new": result(),
+    }
+    baseline = {name: BASELINE for name in ("steady", "slower", "tail", "errors")}
+    assert compare(results, baseline, tolerance=0.15) == ["slower", "tail", "errors"]
+
+
+def test_scenarios_without_ocr_succeed_in_process(app_module):
+    names = [name for name in SCENARIOS if not name.startswith("analyze_report")]
+
+    async def main():
+        app = app_module.app
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                return {name: await run_scenario(client, SCENARIOS[name], 6, 3) for name in names}
+
+    for name, outcome in asyncio.run(main()).items():
+        assert outcome["errors"] == 0, (name, outcome["statuses"])
+        assert outcome["requests"] == 6 and outcome["p50_ms"] <= outcome["p99_ms"]
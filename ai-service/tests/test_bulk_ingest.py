@@ -0,0 +1,206 @@
+import os
+import zipfile
+
+import numpy as np
+import pytest
+
+from services import bulk_ingest
+from services.bulk_ingest import ReportResult, ShardWriter, TESTS, load
+
+
+def hemoglobin(value):
+    return (TESTS.index("hemoglobin"), value, 0, 0)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    source = tmp_path / "reports"
+    source.mkdir()
+    for name in ("a.png", "b.png", "c.png"):
+        (source / name).write_bytes(name.encode())
+    return str(source)
+
+
+def fake_pool(outcomes, attempts):
+    """Stands in for run_pool: per-report results in order, no processes"""
+    def run_pool(items, workers):
+        for item in items:
+            attempts.append(item.name)
+            outcome = outcomes[item.name]
+            if isinstance(outcome, Exception):
+                yield ReportResult(item.name, digest="0" * 64, error=str(outcome))
+            else:
+                yield ReportResult(item.name, digest="0" * 64, values=[hemoglobin(outcome)])
+    return run_pool
+
+
+def test_failed_reports_are_retried_on_resume(archive, tmp_path, monkeypatch):
+    output = str(tmp_path / "run")
+    attempts = []
+
+    monkeypatch.setattr(bulk_ingest, "run_pool", fake_pool(
+        {"a.png": 13.0, "b.png": OSError("tesseract not found"), "c.png": 14.0}, attempts
+    ))
+    first = bulk_ingest.ingest(archive, output, workers=1, shard_size=2)
+    assert first["failed"] == 1
+
+    monkeypatch.setattr(bulk_ingest, "run_pool", fake_pool({"b.png": 15.0}, attempts))
+    second = bulk_ingest.ingest(archive, output, workers=1, shard_size=2)
+    assert second["resumed"] == 2 and second["reports"] == 1 and second["failed"] == 0
+    assert attempts == ["a.png", "b.png", "c.png", "b.png"]
+
+    merged = load(second["output"])
+    # One entry per report: the retry replaced the failure
+    assert sorted(merged["report_name"].tolist()) == ["a.png", "b.png", "c.png"]
+    assert merged["report_error"].tolist() == ["", "", ""]
+    values = dict(zip(merged["report_name"][merged["report"]].tolist(), merged["value"].tolist()))
+    assert values == {"a.png": 13.0, "b.png": 15.0, "c.png": 14.0}
+
+
+def test_checkpoint_survives_orphan_shards(tmp_path):
+    output = str(tmp_path / "run")
+    writer = ShardWriter(output, shard_size=10)
+    writer.add(ReportResult("a.png", values=[hemoglobin(13.0)]))
+    writer.flush()
+    # A shard written by a crashed run but never checkpointed
+    open(os.path.join(output, "part-00001.npz"), "wb").close()
+
+    resumed = ShardWriter(output, shard_size=10)
+    assert resumed.done == {"a.png"}
+    assert not os.path.exists(os.path.join(output, "part-00001.npz"))
+
+
+def test_merge_of_an_empty_run(tmp_path):
+    output = str(tmp_path / "run")
+    ShardWriter(output, shard_size=10)
+    merged = load(bulk_ingest.merge(output))
+    assert len(merged["report"]) == 0 and merged["report"].dtype == np.int32
+
+
+class Crash(Exception):
+    pass
+
+
+def crashing_pool(outcomes, attempts, after):
+    """Like fake_pool, but the process dies once ``after`` reports are done"""
+    run_pool = fake_pool(outcomes, attempts)
+
+    def crashing(items, workers):
+        for count, result in enumerate(run_pool(items, workers)):
+            if count == after:
+                raise Crash()
+            yield result
+    return crashing
+
+
+def test_interrupted_run_resumes_from_its_last_shard(tmp_path, monkeypatch):
+    source = tmp_path / "reports"
+    source.mkdir()
+    names = [f"{i:02d}.png" for i in range(7)]
+    for name in names:
+        (source / name).write_bytes(name.encode())
+    outcomes = {name: 10.0 + i for i, name in enumerate(names)}
+    output = str(tmp_path / "run")
+    attempts = []
+
+    monkeypatch.setattr(bulk_ingest, "run_pool", crashing_pool(outcomes, attempts, after=5))
+    with pytest.raises(Crash):
+        bulk_ingest.ingest(str(source), output, workers=1, shard_size=2)
+    # Two full shards reached the checkpoint; the fifth report was only buffered
+    assert ShardWriter(output, shard_size=2).done == set(names[:4])
+
+    monkeypatch.setattr(bulk_ingest, "run_pool", fake_pool(outcomes, attempts))
+    stats = bulk_ingest.ingest(str(source), output, workers=1, shard_size=2)
+    assert stats["resumed"] == 4 and stats["reports"] == 3
+    assert attempts[6:] == names[4:]
+
+    merged = load(stats["output"])
+    assert merged["report_name"].tolist() == names
+    values = dict(zip(merged["report_name"][merged["report"]].tolist(), merged["value"].tolist()))
+    assert values == outcomes
+
+
+def test_partial_checkpoint_line_is_dropped(tmp_path):
+    output = str(tmp_path / "run")
+    writer = ShardWriter(output, shard_size=1)
+    writer.add(ReportResult("a.png", values=[hemoglobin(13.0)]))
+    writer.add(ReportResult("b.png", values=[hemoglobin(14.0)]))
+    checkpoint = os.path.join(output, bulk_ingest.CHECKPOINT)
+    with open(checkpoint) as f:
+        lines = f.readlines()
+    # The crash cut the second line short; its shard is an orphan
+    with open(checkpoint, "w") as f:
+        f.write(lines[0] + lines[1][:10])
+
+    resumed = ShardWriter(output, shard_size=1)
+    assert resumed.done == {"a.png"} and resumed.shards == ["part-00000.npz"]
+    resumed.add(ReportResult("b.png", values=[hemoglobin(15.0)]))
+    merged = load(bulk_ingest.merge(output))
+    assert merged["report_name"].tolist() == ["a.png", "b.png"]
+    assert merged["value"].tolist() == [13.0, 15.0]
+
+
+def test_merge_keeps_rows_with_their_reports(tmp_path):
+    output = str(tmp_path / "run")
+    wbc = TESTS.index("wbc")
+    writer = ShardWriter(output, shard_size=2)
+    writer.add(ReportResult("a.png", values=[hemoglobin(13.0), (wbc, 7.0, 0, 0)]))
+    writer.add(ReportResult("b.png", error="OSError: unreadable"))
+    writer.add(ReportResult("c.png", values=[(wbc, 9.0, 0, 0)]))
+    writer.flush()
+
+    merged = load(bulk_ingest.merge(output))
+    assert merged["report_name"].tolist() == ["a.png", "b.png", "c.png"]
+    assert merged["report_error"].tolist() == ["", "OSError: unreadable", ""]
+    rows = [
+        (merged["report_name"][r], merged["tests"][t], v)
+        for r, t, v in zip(merged["report"], merged["test"], merged["value"])
+    ]
+    assert rows == [("a.png", "hemoglobin", 13.0), ("a.png", "wbc", 7.0), ("c.png", "wbc", 9.0)]
+
+
+def test_archives_list_reports_in_a_stable_order(tmp_path):
+    source = tmp_path / "reports"
+    (source / "b").mkdir(parents=True)
+    for name in ("b/2.pdf", "b/1.JPG", "a.png", "notes.txt"):
+        (source / name).write_bytes(b"x")
+    assert [item.name for item in bulk_ingest.iter_archive(str(source))] == ["a.png", "b/1.JPG", "b/2.pdf"]
+
+    path = tmp_path / "reports.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        for name in ("z.png", "dir/", "a.pdf", "readme.md"):
+            archive.writestr(name, b"" if name.endswith("/") else name.encode())
+    items = list(bulk_ingest.iter_archive(str(path)))
+    assert [item.name for item in items] == ["z.png", "a.pdf"]
+    assert bulk_ingest._read(items[1]) == b"a.pdf"
+    bulk_ingest._archives.pop(str(path)).close()
+
+
+def test_uploading_a_finished_archive_again_leaves_no_copy(client, app_module, monkeypatch, tmp_path):
+    import io
+    import time
+
+    monkeypatch.setattr(bulk_ingest, "run_pool", fake_pool({"a.png": 13.0}, []))
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        archive.writestr("a.png", f"report {tmp_path}")
+    upload = {"file": ("archive.zip", data.getvalue(), "application/zip")}
+    directory = app_module.ingest_runs.directory
+
+    run = client.post("/api/ingest", files=upload).json()
+    for _ in range(200):
+        if client.get(f"/api/ingest/{run['run_id']}").json()["status"] != "running":
+            break
+        time.sleep(0.02)
+    assert client.get(f"/api/ingest/{run['run_id']}").json()["status"] == "complete"
+    staged = os.path.join(directory, f"{run['run_id']}.zip")
+    assert not os.path.exists(staged)
+
+    again = client.post("/api/ingest", files=upload)
+    assert again.status_code == 202 and again.json()["status"] == "complete"
+    assert not os.path.exists(staged) and not os.path.exists(f"{staged}.tmp")
+
+    # A copy left behind by an older version goes once the run is seen complete
+    open(staged, "wb").close()
+    assert app_module.ingest_runs.start(run["run_id"], staged, remove_source=True)["status"] == "complete"
+    assert not os.path.exists(staged)
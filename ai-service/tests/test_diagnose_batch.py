@@ -0,0 +1,32 @@
+MESSAGES = ["I have a headache", "crushing chest pain", "fever and a cough for two days", "my back hurts"]
+
+
+def test_batch_matches_single_requests_in_order(client):
+    response = client.post("/api/diagnose/batch", json={"items": [{"message": m} for m in MESSAGES]})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [item["index"] for item in results] == list(range(len(MESSAGES)))
+    for message, item in zip(MESSAGES, results):
+        single = client.post("/api/diagnose", json={"message": message}).json()
+        assert item["error"] is None
+        assert item["result"]["diagnosis"] == single["diagnosis"]
+        assert item["result"]["recommendations"] == single["recommendations"]
+
+
+def test_failing_item_does_not_fail_the_batch(client, app_module, monkeypatch):
+    analyze = app_module.llm_service.analyze_symptoms
+
+    async def flaky(message, **kwargs):
+        if "cough" in message:
+            raise RuntimeError("provider down")
+        return await analyze(message, **kwargs)
+
+    monkeypatch.setattr(app_module.llm_service, "analyze_symptoms", flaky)
+    results = client.post("/api/diagnose/batch", json={"items": [{"message": m} for m in MESSAGES]}).json()["results"]
+    assert [item["error"] is not None for item in results] == [False, False, True, False]
+
+
+def test_empty_and_oversized_batches_are_rejected(client, app_module):
+    assert client.post("/api/diagnose/batch", json={"items": []}).status_code == 422
+    items = [{"message": "headache"}] * (app_module.BATCH_MAX_ITEMS + 1)
+    assert client.post("/api/diagnose/batch", json={"items": items}).status_code == 422
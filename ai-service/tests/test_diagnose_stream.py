@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from services.llm_service import STREAM_SEPARATOR, LLMService
+
+
+def parse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_sends_severity_tokens_then_result(client):
+    response = client.post("/api/diagnose/stream", json={"message": "I have a headache and mild fever"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+    names = [name for name, _ in events]
+    assert names[0] == "severity" and names[-1] == "result"
+    assert "token" in names
+    assert "diagnosis" in events[-1][1]
+
+
+def test_emergency_skips_the_llm(client):
+    events = parse_events(client.post("/api/diagnose/stream", json={"message": "crushing chest pain"}).text)
+    assert [name for name, _ in events] == ["severity", "result"]
+    assert events[0][1]["is_emergency"] is True
+
+
+class ChunkedProviders:
+    """Replies in fixed chunks that split the separator across two of them"""
+    available = True
+
+    def __init__(self, reply: str, size: int):
+        self.chunks = [reply[i:i + size] for i in range(0, len(reply), size)]
+
+    async def stream(self, prompt):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def test_separator_split_across_chunks_never_leaks_into_tokens():
+    structured = {"conditions": ["Migraine"], "recommendations": ["Rest"], "confidence": 0.7}
+    reply = f"Sounds like a migraine.\n{STREAM_SEPARATOR}\n{json.dumps(structured)}"
+    for size in (1, 3, 7, 25):
+        service = LLMService()
+        service.caches = {}
+        service.providers = ChunkedProviders(reply, size)
+
+        async def collect():
+            return [event async for event in service.stream_symptoms("throbbing head")]
+
+        events = asyncio.run(collect())
+        text = "".join(event["token"] for event in events if "token" in event)
+        assert text.strip() == "Sounds like a migraine."
+        assert events[-1]["result"]["conditions"] == ["Migraine"]
+        assert events[-1]["result"]["message"] == "Sounds like a migraine."
@@ -0,0 +1,93 @@
+import json
+import random
+
+import pytest
+
+from services.drug_interactions import DEFAULT_TABLE, SEVERITY_ORDER, InteractionIndex, MappedInteractionIndex
+from services.knowledge_base import KnowledgeBase, write_knowledge_base
+
+
+@pytest.fixture(scope="module")
+def index():
+    return InteractionIndex.load()
+
+
+@pytest.fixture(params=["dict", "mapped"])
+def indexes(request, index, tmp_path_factory):
+    if request.param == "dict":
+        yield index
+        return
+    path = str(tmp_path_factory.mktemp("kb") / "kb.bin")
+    write_knowledge_base(path, index.export())
+    kb = KnowledgeBase(path)
+    yield MappedInteractionIndex(kb)
+    kb.close()
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Warfarin", "warfarin"),
+    ("warfarin sodium 5mg", "warfarin"),
+    ("Coumadin 5 mg tablets", "warfarin"),
+    ("losartan potassium", "losartan"),
+    ("low dose aspirin", "aspirin"),
+    ("Bayer Aspirin", "aspirin"),
+    ("potassium chloride", "potassium"),
+    ("beer", "alcohol"),
+])
+def test_resolves_names_and_qualified_names(indexes, index, name, expected):
+    drug = indexes.resolve(name)
+    assert drug is not None
+    assert (index.names[drug] if isinstance(drug, int) else drug) == expected
+
+
+@pytest.mark.parametrize("name", ["root beer", "ginger beer", "aspirin free pain relief", "vitamin d"])
+def test_words_inside_other_products_do_not_resolve(indexes, name):
+    assert indexes.resolve(name) is None
+
+
+def test_root_beer_does_not_interact_with_metformin(index):
+    report = index.check(["metformin", "root beer"])
+    assert report.interactions == []
+    assert report.unknown == ["root beer"]
+    assert index.check(["metformin", "beer"]).interactions
+
+
+def scan_rules(table, medications):
+    """Reference: expand every rule's classes and scan the list for both sides"""
+    given = set(medications)
+    found = {}
+    for rule in table["interactions"]:
+        sides = [
+            table["classes"][entry[6:]] if entry.startswith("class:") else [entry]
+            for entry in rule["medications"]
+        ]
+        for a in sides[0]:
+            for b in sides[1]:
+                if a != b and a in given and b in given:
+                    key = frozenset((a, b))
+                    rank = SEVERITY_ORDER[rule["severity"]]
+                    if key not in found or rank > found[key]:
+                        found[key] = rank
+    return found
+
+
+def test_index_matches_a_scan_of_every_rule(index):
+    with open(DEFAULT_TABLE) as f:
+        table = json.load(f)
+    rng = random.Random(0)
+    for _ in range(300):
+        medications = rng.sample(index.names, rng.randint(2, 8))
+        report = index.check(medications)
+        found = {
+            frozenset(interaction["medications"]): SEVERITY_ORDER[interaction["severity"]]
+            for interaction in report.interactions
+        }
+        assert found == scan_rules(table, medications), medications
+        severities = [SEVERITY_ORDER[i["severity"]] for i in report.interactions]
+        assert severities == sorted(severities, reverse=True)
+
+
+def test_brand_and_generic_count_once(index):
+    report = index.check(["warfarin", "Coumadin", "advil"])
+    assert len(report.interactions) == 1
+    assert set(report.interactions[0]["medications"]) == {"warfarin", "ibuprofen"}
@@ -0,0 +1,38 @@
+import random
+
+from services.keyword_matcher import KeywordMatcher
+from services.symptom_analyzer import SymptomAnalyzer
+
+WORDS = ["he", "she", "hers", "his", "head", "headache", "ache", "chest pain", "pain", "Pain", "ear", "heart"]
+
+
+def naive(keyword_sets, text):
+    """Every (set, keyword, start) by plain substring search"""
+    text = text.lower()
+    found = set()
+    for pattern_id, keywords in keyword_sets.items():
+        for keyword in keywords:
+            keyword = keyword.lower()
+            start = text.find(keyword)
+            while start != -1:
+                found.add((pattern_id, keyword, start))
+                start = text.find(keyword, start + 1)
+    return found
+
+
+def test_finds_every_occurrence_like_substring_search():
+    rng = random.Random(0)
+    keyword_sets = {"a": ["he", "she", "hers", "head"], "b": ["headache", "ache", "pain"], "c": ["chest pain", "ear"]}
+    matcher = KeywordMatcher(keyword_sets)
+    for _ in range(300):
+        text = " ".join(rng.choices(WORDS, k=rng.randint(0, 12))).replace(" ", rng.choice([" ", ""]), 3)
+        hits = matcher.find_all(text)
+        assert {(hit.pattern_id, hit.keyword, hit.start) for hit in hits} == naive(keyword_sets, text), text
+        assert [hit.end for hit in hits] == sorted(hit.end for hit in hits)
+
+
+def test_emergency_gate_matches_the_keyword_scan():
+    analyzer = SymptomAnalyzer()
+    for message in ["Crushing CHEST PAIN since noon", "I can't breathe", "mild headache", "arm weakness and face drooping", ""]:
+        expected = any(kw in message.lower() for kw in analyzer.emergency_keywords)
+        assert analyzer.is_emergency(message) is expected
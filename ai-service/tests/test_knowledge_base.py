@@ -0,0 +1,77 @@
+import random
+
+import numpy as np
+import pytest
+
+from services.drug_interactions import InteractionIndex, MappedInteractionIndex
+from services.knowledge_base import (
+    DEFAULT_INTERACTIONS, DEFAULT_TERMS, KnowledgeBase, build, load_abbreviations, load_terms, write_knowledge_base
+)
+
+
+@pytest.fixture(scope="module")
+def compiled(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("kb") / "kb.bin")
+    build(DEFAULT_TERMS, DEFAULT_INTERACTIONS, path)
+    kb = KnowledgeBase(path)
+    yield kb
+    kb.close()
+
+
+def test_tables_round_trip_the_sources(compiled):
+    terms = load_terms()
+    assert len(compiled.table("terms")) == len(terms)
+    assert dict(compiled.table("terms").items()) == terms
+    assert dict(compiled.table("abbreviations").items()) == load_abbreviations()
+    assert compiled.table("terms").get("no such term") is None
+    assert "no such term" not in compiled.table("terms")
+
+
+def test_mapped_index_answers_like_the_json_index(compiled):
+    index = InteractionIndex.load()
+    mapped = MappedInteractionIndex(compiled)
+    assert len(mapped) == len(index)
+    rng = random.Random(0)
+    aliases = list(index.aliases)
+    for _ in range(200):
+        medications = rng.sample(aliases, rng.randint(2, 6))
+        assert mapped.check(medications) == index.check(medications), medications
+
+
+def test_keys_with_colliding_slots_and_unicode(tmp_path):
+    entries = {f"key{i}": f"value {i} µg" for i in range(500)}
+    entries["naïve"] = "ü"
+    path = str(tmp_path / "kb.bin")
+    write_knowledge_base(path, {"t": entries, "empty": {}})
+    kb = KnowledgeBase(path)
+    assert dict(kb.table("t").items()) == entries
+    assert len(kb.table("empty")) == 0
+    kb.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not-a-kb.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        KnowledgeBase(str(path))
+
+
+def test_arrays_round_trip_aligned(tmp_path):
+    path = str(tmp_path / "kb.bin")
+    arrays = {"odd": b"abc", "numbers": np.arange(10, dtype="<u8").tobytes()}
+    write_knowledge_base(path, {"t": {"k": "v"}}, arrays)
+    kb = KnowledgeBase(path)
+    numbers = kb.array("numbers", "<u8")
+    assert list(numbers) == list(range(10)) and numbers.ctypes.data % 8 == 0
+    assert kb.array("odd", "u1").tobytes() == b"abc"
+    assert kb.table("t").get("k") == "v"
+    # Views still held keep the mapping alive past close()
+    kb.close()
+    assert numbers[9] == 9
+
+
+def test_long_names_are_rejected_not_truncated(tmp_path):
+    with pytest.raises(ValueError):
+        write_knowledge_base(str(tmp_path / "kb.bin"), {"x" * 33: {}})
+    with pytest.raises(ValueError):
+        write_knowledge_base(str(tmp_path / "kb.bin"), {}, {"y" * 33: b""})
@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+
+from services.lab_history import LabHistory, POINT, SECONDS_PER_DAY, trend
+
+
+def legacy_trend(times, values, low, high):
+    """Per-value loop and np.polyfit, the straightforward version of trend()"""
+    outside = []
+    for value in values:
+        outside.append(low - value if value < low else value - high if value > high else 0.0)
+    result = {
+        "points": len(values),
+        "latest": values[-1],
+        "delta": values[-1] - values[-2] if len(values) > 1 else None,
+        "out_of_range_fraction": sum(1 for d in outside if d) / len(values),
+        "slope_per_day": None,
+        "out_of_range_slope_per_day": None,
+    }
+    if max(times) - min(times) >= SECONDS_PER_DAY:
+        days = times / SECONDS_PER_DAY
+        result["slope_per_day"] = np.polyfit(days, values, 1)[0]
+        result["out_of_range_slope_per_day"] = np.polyfit(days, outside, 1)[0]
+    return result
+
+
+def test_trend_matches_the_legacy_loop():
+    for seed in range(200):
+        rng = np.random.default_rng(seed)
+        count = int(rng.integers(1, 40))
+        times = np.sort(rng.uniform(1.6e9, 1.6e9 + 400 * SECONDS_PER_DAY, count))
+        values = rng.normal(14.0, 2.0, count)
+        expected = legacy_trend(times, values, 12.0, 16.0)
+        actual = trend(times, values, 12.0, 16.0)
+        assert actual.keys() == expected.keys(), seed
+        for key, value in expected.items():
+            if value is None:
+                assert actual[key] is None, (seed, key)
+            else:
+                assert np.isclose(actual[key], value, rtol=1e-6, atol=1e-9), (seed, key, actual[key], value)
+
+
+def test_no_slope_until_the_series_spans_a_day():
+    times = np.array([0.0, 60.0, 120.0])
+    result = trend(times, np.array([10.0, 11.0, 20.0]), 12.0, 16.0)
+    assert result["slope_per_day"] is None and result["out_of_range_slope_per_day"] is None
+    assert result["delta"] == 9.0 and result["out_of_range_fraction"] == 1.0
+
+
+def test_moving_back_into_range_has_a_negative_out_of_range_slope():
+    days = np.arange(5) * SECONDS_PER_DAY
+    result = trend(days, np.array([20.0, 19.0, 18.0, 17.0, 16.0]), 12.0, 16.0)
+    assert np.isclose(result["slope_per_day"], -1.0)
+    assert np.isclose(result["out_of_range_slope_per_day"], -1.0)
+
+
+def test_a_report_is_recorded_once(tmp_path):
+    history = LabHistory(str(tmp_path))
+    assert history.record("u1", "a" * 64, {"hemoglobin": 13.0, "wbc": 7.0}, at=1.0)
+    assert not history.record("u1", "a" * 64, {"hemoglobin": 13.0, "wbc": 7.0}, at=2.0)
+    # The same report for another user is that user's first
+    assert history.record("u2", "a" * 64, {"hemoglobin": 13.0}, at=3.0)
+    assert history.record("u1", "b" * 64, {"hemoglobin": 12.0}, at=4.0)
+
+    assert history.series("u1", "hemoglobin").tolist() == [(1.0, 13.0), (4.0, 12.0)]
+    assert history.series("u1", "wbc").tolist() == [(1.0, 7.0)]
+    assert set(history.history("u2")) == {"hemoglobin"}
+    assert history.history("nobody") == {}
+
+
+def test_torn_append_is_ignored_then_cut_off(tmp_path):
+    history = LabHistory(str(tmp_path))
+    history.record("u1", "a" * 64, {"hemoglobin": 13.0}, at=1.0)
+    path = os.path.join(history._user_dir("u1"), "hemoglobin.f8")
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 5)  # a crash mid-write
+
+    assert history.series("u1", "hemoglobin").tolist() == [(1.0, 13.0)]
+    history.record("u1", "b" * 64, {"hemoglobin": 14.0}, at=2.0)
+    assert os.path.getsize(path) == 2 * POINT.itemsize
+    assert history.series("u1", "hemoglobin").tolist() == [(1.0, 13.0), (2.0, 14.0)]
+
+
+def test_trends_cover_tests_with_ranges(tmp_path):
+    history = LabHistory(str(tmp_path))
+    history.record("u1", "a" * 64, {"hemoglobin": 11.0, "mystery": 1.0}, at=0.0)
+    history.record("u1", "b" * 64, {"hemoglobin": 13.0, "mystery": 2.0}, at=2 * SECONDS_PER_DAY)
+    trends = history.trends("u1", {"hemoglobin": (12.0, 16.0)})
+    assert set(trends) == {"hemoglobin"}
+    assert trends["hemoglobin"]["points"] == 2
+    assert np.isclose(trends["hemoglobin"]["slope_per_day"], 1.0)
+    assert np.isclose(trends["hemoglobin"]["out_of_range_slope_per_day"], -0.5)
+
+
+def test_the_same_report_recorded_at_once_is_added_once(tmp_path):
+    import threading
+
+    history = LabHistory(str(tmp_path))
+    for user in range(20):
+        start = threading.Barrier(4)
+        outcomes = []
+
+        def record():
+            start.wait()
+            outcomes.append(history.record(f"u{user}", "a" * 64, {"hemoglobin": 13.0, "wbc": 7.0}, at=1.0))
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(outcomes) == [False, False, False, True], user
+        assert len(history.series(f"u{user}", "hemoglobin")) == 1, user
@@ -0,0 +1,49 @@
+import random
+import re
+
+from services.report_analyzer import LabPatternMatcher, ReportAnalyzer
+
+FRAGMENTS = [
+    "Hemoglobin: 14.2 g/dL", "HGB 9.8", "hemoglobin", "WBC: 11.5", "White Blood Cell 7",
+    "Platelets: 250,000", "platelet 180", "PLT: 90", "Fasting Glucose: 126 mg/dL", "FBG 99",
+    "Glucose: 140", "GLU: 88", "Total Cholesterol: 210", "TC 180", "LDL-C: 130", "LDL 99",
+    "HDL: 45", "HDL-C 60", "Triglycerides: 180", "TG 150", "Creatinine 1.1", "CRE: 0.9",
+    "ALT 40", "SGPT: 35", "AST: 32 U/L", "SGOT 20", "Glucose: .", "HGB: 1.2.3",
+    "patient", "collected", "reference range", "platform", "cast", "altitude 300",
+    "glu", "tc", ":", "12", "\n",
+]
+
+
+def legacy_search(text: str):
+    """The original per-pattern loop: each test's first matching pattern"""
+    found = {}
+    for test_name, config in ReportAnalyzer.LAB_PATTERNS.items():
+        for pattern in config["patterns"]:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                found[test_name] = (match.start(), match.group(1))
+                break
+    return found
+
+
+def test_matches_the_per_pattern_loop():
+    rng = random.Random(0)
+    for _ in range(500):
+        text = rng.choice([" ", "\n", "; "]).join(
+            fragment.upper() if rng.random() < 0.2 else fragment
+            for fragment in rng.choices(FRAGMENTS, k=rng.randint(1, 25))
+        )
+        found = {name: (match.start(), match.group(1)) for name, match in ReportAnalyzer.matcher.search(text).items()}
+        assert found == legacy_search(text), text
+
+
+def test_first_pattern_wins_over_an_earlier_fallback():
+    # HGB occurs first, but "hemoglobin" is the test's first pattern
+    found = ReportAnalyzer.matcher.search("HGB 9.8\nHemoglobin: 14.2")
+    assert found["hemoglobin"].group(1) == "14.2"
+
+
+def test_literal_prefix_stops_at_optional_characters():
+    assert LabPatternMatcher._literal_prefix(r"platelets?\s*([\d,]+)") == "platelet"
+    assert LabPatternMatcher._literal_prefix(r"LDL-C\s*([\d.]+)") == "ldl"
+    assert LabPatternMatcher._literal_prefix(r"\s*([\d.]+)") == ""
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from services.llm_providers import AnthropicProvider, LLMUnavailable, OpenAIProvider, ProviderPool
+
+
+def mocked(provider, handler):
+    """Point a provider's client at an in-process handler"""
+    provider.client = httpx.AsyncClient(
+        base_url=provider.base_url, headers=provider.headers(), transport=httpx.MockTransport(handler)
+    )
+    return provider
+
+
+def openai_down(request):
+    return httpx.Response(503)
+
+
+def anthropic_reply(request):
+    assert request.headers["x-api-key"] == "a-key"
+    if json.loads(request.content).get("stream"):
+        events = [
+            {"type": "message_start"},
+            {"type": "content_block_delta", "delta": {"text": "Hello "}},
+            {"type": "content_block_delta", "delta": {"text": "there"}},
+        ]
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+    return httpx.Response(200, json={"content": [{"type": "text", "text": "Hello there"}]})
+
+
+@pytest.fixture
+def pool():
+    openai = mocked(OpenAIProvider("o-key", "gpt"), openai_down)
+    anthropic = mocked(AnthropicProvider("a-key", "claude"), anthropic_reply)
+    return ProviderPool([openai, anthropic], http2=False)
+
+
+def test_complete_fails_over_and_cools_down_the_failed_provider(pool):
+    async def main():
+        assert await pool.complete("hi") == "Hello there"
+        openai, anthropic = pool.providers
+        assert openai.failures == 1 and anthropic.failures == 0
+        # The healthy provider is now tried first
+        assert await pool.complete("hi again") == "Hello there"
+        assert openai.failures == 1
+        await pool.close()
+
+    asyncio.run(main())
+
+
+def test_stream_fails_over_before_the_first_chunk(pool):
+    async def main():
+        chunks = [chunk async for chunk in pool.stream("hi")]
+        await pool.close()
+        return chunks
+
+    assert asyncio.run(main()) == ["Hello ", "there"]
+
+
+def test_no_working_provider_raises():
+    async def main():
+        pool = ProviderPool([mocked(OpenAIProvider("o-key", "gpt"), openai_down)], http2=False)
+        with pytest.raises(LLMUnavailable):
+            await pool.complete("hi")
+        with pytest.raises(LLMUnavailable):
+            await ProviderPool([], http2=False).complete("hi")
+        await pool.close()
+
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+import glob
+import json
+
+from loguru import logger
+
+from services.log_writer import AsyncJsonSink
+
+
+def write(sink: AsyncJsonSink, log):
+    handler = logger.add(sink, level="DEBUG", format="{message}", filter=sink.accept)
+    try:
+        log()
+    finally:
+        logger.remove(handler)
+        sink.close()
+
+
+def read(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class Lane:
+    def __str__(self):
+        return "small"
+
+
+def test_records_are_written_as_json_lines(tmp_path):
+    path = str(tmp_path / "service.log")
+
+    def log():
+        # Extra fields that are not JSON types are written as their str()
+        logger.info("Queued report", job_id="abc", lane=Lane())
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("Analysis failed")
+
+    write(AsyncJsonSink(path), log)
+    info, error = read(path)
+    assert info["message"] == "Queued report" and info["level"] == "INFO"
+    assert info["job_id"] == "abc" and info["lane"] == "small"
+    assert error["level"] == "ERROR" and "ZeroDivisionError" in error["exception"]
+
+
+def test_sampling_never_drops_warnings(tmp_path):
+    path = str(tmp_path / "service.log")
+
+    def log():
+        for i in range(50):
+            logger.info("routine", i=i)
+        logger.warning("important")
+
+    write(AsyncJsonSink(path, sample_rate=0.0), log)
+    assert [record["message"] for record in read(path)] == ["important"]
+
+
+def test_file_is_rotated_by_size(tmp_path):
+    path = str(tmp_path / "service.log")
+
+    def log():
+        for i in range(200):
+            logger.info("x" * 100, i=i)
+
+    write(AsyncJsonSink(path, rotation_bytes=4096), log)
+    rotated = glob.glob(f"{path}.*")
+    assert rotated
+    total = sum(len(read(p)) for p in rotated) + (len(read(path)) if glob.glob(path) else 0)
+    assert total == 200
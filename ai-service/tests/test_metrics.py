@@ -0,0 +1,78 @@
+import json
+
+from services.metrics import MetricsExporter, Registry, _snapshot
+
+
+def test_merge_skips_files_that_are_not_worker_snapshots(tmp_path):
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests")
+    requests.inc(3)
+
+    # An exited worker's snapshot: its counters still count toward the total
+    other = Registry()
+    other.counter("requests_total", "Requests").inc(2)
+    (tmp_path / "999999999.json").write_text(json.dumps(_snapshot(other.collect())))
+    (tmp_path / "notes.json").write_text("{}")
+    (tmp_path / "backup-1.json").write_text("{}")
+
+    text = MetricsExporter(registry, directory=str(tmp_path)).render()
+    assert "requests_total 5" in text
+
+
+def test_render_exposition_format():
+    registry = Registry()
+    registry.counter("jobs_total", "Jobs", ("lane",)).labels('say "hi"\n').inc(2)
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value)
+
+    lines = MetricsExporter(registry).render().splitlines()
+    assert "# TYPE jobs_total counter" in lines
+    assert 'jobs_total{lane="say \\"hi\\"\\n"} 2.0' in lines
+    assert [line for line in lines if line.startswith("latency_seconds")] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 4.25",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_gauges_of_exited_workers_are_dropped(tmp_path):
+    registry = Registry()
+    registry.gauge("queue_depth", "Depth").set(3)
+    other = Registry()
+    other.gauge("queue_depth", "Depth").set(7)
+    (tmp_path / "999999999.json").write_text(json.dumps(_snapshot(other.collect())))
+
+    text = MetricsExporter(registry, directory=str(tmp_path)).render()
+    assert 'queue_depth{worker="999999999"}' not in text
+    assert "queue_depth{worker=" in text
+
+
+def test_requests_are_labelled_by_route_template(client):
+    client.get("/api/analyze-report/no-such-job")
+    client.get("/api/analyze-report/another-job")
+    text = client.get("/metrics").text
+    assert 'route="/api/analyze-report/{job_id}",status="404"' in text
+    assert "no-such-job" not in text
+
+
+def test_scrape_reads_snapshot_files_off_the_event_loop(client, app_module, monkeypatch):
+    import asyncio
+
+    render = app_module.metrics_exporter.render
+    on_loop = []
+
+    def recording(families=None):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return render(families)
+
+    monkeypatch.setattr(app_module.metrics_exporter, "render", recording)
+    response = client.get("/metrics")
+    assert response.status_code == 200 and "http_requests_total" in response.text
+    assert on_loop == [False]
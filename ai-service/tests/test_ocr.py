@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+from services.ocr import OCRPool, OCRPoolSaturated, _text_pages, is_pdf
+
+
+def test_pool_rejects_beyond_workers_plus_queue():
+    async def main():
+        pool = OCRPool(workers=1, queue_depth=1, retry_after=7)
+        try:
+            running = [asyncio.create_task(pool.run(time.sleep, 0.3)) for _ in range(2)]
+            await asyncio.sleep(0)
+            assert pool.saturated
+            with pytest.raises(OCRPoolSaturated) as rejected:
+                await pool.run(time.sleep, 0)
+            assert rejected.value.retry_after == 7
+            # Follow-up work of an admitted report is never turned away
+            await pool.run(time.sleep, 0, admitted=True)
+            await asyncio.gather(*running)
+            assert pool.in_flight == 0 and not pool.saturated
+        finally:
+            pool.shutdown()
+
+    asyncio.run(main())
+
+
+def test_is_pdf_sniffs_paths_and_bytes(tmp_path):
+    path = tmp_path / "report"
+    path.write_bytes(b"%PDF-1.7\n...")
+    assert is_pdf(str(path))
+    assert is_pdf(b"%PDF-1.4")
+    assert not is_pdf(b"\x89PNG\r\n")
+
+
+def test_text_pages_split_on_form_feeds():
+    assert _text_pages(b"one\fTwo\f") == ["one", "Two"]
+    assert _text_pages(b"only page") == ["only page"]
+    assert _text_pages(b"one\f\f") == ["one", ""]
+
+
+def test_abandoned_jobs_count_until_they_finish():
+    async def main():
+        pool = OCRPool(workers=1, queue_depth=0)
+        try:
+            await pool.run(time.sleep, 0)  # start the worker process
+            waiting = asyncio.create_task(pool.run(time.sleep, 0.5))
+            await asyncio.sleep(0.1)
+            # The caller gives up, as _ocr_pages does on early exit, but
+            # the job keeps its worker busy
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            assert pool.in_flight == 1 and pool.saturated
+            with pytest.raises(OCRPoolSaturated):
+                await pool.run(time.sleep, 0)
+            for _ in range(100):
+                if pool.in_flight == 0:
+                    break
+                await asyncio.sleep(0.02)
+            assert pool.in_flight == 0 and not pool.saturated
+        finally:
+            pool.shutdown()
+
+    asyncio.run(main())
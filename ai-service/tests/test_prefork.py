@@ -0,0 +1,150 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A minimal app with the master's hooks; each hook leaves a file behind
+APP = textwrap.dedent('''
+    import os
+
+    STATE = os.environ["PREFORK_TEST_STATE"]
+    warmed = None
+
+
+    def warm_up():
+        global warmed
+        warmed = "built in the master"
+        open(os.path.join(STATE, f"warm-{os.getpid()}"), "w").close()
+
+
+    def init_worker():
+        open(os.path.join(STATE, f"worker-{os.getpid()}"), "w").close()
+
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = f"{os.getpid()} {warmed}".encode()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+''')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(condition, timeout: float = 20.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return
+        time.sleep(0.1)
+    raise AssertionError("condition not reached")
+
+
+def files(state, prefix: str):
+    return {int(name.split("-")[1]) for name in os.listdir(state) if name.startswith(prefix)}
+
+
+@pytest.fixture
+def master(tmp_path):
+    state = tmp_path / "state"
+    state.mkdir()
+    (tmp_path / "prefork_app.py").write_text(APP)
+    port = free_port()
+    env = {
+        **os.environ,
+        "PREFORK_TEST_STATE": str(state),
+        "PYTHONPATH": os.pathsep.join([str(tmp_path), ROOT]),
+        "METRICS_DIR": "",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "services.prefork", "--app", "prefork_app:app",
+         "--host", "127.0.0.1", "--port", str(port), "--workers", "2", "--graceful-timeout", "1"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}/"
+
+    def serving():
+        try:
+            return httpx.get(url, timeout=1.0).status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    try:
+        wait_until(lambda: len(files(state, "worker-")) == 2 and serving())
+        yield process, state, url
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def test_workers_share_the_masters_warmed_state(master):
+    process, state, url = master
+    pids = set()
+    for _ in range(20):
+        pid, warmed = httpx.get(url).text.split(" ", 1)
+        assert warmed == "built in the master"
+        pids.add(int(pid))
+    # Warmed once, in the master, and never in a worker
+    assert files(state, "warm-") == {process.pid}
+    assert pids <= files(state, "worker-") and process.pid not in pids
+
+
+def test_dead_worker_is_replaced(master):
+    process, state, url = master
+    victim = min(files(state, "worker-"))
+    os.kill(victim, signal.SIGKILL)
+    wait_until(lambda: len(files(state, "worker-")) == 3)
+    for _ in range(10):
+        assert int(httpx.get(url).text.split(" ")[0]) != victim
+
+
+def test_sighup_replaces_every_worker_and_sigterm_stops(master):
+    process, state, url = master
+    old = files(state, "worker-")
+    process.send_signal(signal.SIGHUP)
+    wait_until(lambda: len(files(state, "worker-")) == 4)
+    new = files(state, "worker-") - old
+
+    def old_gone():
+        return int(httpx.get(url).text.split(" ")[0]) in new and all(
+            not os.path.exists(f"/proc/{pid}") or open(f"/proc/{pid}/stat").read().split()[2] == "Z"
+            for pid in old
+        )
+    wait_until(old_gone)
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=15) == 0
+    for pid in new:
+        assert not os.path.exists(f"/proc/{pid}")
+
+
+def test_workers_stop_when_the_master_is_killed(master):
+    process, state, url = master
+    workers = files(state, "worker-")
+    process.kill()
+    process.wait()
+    wait_until(lambda: all(
+        not os.path.exists(f"/proc/{pid}") or open(f"/proc/{pid}/stat").read().split()[2] == "Z"
+        for pid in workers
+    ))
+
+
+def test_service_warm_up_leaves_the_app_serving(app_module, client):
+    app_module.warm_up()
+    assert client.get("/health").status_code == 200
+    response = client.post("/api/diagnose", json={"message": "I have a headache"})
+    assert response.status_code == 200
@@ -0,0 +1,142 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from services import preprocess
+from services.preprocess import PreprocessCache
+
+
+def page(seed: int) -> np.ndarray:
+    # Noise compresses poorly, so every entry has about the same size
+    return (np.random.default_rng(seed).random((64, 64)) > 0.5).astype(np.uint8) * 255
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path) if name.endswith(".png"))
+
+
+def test_put_scans_the_directory_only_past_the_limit(tmp_path, monkeypatch):
+    scans = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scans.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(preprocess.os, "scandir", counting_scandir)
+    cache = PreprocessCache(str(tmp_path), max_bytes=50_000)
+    for i in range(300):
+        cache.put(f"page:{i}", page(i))
+        assert directory_size(str(tmp_path)) <= cache.max_bytes
+
+    # One scan to learn the size, then one each time the limit is crossed;
+    # evicting to LOW_WATER leaves room for several puts in between
+    assert 1 < len(scans) < 60
+    assert cache.get("page:299") is not None
+    assert cache.get("page:0") is None
+
+
+def test_rescan_picks_up_other_processes_writes(tmp_path):
+    cache = PreprocessCache(str(tmp_path), max_bytes=10_000)
+    other = PreprocessCache(str(tmp_path), max_bytes=10_000)
+    cache.put("page:0", page(0))
+    for i in range(1, 40):
+        other.put(f"page:{i}", page(i))
+
+    cache._scanned_at = 0.0  # as if RESCAN_INTERVAL had passed
+    cache.put("page:40", page(40))
+    assert directory_size(str(tmp_path)) <= cache.max_bytes
+
+
+def text_page(scale: float = 1.0, lines: int = 30) -> np.ndarray:
+    """A white page of printed lab lines, characters about 22 * scale px tall"""
+    image = np.full((int(1400 * scale), int(1000 * scale)), 255, dtype=np.uint8)
+    for i in range(lines):
+        y = int((60 + i * 42) * scale)
+        cv2.putText(image, f"Hemoglobin {i}: 13.{i} g/dL", (int(60 * scale), y),
+                    cv2.FONT_HERSHEY_SIMPLEX, scale, 0, max(1, int(2 * scale)))
+    return image
+
+
+def test_skew_is_measured_and_corrected():
+    page = text_page()
+    layout = preprocess.analyze_layout(preprocess.rotate(page, 4.0), page.shape)
+    assert layout is not None
+    assert abs(layout.angle + 4.0) < 0.5
+
+
+def test_output_is_binary_with_text_near_the_target_height():
+    image = text_page(scale=3.0)
+    binary = preprocess.preprocess(image)
+    assert set(np.unique(binary)) <= {0, 255}
+    # Large print is scaled down, not passed to OCR at full size
+    assert binary.shape[1] < image.shape[1] / 1.5
+    layout = preprocess.analyze_layout(binary, binary.shape)
+    assert layout is not None
+    assert 0.5 * preprocess.TARGET_TEXT_HEIGHT < layout.text_height < 1.5 * preprocess.TARGET_TEXT_HEIGHT
+
+
+def test_reduced_decode_matches_full_decode():
+    image = text_page(scale=4.0)
+    ok, encoded = cv2.imencode(".png", image)
+    assert ok
+    reduced = preprocess.load_and_preprocess(encoded.tobytes())
+    full = preprocess.preprocess(image)
+    assert set(np.unique(reduced)) <= {0, 255}
+    assert abs(reduced.shape[0] - full.shape[0]) <= 0.1 * full.shape[0]
+    assert abs(reduced.shape[1] - full.shape[1]) <= 0.1 * full.shape[1]
+
+
+def test_unreadable_upload_is_rejected():
+    with pytest.raises(ValueError):
+        preprocess.load_and_preprocess(b"not an image")
+
+
+def test_cache_round_trip_and_disabled_cache(tmp_path):
+    binary = preprocess.binarize(text_page())
+    cache = PreprocessCache(str(tmp_path))
+    assert cache.get("page:1") is None
+    cache.put("page:1", binary)
+    assert np.array_equal(cache.get("page:1"), binary)
+
+    disabled = PreprocessCache("")
+    disabled.put("page:1", binary)
+    assert disabled.get("page:1") is None
+
+
+def test_cache_is_off_unless_configured(monkeypatch):
+    monkeypatch.delenv("OCR_CACHE_DIR", raising=False)
+    assert PreprocessCache().directory is None
+
+
+def test_new_cache_directory_is_private(tmp_path):
+    directory = tmp_path / "cache"
+    cache = PreprocessCache(str(directory))
+    cache.put("page:1", page(1))
+    assert cache.get("page:1") is not None
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+
+
+def test_directory_open_to_other_users_is_not_used(tmp_path):
+    directory = tmp_path / "shared"
+    directory.mkdir()
+    os.chmod(directory, 0o777)
+    # An entry planted by another user for a report they expect to be uploaded
+    cv2.imwrite(str(directory / f"page-1-v{preprocess.PREPROCESS_VERSION}.png"), page(1))
+    cache = PreprocessCache(str(directory))
+    assert cache.get("page:1") is None
+    cache.put("page:2", page(2))
+    assert cache.directory is None
+    assert len(os.listdir(directory)) == 1
+
+
+@pytest.mark.skipif(os.getuid() != 0, reason="needs root to create another user's directory")
+def test_directory_owned_by_another_user_is_not_used(tmp_path):
+    directory = tmp_path / "theirs"
+    directory.mkdir(mode=0o700)
+    os.chown(directory, 65534, 65534)
+    cache = PreprocessCache(str(directory))
+    cache.put("page:1", page(1))
+    assert cache.get("page:1") is None and cache.directory is None
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from services.reference_ranges import (
+    AGE_BANDS, SEVERITIES, SEXES, STATUSES, Demographics, ReferenceRanges, age_bands
+)
+from services.report_analyzer import ReportAnalyzer
+
+DEFAULTS = {
+    "hemoglobin": {"normal_min": 12.0, "normal_max": 17.5},
+    "wbc": {"normal_min": 4.5, "normal_max": 11.0},
+}
+
+
+def cell(ranges, test, sex, band):
+    low, high = ranges.table[ranges.codes[test], SEXES.index(sex), AGE_BANDS.index(band)].tolist()
+    return low, high
+
+
+def legacy_classify(value, low, high):
+    """Status and severity as extract_values and _severity computed them per value"""
+    status = "low" if value < low else "high" if value > high else "normal"
+    if low <= value <= high:
+        return status, "low"
+    distance = (low - value) if value < low else (value - high)
+    return status, "high" if distance > 0.5 * (high - low) else "moderate"
+
+
+def test_most_specific_row_wins():
+    ranges = ReferenceRanges(DEFAULTS, [
+        ("hemoglobin", "female", None, 12.0, 15.5),
+        ("hemoglobin", None, "child", 11.5, 15.5),
+        ("hemoglobin", "female", "adolescent", 12.0, 16.0),
+        ("hemoglobin", "pregnant", None, 11.0, 14.0),
+        ("wbc", "female", "older", 4.0, 10.0),
+    ])
+    assert cell(ranges, "hemoglobin", "female", "adult") == (12.0, 15.5)
+    assert cell(ranges, "hemoglobin", "female", "adolescent") == (12.0, 16.0)
+    # An age band match beats a sex match
+    assert cell(ranges, "hemoglobin", "female", "child") == (11.5, 15.5)
+    assert cell(ranges, "hemoglobin", "male", "child") == (11.5, 15.5)
+    assert cell(ranges, "hemoglobin", "pregnant", "adult") == (11.0, 14.0)
+    # Pregnancy falls back to female rows
+    assert cell(ranges, "hemoglobin", "pregnant", "adolescent") == (12.0, 16.0)
+    assert cell(ranges, "wbc", "pregnant", "older") == (4.0, 10.0)
+    # Everything else keeps the test's default
+    assert cell(ranges, "hemoglobin", "male", "adult") == (12.0, 17.5)
+    assert cell(ranges, "hemoglobin", "any", "older") == (12.0, 17.5)
+    assert cell(ranges, "wbc", "any", "older") == (4.5, 11.0)
+
+
+def test_published_ranges_resolve_per_patient():
+    ranges = ReportAnalyzer.ranges
+    assert ranges.ranges(Demographics("female", 40))["hemoglobin"] == (12.0, 15.5)
+    assert ranges.ranges(Demographics("male", 40))["hemoglobin"] == (13.5, 17.5)
+    assert ranges.ranges(Demographics("female", 30, pregnant=True))["hemoglobin"] == (11.0, 14.0)
+    assert ranges.ranges(Demographics("female", 30, pregnant=True))["alt"] == (7, 45)
+    assert ranges.ranges(Demographics("male", 8))["hemoglobin"] == (11.5, 15.5)
+    assert ranges.ranges(Demographics("male", 15))["hemoglobin"] == (13.0, 16.0)
+    defaults = ranges.ranges()
+    for test, config in ReportAnalyzer.LAB_PATTERNS.items():
+        assert defaults[test] == (config["normal_min"], config["normal_max"])
+
+
+@pytest.mark.parametrize("demographics,sex,band", [
+    (Demographics(), "any", "adult"),
+    (Demographics("F", 11.99), "female", "child"),
+    (Demographics(" Male ", 12), "male", "adolescent"),
+    (Demographics("female", 18), "female", "adult"),
+    (Demographics("x", 65), "any", "older"),
+    (Demographics(None, 30, pregnant=True), "pregnant", "adult"),
+    # Pregnancy is ignored for a patient recorded as male
+    (Demographics("male", 30, pregnant=True), "male", "adult"),
+])
+def test_demographics_codes(demographics, sex, band):
+    assert SEXES[demographics.sex_code] == sex
+    assert AGE_BANDS[demographics.band] == band
+    assert demographics.key == f"{sex}:{band}"
+
+
+def test_unknown_ages_count_as_adult():
+    bands = age_bands(np.array([np.nan, 0.5, 12.0, 64.9, 90.0]))
+    assert [AGE_BANDS[b] for b in bands] == ["adult", "child", "adolescent", "adult", "older"]
+
+
+def test_classify_matches_the_legacy_loop():
+    ranges = ReportAnalyzer.ranges
+    rng = np.random.default_rng(0)
+    count = 5000
+    tests = rng.integers(0, len(ranges.tests), count)
+    sexes = rng.integers(0, len(SEXES), count)
+    bands = rng.integers(0, len(AGE_BANDS), count)
+    low = ranges.table["low"][tests, sexes, bands]
+    high = ranges.table["high"][tests, sexes, bands]
+    width = high - low
+    values = rng.uniform(low - 1.5 * width - 1, high + 1.5 * width + 1)
+    # Exact bounds and the severity edges, where < and <= differ
+    values[:40] = low[:40]
+    values[40:80] = high[40:80]
+    values[80:120] = high[80:120] + 0.5 * width[80:120]
+
+    classified = ranges.classify(tests, values, sexes, bands)
+    for i, (status, severity, row_low, row_high) in enumerate(classified.tolist()):
+        expected = legacy_classify(values[i], low[i], high[i])
+        assert (STATUSES[status], SEVERITIES[severity]) == expected, (ranges.tests[tests[i]], values[i], low[i], high[i])
+        assert (row_low, row_high) == (low[i], high[i])
+
+
+def test_default_demographics_match_the_pre_demographic_output():
+    text = "Hemoglobin: 11.0\nWBC: 25\nPlatelets: 300\nGlucose: 99\nHDL: 30\nCreatinine: 1.3"
+    for item in ReportAnalyzer.extract_values(text):
+        config = ReportAnalyzer.LAB_PATTERNS[item["name"]]
+        status, severity = legacy_classify(item["value"], config["normal_min"], config["normal_max"])
+        assert (item["status"], item["severity"]) == (status, severity), item
@@ -0,0 +1,171 @@
+import pytest
+
+from services.report_analyzer import ReportAnalyzer
+
+REPORT = """
+Hemoglobin: 13.5 g/dL
+WBC: 11.2
+Platelets: 250,000
+Fasting Glucose: 130 mg/dL
+Total Cholesterol: 210
+"""
+
+
+@pytest.mark.parametrize("noise", ["Glucose: .", "HGB: 1.2.3", "Platelets: ,", "Hemoglobin: ..", "WBC: ."])
+def test_unparseable_values_are_skipped(noise):
+    values = ReportAnalyzer.extract_values(f"{noise}\nTotal Cholesterol: 210\n")
+    assert [v["name"] for v in values] == ["cholesterol_total"]
+    assert values[0]["value"] == 210
+
+
+def test_noise_alone_yields_no_values():
+    assert ReportAnalyzer.extract_values("Glucose: .\nHGB: 1.2.3\nPlatelets: ,") == []
+
+
+def test_values_and_ranges():
+    values = {v["name"]: v for v in ReportAnalyzer.extract_values(REPORT)}
+    assert values["hemoglobin"]["value"] == 13.5
+    assert values["platelets"]["value"] == 250000
+    assert values["wbc"]["status"] == "high"
+    assert values["glucose_fasting"]["status"] == "high"
+    assert values["hemoglobin"]["status"] == "normal"
+
+
+def test_displayed_values_keep_every_digit():
+    analyzer = ReportAnalyzer()
+    values = ReportAnalyzer.extract_values("Platelets: 1,234,567\nHemoglobin: 13.25\nWBC: 7.0")
+    displayed = {fv["name"]: fv for fv in analyzer._build_analysis(values, "")["flagged_values"]}
+    assert displayed["platelets"]["value"] == "1234567"
+    assert displayed["hemoglobin"]["value"] == "13.25"
+    assert displayed["wbc"]["value"] == "7"
+    assert displayed["hemoglobin"]["normal_range"] == "12-17.5"
+
+
+class PageOCR:
+    """Stands in for the OCR pool: text per 1-based page, or an error"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    async def __call__(self, func, path, page, digest=None, admitted=False):
+        self.calls.append(page)
+        text = self.pages[page]
+        if isinstance(text, Exception):
+            raise text
+        return {"text": text, "found": list(ReportAnalyzer.matcher.search(text)), "timings": {}}
+
+
+@pytest.fixture
+def scanned_pdf(monkeypatch):
+    """A three-page PDF without a text layer"""
+    async def text_layer(path):
+        return ["", "", ""]
+
+    monkeypatch.setattr("services.report_analyzer.pdf_text_layer", text_layer)
+    return b"%PDF-1.4 scanned"
+
+
+def run(coro):
+    import asyncio
+    return asyncio.run(coro)
+
+
+def test_failed_page_keeps_other_pages_values(scanned_pdf):
+    from services.ocr import OCRError, OCRPool
+
+    analyzer = ReportAnalyzer(OCRPool(workers=1))
+    analyzer._run = PageOCR({1: "Hemoglobin: 13.5", 2: OCRError("Could not render page 2"), 3: "WBC: 7.0"})
+    analysis = run(analyzer.analyze(scanned_pdf, "general"))
+    assert analysis["status"] == "partial"
+    assert analysis["failed_pages"] == [2]
+    assert {fv["name"] for fv in analysis["flagged_values"]} == {"hemoglobin", "wbc"}
+    assert "Page(s) 2 could not be read" in analysis["summary"]
+
+
+def test_all_pages_failing_still_raises(scanned_pdf):
+    from services.ocr import OCRError, OCRPool
+
+    analyzer = ReportAnalyzer(OCRPool(workers=2))
+    analyzer._run = PageOCR({page: OCRError(f"page {page}") for page in (1, 2, 3)})
+    with pytest.raises(OCRError):
+        run(analyzer.analyze(scanned_pdf, "general"))
+
+
+def test_complete_report_is_not_partial(scanned_pdf):
+    from services.ocr import OCRPool
+
+    analyzer = ReportAnalyzer(OCRPool(workers=1))
+    analyzer._run = PageOCR({1: "Hemoglobin: 13.5", 2: "", 3: "WBC: 7.0"})
+    analysis = run(analyzer.analyze(scanned_pdf, "general"))
+    assert "status" not in analysis and "failed_pages" not in analysis
+
+
+ALL_TESTS = (
+    "Hemoglobin: 13.5 WBC: 7.0 Platelets: 250 Fasting Glucose: 90 Glucose: 95 Total Cholesterol: 180 "
+    "LDL: 100 HDL: 50 Triglycerides: 120 Creatinine: 1.0 ALT: 30 AST: 25"
+)
+
+
+def text_layer(monkeypatch, pages):
+    async def read(path):
+        return pages
+
+    monkeypatch.setattr("services.report_analyzer.pdf_text_layer", read)
+
+
+def test_text_layer_pages_are_not_ocrd(monkeypatch):
+    from services.ocr import OCRPool
+
+    text_layer(monkeypatch, ["Hemoglobin: 13.5 g/dL on the first page of the report", "", "Patient notes only, nothing measured here"])
+    analyzer = ReportAnalyzer(OCRPool(workers=1))
+    analyzer._run = PageOCR({2: "WBC: 12.0"})
+    analysis = run(analyzer.analyze(b"%PDF-1.4 mixed", "general"))
+    assert analyzer._run.calls == [2]
+    assert set(analysis["values"]) == {"hemoglobin", "wbc"}
+
+
+def test_no_more_pages_are_ocrd_once_every_test_is_found(scanned_pdf):
+    from services.ocr import OCRPool
+
+    analyzer = ReportAnalyzer(OCRPool(workers=1))
+    analyzer._run = PageOCR({1: ALL_TESTS, 2: "Hemoglobin: 9.0", 3: "WBC: 20"})
+    analysis = run(analyzer.analyze(scanned_pdf, "general"))
+    assert analyzer._run.calls == [1]
+    assert analysis["values"]["hemoglobin"] == 13.5
+
+
+def test_pages_merge_like_one_document(scanned_pdf):
+    from services.ocr import OCRPool
+
+    pages = {1: "HGB 9.8", 2: "Hemoglobin: 14.2\nGLU: 88", 3: "Glucose: 140"}
+    analyzer = ReportAnalyzer(OCRPool(workers=2))
+    analyzer._run = PageOCR(pages)
+    analysis = run(analyzer.analyze(scanned_pdf, "general"))
+    expected = ReportAnalyzer.extract_values("\f".join(pages.values()))
+    assert analysis["values"] == {v["name"]: v["value"] for v in expected}
+    # The first pattern of a test wins over an earlier page's fallback alias
+    assert analysis["values"]["hemoglobin"] == 14.2
+
+
+def test_render_and_preprocess_failures_fail_only_their_page(monkeypatch):
+    import subprocess
+
+    import numpy as np
+
+    from services import report_analyzer
+    from services.ocr import OCRError, rasterize_pdf_page
+
+    def pdftoppm_fails(*args, **kwargs):
+        raise subprocess.CalledProcessError(1, "pdftoppm", stderr=b"Syntax Error: bad page")
+
+    monkeypatch.setattr("services.ocr.subprocess.run", pdftoppm_fails)
+    with pytest.raises(OCRError, match="bad page"):
+        rasterize_pdf_page("report.pdf", 2)
+    with pytest.raises(OCRError):
+        report_analyzer._ocr_page("report.pdf", 2)
+
+    # A page that renders to an image preprocessing cannot use
+    monkeypatch.setattr(report_analyzer, "rasterize_pdf_page", lambda path, page: np.zeros((0, 0), np.uint8))
+    with pytest.raises(OCRError, match="page 3"):
+        report_analyzer._ocr_page("report.pdf", 3)
@@ -0,0 +1,71 @@
+import time
+import uuid
+
+
+def upload(text: str):
+    # A unique line keeps each test's upload out of the others' cache entries
+    return {"file": ("report.txt", f"{text}\nref {uuid.uuid4().hex}\n".encode(), "text/plain")}
+
+
+def wait_for_job(client, job_id: str, timeout: float = 10.0) -> dict:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/analyze-report/{job_id}").json()
+        if job["status"] in ("complete", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_background_job_records_history_with_demographics(client, text_reports):
+    response = client.post(
+        "/api/analyze-report",
+        params={"background": "true", "user_id": "u2", "sex": "female", "age": 40},
+        files=upload("Hemoglobin: 12.5 g/dL\nPlatelets: 1234567")
+    )
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["job_id"])
+    assert job["status"] == "complete"
+    result = job["result"]
+    hemoglobin = next(fv for fv in result["flagged_values"] if fv["name"] == "hemoglobin")
+    assert hemoglobin["normal_range"] == "12-15.5"
+    platelets = next(fv for fv in result["flagged_values"] if fv["name"] == "platelets")
+    assert platelets["value"] == "1234567"
+    assert set(result["trends"]) == {"hemoglobin", "platelets"}
+
+    history = client.get("/api/lab-history/u2")
+    assert history.status_code == 200
+    assert history.json()["tests"]["platelets"]["values"] == [1234567.0]
+
+
+def test_cached_report_records_exact_values(client, text_reports):
+    files = upload("Platelets: 7654321")
+    first = client.post("/api/analyze-report", params={"user_id": "u3"}, files=files)
+    assert first.status_code == 200
+    cached = client.post("/api/analyze-report", params={"user_id": "u4", "background": "true"}, files=files)
+    assert cached.status_code == 200
+    assert cached.json()["status"] == "complete"
+    assert cached.json()["result"]["trends"]["platelets"]["latest"] == 7654321.0
+    for user in ("u3", "u4"):
+        assert client.get(f"/api/lab-history/{user}").json()["tests"]["platelets"]["values"] == [7654321.0]
+
+
+def test_identical_uploads_are_analyzed_once(client, text_reports, app_module, monkeypatch):
+    calls = []
+    analyze = app_module.report_analyzer.analyze
+
+    async def counting(source, report_type, digest=None, demographics=None):
+        calls.append(report_type)
+        return await analyze(source, report_type, digest, demographics)
+
+    monkeypatch.setattr(app_module.report_analyzer, "analyze", counting)
+    files = upload("Hemoglobin: 11.0 g/dL")
+    first = client.post("/api/analyze-report", files=files)
+    again = client.post("/api/analyze-report", files=files)
+    assert again.content == first.content
+    assert len(calls) == 1
+
+    # Other demographics classify against other ranges: a different entry
+    other = client.post("/api/analyze-report", params={"sex": "male"}, files=files)
+    assert other.status_code == 200
+    assert len(calls) == 2
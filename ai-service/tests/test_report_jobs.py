@@ -0,0 +1,297 @@
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from services.report_jobs import valid_callback_url
+
+
+@pytest.mark.parametrize("url", [
+    "http://localhost:8000/hook",
+    "http://127.0.0.1/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.5/hook",
+    "https://172.16.3.4/hook",
+    "http://192.168.1.10/hook",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://0.0.0.0/hook",
+    "ftp://8.8.8.8/hook",
+    "http:///hook",
+    "not a url",
+])
+def test_internal_and_malformed_callbacks_are_refused(url):
+    assert not valid_callback_url(url, allowed_hosts=[])
+
+
+def test_public_address_is_accepted():
+    assert valid_callback_url("https://8.8.8.8/hook", allowed_hosts=[])
+
+
+def test_allowlist_replaces_address_checks():
+    allowed = ["hooks.example.org", "10.0.0.5"]
+    assert valid_callback_url("https://hooks.example.org/done", allowed)
+    assert valid_callback_url("http://10.0.0.5/hook", allowed)
+    assert not valid_callback_url("https://8.8.8.8/hook", allowed)
+
+
+def test_env_allowlist(monkeypatch):
+    monkeypatch.setenv("JOB_CALLBACK_HOSTS", "hooks.example.org")
+    assert valid_callback_url("https://hooks.example.org/done")
+    assert not valid_callback_url("http://169.254.169.254/")
+
+
+def test_submission_with_internal_callback_is_rejected(client):
+    response = client.post(
+        "/api/analyze-report",
+        params={"callback_url": "http://169.254.169.254/latest/meta-data/"},
+        files={"file": ("report.txt", b"Hemoglobin: 13", "text/plain")}
+    )
+    assert response.status_code == 422
+
+
+def run_queue(tmp_path, handler, body):
+    """Start a queue in tmp_path, run ``body(queue)`` against it, then close it"""
+    from services.report_jobs import JobQueue
+
+    async def main():
+        queue = JobQueue(handler, directory=str(tmp_path), workers=1)
+        await queue.start()
+        try:
+            return await body(queue)
+        finally:
+            await queue.close()
+    return asyncio.run(main())
+
+
+async def wait_finished(queue, job_id: str) -> dict:
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job["status"] in ("complete", "failed"):
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_sqlite_calls_run_off_the_event_loop(tmp_path, monkeypatch):
+    from services.report_jobs import JobQueue
+
+    threads = set()
+    query = JobQueue._query
+
+    def recording_query(self, *args):
+        threads.add(threading.get_ident())
+        return query(self, *args)
+
+    monkeypatch.setattr(JobQueue, "_query", recording_query)
+
+    async def handler(path, report_type, digest, options):
+        return json.dumps({"options": options}).encode()
+
+    async def body(queue):
+        job = await queue.submit(io.BytesIO(b"report"), 6, "blood_test", "d" * 64, options={"age": 40})
+        finished = await wait_finished(queue, job["job_id"])
+        cached = await queue.add_finished("blood_test", "e" * 64, b"{}")
+        return threading.get_ident(), finished, cached
+
+    loop_thread, finished, cached = run_queue(tmp_path, handler, body)
+    assert finished["status"] == "complete"
+    assert json.loads(finished["result"]) == {"options": {"age": 40}}
+    assert cached["status"] == "complete"
+    assert threads and loop_thread not in threads
+
+
+def test_queue_restarts_on_a_new_event_loop(tmp_path):
+    from services.report_jobs import JobQueue
+
+    async def handler(path, report_type, digest, options):
+        return b"{}"
+
+    queue = JobQueue(handler, directory=str(tmp_path), workers=1)
+
+    async def once():
+        await queue.start()
+        try:
+            job = await queue.submit(io.BytesIO(b"report"), 6, "blood_test", "d" * 64)
+            return await wait_finished(queue, job["job_id"])
+        finally:
+            await queue.close()
+
+    # Each asyncio.run is a new loop, like each app lifespan
+    for _ in range(2):
+        assert asyncio.run(once())["status"] == "complete"
+
+
+def mark_running(tmp_path, job_id: str, pid: int):
+    """Leave a job as a crashed worker process would have: running, owned by pid"""
+    db = sqlite3.connect(str(tmp_path / "queue.db"))
+    with db:
+        db.execute("UPDATE jobs SET status = 'running', pid = ?, started_at = 1 WHERE id = ?", (pid, job_id))
+    db.close()
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+def submit_only(tmp_path, handler) -> dict:
+    """Queue one job without starting any workers"""
+    from services.report_jobs import JobQueue
+
+    queue = JobQueue(handler, directory=str(tmp_path), workers=1)
+
+    async def main():
+        await asyncio.to_thread(queue._open)
+        try:
+            return await queue.submit(io.BytesIO(b"report"), 6, "blood_test", "d" * 64)
+        finally:
+            queue._db.close()
+    return asyncio.run(main())
+
+
+def test_jobs_of_a_dead_process_are_recovered(tmp_path):
+    calls = []
+
+    async def handler(path, report_type, digest, options):
+        calls.append(path)
+        return b'{"ok": true}'
+
+    # Queued without running, then handed to a process that died
+    job = submit_only(tmp_path, handler)
+    mark_running(tmp_path, job["job_id"], dead_pid())
+
+    async def body(queue):
+        return await wait_finished(queue, job["job_id"])
+
+    finished = run_queue(tmp_path, handler, body)
+    assert finished["status"] == "complete"
+    assert json.loads(finished["result"]) == {"ok": True}
+    assert len(calls) == 1
+
+
+def test_jobs_of_a_live_process_are_left_alone(tmp_path):
+    async def handler(path, report_type, digest, options):
+        return b"{}"
+
+    job = submit_only(tmp_path, handler)
+    # The parent process is alive and still owns the job
+    mark_running(tmp_path, job["job_id"], os.getppid())
+
+    async def body(queue):
+        await asyncio.sleep(0.2)
+        return await queue.get(job["job_id"])
+
+    assert run_queue(tmp_path, handler, body)["status"] == "running"
+
+
+def test_interrupted_job_is_requeued_on_shutdown_and_rerun(tmp_path):
+    started = []
+
+    async def hang(path, report_type, digest, options):
+        started.append(path)
+        await asyncio.Event().wait()
+
+    async def submit_and_wait_running(queue):
+        job = await queue.submit(io.BytesIO(b"report"), 6, "blood_test", "d" * 64)
+        for _ in range(200):
+            if started:
+                break
+            await asyncio.sleep(0.01)
+        assert (await queue.get(job["job_id"]))["status"] == "running"
+        return job
+
+    job = run_queue(tmp_path, hang, submit_and_wait_running)
+
+    async def handler(path, report_type, digest, options):
+        # The upload outlived the interrupted run
+        with open(path, "rb") as f:
+            return json.dumps({"upload": f.read().decode()}).encode()
+
+    async def body(queue):
+        return await wait_finished(queue, job["job_id"])
+
+    finished = run_queue(tmp_path, handler, body)
+    assert finished["status"] == "complete"
+    assert json.loads(finished["result"]) == {"upload": "report"}
+
+
+def test_saturated_ocr_pool_requeues_instead_of_failing(tmp_path):
+    from services.ocr import OCRPoolSaturated
+
+    calls = []
+
+    async def handler(path, report_type, digest, options):
+        calls.append(path)
+        if len(calls) == 1:
+            raise OCRPoolSaturated(retry_after=0)
+        return b"{}"
+
+    async def body(queue):
+        job = await queue.submit(io.BytesIO(b"report"), 6, "blood_test", "d" * 64)
+        return await wait_finished(queue, job["job_id"])
+
+    assert run_queue(tmp_path, handler, body)["status"] == "complete"
+    assert len(calls) == 2
+
+
+def test_handler_errors_fail_the_job_without_details(tmp_path):
+    async def handler(path, report_type, digest, options):
+        raise RuntimeError("/secret/path exploded")
+
+    async def body(queue):
+        job = await queue.submit(io.BytesIO(b"report"), 6, "blood_test", "d" * 64)
+        return await wait_finished(queue, job["job_id"])
+
+    failed = run_queue(tmp_path, handler, body)
+    assert failed["status"] == "failed"
+    assert "secret" not in failed["error"]
+
+
+async def wait_callback(queue, job_id: str) -> dict:
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job["callback_status"]:
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"job {job_id} callback was not attempted")
+
+
+@pytest.mark.parametrize("allowed,expected,posts", [
+    ("hooks.example.org", "delivered", 1),
+    ("other.example.org", "refused", 0),
+])
+def test_callback_delivery(tmp_path, monkeypatch, allowed, expected, posts):
+    import httpx
+
+    monkeypatch.setenv("JOB_CALLBACK_HOSTS", allowed)
+    received = []
+
+    def respond(request):
+        received.append(json.loads(request.content))
+        return httpx.Response(200)
+
+    async def handler(path, report_type, digest, options):
+        return b'{"values": {"hemoglobin": 13.5}}'
+
+    async def body(queue):
+        await queue._client.aclose()
+        queue._client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+        job = await queue.submit(
+            io.BytesIO(b"report"), 6, "blood_test", "d" * 64, callback_url="https://hooks.example.org/done"
+        )
+        return await wait_callback(queue, job["job_id"])
+
+    job = run_queue(tmp_path, handler, body)
+    assert job["callback_status"] == expected
+    assert len(received) == posts
+    if posts:
+        assert received[0]["status"] == "complete"
+        assert received[0]["result"] == {"values": {"hemoglobin": 13.5}}
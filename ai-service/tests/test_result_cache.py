@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+
+from services.result_cache import ResultCache
+
+
+def test_concurrent_puts_keep_disk_size_consistent(tmp_path):
+    path = str(tmp_path / "results.db")
+    cache = ResultCache(memory_bytes=4096, disk_path=path, disk_bytes=64 * 1024)
+
+    def work(worker: int):
+        for i in range(200):
+            key = f"{worker}:{i % 50}"
+            cache.put(key, bytes(100 + i % 7))
+            cache.get(key)
+            cache.get(f"{(worker + 1) % 4}:{i % 50}")
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    cache.close()
+    with sqlite3.connect(path) as db:
+        entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+    assert entries == 200
+    assert stats["disk_bytes"] == size
+    assert stats["memory_bytes"] <= 4096
+
+
+def test_disk_tier_serves_after_memory_eviction(tmp_path):
+    cache = ResultCache(memory_bytes=150, disk_path=str(tmp_path / "results.db"))
+    cache.put("a", b"a" * 100)
+    cache.put("b", b"b" * 100)
+    assert cache.get("a") == b"a" * 100
+    stats = cache.stats()
+    # "b" evicted "a"; promoting "a" back from disk evicted "b"
+    assert stats["memory_evictions"] == 2
+    assert stats["disk_hits"] == 1
+    cache.close()
+
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.result_cache.time.time", lambda: now[0])
+    cache = ResultCache(ttl=60, disk_path=str(tmp_path / "results.db"))
+    cache.put("a", b"value")
+    now[0] += 61
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["expired"] == 2  # both tiers
+    assert stats["misses"] == 1
+    assert stats["disk_bytes"] == 0
+    cache.close()
+
+
+def test_processes_sharing_the_disk_tier_share_its_limit(tmp_path):
+    path = str(tmp_path / "results.db")
+    # Two pre-fork workers on one file, each with the same limit
+    workers = [ResultCache(memory_bytes=1, disk_path=path, disk_bytes=10_000) for _ in range(2)]
+    for i in range(100):
+        workers[i % 2].put(f"report:{i}", bytes(500))
+
+    with sqlite3.connect(path) as db:
+        size = db.execute("SELECT SUM(size) FROM results").fetchone()[0]
+    assert 9_000 < size <= 10_000
+    assert [w.stats()["disk_bytes"] for w in workers] == [size, size]
+    # Least recently used first, whichever worker wrote it
+    assert workers[0].get("report:99") is not None
+    assert workers[1].get("report:0") is None
+    for worker in workers:
+        worker.close()
+
+
+def test_existing_cache_file_gets_its_size_on_open(tmp_path):
+    path = str(tmp_path / "results.db")
+    cache = ResultCache(memory_bytes=1, disk_path=path, disk_bytes=10_000)
+    cache.put("a", bytes(300))
+    cache.close()
+    with sqlite3.connect(path) as db:
+        db.execute("DROP TABLE results_size")
+
+    reopened = ResultCache(memory_bytes=1, disk_path=path, disk_bytes=10_000)
+    reopened.put("b", bytes(200))
+    assert reopened.stats()["disk_bytes"] == 500
+    reopened.close()
@@ -0,0 +1,66 @@
+import pytest
+
+from services.knowledge_base import find_terms
+from services.semantic_cache import SemanticCache, normalize
+
+CONTEXT = "patient asks what this means for them and what they should do next: "
+PAIRS = [
+    ("hypertension", "hypotension"),
+    ("hyperkalemia", "hypokalemia"),
+    ("hyperthyroidism", "hypothyroidism"),
+    ("sharp pain in the left side of the abdomen", "sharp pain in the right side of the abdomen"),
+]
+
+
+@pytest.mark.parametrize("cached, asked", PAIRS + [(b, a) for a, b in PAIRS])
+def test_near_antonyms_are_not_served(cached, asked):
+    cache = SemanticCache(capacity=8, ttl=60, threshold=0.85)
+    cache.put(cached, CONTEXT + cached, "answer about " + cached)
+
+    # Close enough for the similarity tier; only the guard tells them apart
+    score = float(cache.embed(normalize(CONTEXT + cached)) @ cache.embed(normalize(CONTEXT + asked)))
+    assert score >= 0.85
+    assert cache.get(asked, CONTEXT + asked) is None
+
+
+def test_similar_wording_is_served():
+    cache = SemanticCache(capacity=8, ttl=60, threshold=0.85)
+    cache.put("a", CONTEXT + "hypertension in the morning", "answer")
+    assert cache.get("b", CONTEXT + "hypertension in the mornings") == "answer"
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_guard_includes_named_terms():
+    terms = {"anemia", "iron deficiency anemia", "hemoglobin"}
+    cache = SemanticCache(capacity=8, ttl=60, threshold=0.5, find_terms=lambda text: find_terms(terms.__contains__, text))
+    cache.put("a", CONTEXT + "low hemoglobin and anemia", "answer")
+    assert cache.get("b", CONTEXT + "low hemoglobin and iron deficiency anemia") is None
+    assert cache.get("c", CONTEXT + "low hemoglobin and anemia!") == "answer"
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("I have a fever and a cough", "I have no fever and a cough"),
+    ("fever of 38 degrees since yesterday", "fever of 40 degrees since yesterday"),
+])
+def test_negation_and_numbers_must_match(cached, asked):
+    cache = SemanticCache(capacity=8, ttl=60, threshold=0.5)
+    cache.put(cached, cached, "answer")
+    assert cache.get(asked, asked) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticCache(capacity=2, ttl=60, threshold=0.99)
+    cache.put("a", "alpha question", "A")
+    cache.put("b", "bravo question", "B")
+    assert cache.get("a", "alpha question") == "A"
+    cache.put("c", "charlie question", "C")
+    assert cache.get("b", "bravo question") is None
+    assert cache.get("a", "alpha question") == "A"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cached_values_are_copies():
+    cache = SemanticCache(capacity=2, ttl=60)
+    cache.put("a", "alpha", {"conditions": ["x"]})
+    cache.get("a", "alpha")["conditions"].append("mutated")
+    assert cache.get("a", "alpha") == {"conditions": ["x"]}
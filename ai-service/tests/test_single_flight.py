@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+class Call:
+    """An upstream call that runs until released, counting starts and cancellations"""
+
+    def __init__(self):
+        self.started = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.started += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"result {self.started}"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flight, call = SingleFlight(), Call()
+        callers = [asyncio.create_task(flight.do("k", call)) for _ in range(5)]
+        await asyncio.sleep(0)
+        call.release.set()
+        results = await asyncio.gather(*callers)
+        return flight, call, results
+
+    flight, call, results = run(main())
+    assert call.started == 1
+    assert results == ["result 1"] * 5
+    assert flight.stats() == {"calls": 5, "coalesced": 4, "in_flight": 0}
+
+
+def test_one_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flight, call = SingleFlight(), Call()
+        first = asyncio.create_task(flight.do("k", call))
+        second = asyncio.create_task(flight.do("k", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        call.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return call, await second
+
+    call, result = run(main())
+    assert result == "result 1"
+    assert call.cancelled == 0
+
+
+def test_call_is_cancelled_when_every_caller_is():
+    async def main():
+        flight, call = SingleFlight(), Call()
+        callers = [asyncio.create_task(flight.do("k", call)) for _ in range(3)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert "k" not in flight
+
+        # A later caller starts a fresh call instead of joining the cancelled one
+        call.release.set()
+        return call, await flight.do("k", call)
+
+    call, result = run(main())
+    assert call.cancelled == 1
+    assert result == "result 2"
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    async def main():
+        flight = SingleFlight()
+        attempts = []
+
+        async def failing():
+            attempts.append(1)
+            await asyncio.sleep(0)
+            raise ValueError("upstream down")
+
+        outcomes = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+        assert len(attempts) == 1
+        with pytest.raises(ValueError):
+            await flight.do("k", failing)
+        return attempts
+
+    assert len(run(main())) == 2
@@ -0,0 +1,48 @@
+import asyncio
+import io
+import os
+
+import pytest
+from starlette.datastructures import UploadFile
+
+
+def stage(app_module, data: bytes, fail: bool = False):
+    """What staged_upload yields for data, and whether a staged path survives"""
+    async def main():
+        upload = UploadFile(io.BytesIO(data), size=len(data), filename="report.pdf")
+        async with app_module.staged_upload(upload) as source:
+            staged = source if isinstance(source, bytes) else open(source, "rb").read()
+            if fail:
+                raise RuntimeError("analysis failed")
+        return source, staged
+
+    return asyncio.run(main())
+
+
+def test_small_upload_stays_in_memory(app_module):
+    source, staged = stage(app_module, b"%PDF-1.4 small")
+    assert source == b"%PDF-1.4 small"
+
+
+def test_large_upload_is_spooled_and_removed(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "UPLOAD_MEMORY_LIMIT", 8)
+    source, staged = stage(app_module, b"%PDF-1.4 large upload")
+    assert isinstance(source, str) and source.endswith(".pdf")
+    assert staged == b"%PDF-1.4 large upload"
+    assert not os.path.exists(source)
+
+
+def test_spooled_upload_is_removed_when_analysis_fails(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "UPLOAD_MEMORY_LIMIT", 8)
+    paths = []
+    real = app_module.tempfile.NamedTemporaryFile
+
+    def recording(*args, **kwargs):
+        tmp = real(*args, **kwargs)
+        paths.append(tmp.name)
+        return tmp
+
+    monkeypatch.setattr(app_module.tempfile, "NamedTemporaryFile", recording)
+    with pytest.raises(RuntimeError):
+        stage(app_module, b"%PDF-1.4 large upload", fail=True)
+    assert paths and not os.path.exists(paths[0])
@@ -0,0 +1,67 @@
+import random
+
+from services.symptom_analyzer import SEVERITY_RANK, SymptomAnalyzer, SymptomPattern
+
+VOCABULARY = [f"sym{i}" for i in range(30)]
+
+
+def loop_score(analyzer, message):
+    """Reference: count each pattern's distinct keywords in the message, pattern by pattern"""
+    text = message.lower()
+    scored = []
+    for index, (name, pattern) in enumerate(analyzer.patterns.items()):
+        score = sum(keyword in text for keyword in dict.fromkeys(k.lower() for k in pattern.keywords))
+        if score:
+            scored.append((-score, -SEVERITY_RANK[pattern.severity], index, name, score))
+    return [(name, score) for *_, name, score in sorted(scored)]
+
+
+def random_library(rng):
+    """Patterns sharing keywords, with duplicates and mixed case"""
+    return {
+        f"p{i}": SymptomPattern(
+            keywords=[word.upper() if rng.random() < 0.2 else word for word in rng.choices(VOCABULARY, k=rng.randint(1, 6))],
+            severity=rng.choice(["low", "moderate", "high"]),
+            recommendations=[f"r{i}"],
+            conditions=[f"c{i}"]
+        )
+        for i in range(40)
+    }
+
+
+def random_message(rng, words):
+    return " ".join(rng.choices(words + ["and", "since", "yesterday"], k=rng.randint(0, 10)))
+
+
+def test_csr_scores_match_the_pattern_loop():
+    rng = random.Random(0)
+    for _ in range(20):
+        analyzer = SymptomAnalyzer(patterns=random_library(rng))
+        messages = [random_message(rng, VOCABULARY) for _ in range(25)]
+        batch = analyzer.score_batch([analyzer.matcher.find_all(m) for m in messages])
+        for message, ranked in zip(messages, batch):
+            assert ranked == loop_score(analyzer, message), message
+            assert analyzer.score(analyzer.matcher.find_all(message)) == ranked
+
+
+def test_default_library_matches_the_pattern_loop():
+    analyzer = SymptomAnalyzer()
+    keywords = [kw for pattern in analyzer.patterns.values() for kw in pattern.keywords]
+    rng = random.Random(1)
+    for _ in range(200):
+        message = random_message(rng, keywords)
+        assert analyzer.score(analyzer.matcher.find_all(message)) == loop_score(analyzer, message), message
+
+
+def test_single_match_is_what_first_match_returned():
+    analyzer = SymptomAnalyzer()
+    for name, pattern in analyzer.patterns.items():
+        for keyword in pattern.keywords:
+            message = f"I have {keyword} today"
+            if len(loop_score(analyzer, message)) != 1 or analyzer.is_emergency(message):
+                continue  # keyword shared with another pattern or the emergency gate
+            result = analyzer.analyze(message)
+            assert result["matched_symptom"] == name
+            assert result["severity"] == pattern.severity
+            assert result["conditions"] == pattern.conditions
+            assert result["recommendations"] == pattern.recommendations
@@ -0,0 +1,119 @@
+import pytest
+
+from services.knowledge_base import contrasting
+from services.term_index import TermIndex
+
+VOCABULARY = [
+    "hypertension", "hypokalemia", "hyperthyroidism", "tachycardia",
+    "hemoglobin", "hematocrit", "cholesterol", "anemia", "anaemia",
+]
+
+
+@pytest.fixture
+def index():
+    return TermIndex(VOCABULARY, {"hgb": "hemoglobin", "htn": "hypertension"})
+
+
+@pytest.mark.parametrize("query, other", [
+    ("hypotension", "hypertension"),
+    ("hyperkalemia", "hypokalemia"),
+    ("hypothyroidism", "hyperthyroidism"),
+    ("bradycardia", "tachycardia"),
+])
+def test_resolve_never_crosses_a_contrast_pair(index, query, other):
+    assert contrasting(query, other)
+    assert index.resolve(query) is None
+    assert other not in [m.term for m in index.suggest(query)]
+
+
+def test_resolve_corrects_a_single_typo(index):
+    assert index.resolve("hypertention") == "hypertension"
+    assert index.resolve("hemoglobn") == "hemoglobin"
+
+
+def test_resolve_exact_and_abbreviation(index):
+    assert index.resolve("anemia") == "anemia"
+    assert index.resolve("hgb") == "hemoglobin"
+
+
+def test_resolve_rejects_two_edits_and_ties(index):
+    assert index.resolve("hemglobn") is None
+    # one edit from both "anemia" and "anaemia"
+    assert index.resolve("anamia") is None
+
+
+def test_suggest_still_lists_two_edit_typos(index):
+    assert "hemoglobin" in [m.term for m in index.suggest("hemglobn")]
+
+
+def test_built_on_first_use():
+    walked = []
+
+    def terms():
+        walked.append(True)
+        yield from VOCABULARY
+
+    index = TermIndex(terms())
+    assert not walked
+    assert index.complete("hyp") == ["hypokalemia", "hypertension", "hyperthyroidism"]
+    assert walked == [True]
+    assert len(index) == len(VOCABULARY)
+
+
+def random_vocabulary(rng, size=3000):
+    # A small alphabet gives many near neighbours and prefixes heavier than HEAVY_PREFIX
+    return sorted({"".join(rng.choices("abcde", k=rng.randint(3, 11))) for _ in range(size)})
+
+
+def test_fuzzy_finds_what_brute_force_finds():
+    import random
+
+    from services.term_index import edit_distance
+
+    rng = random.Random(0)
+    vocabulary = random_vocabulary(rng, 1000)
+    index = TermIndex(vocabulary)
+    for _ in range(40):
+        term = rng.choice(vocabulary)
+        query = "".join(c if rng.random() > 0.15 else rng.choice("abcdef") for c in term)
+        distances = ((edit_distance(query, t, 2), len(t), t) for t in vocabulary)
+        expected = sorted(d for d in distances if d[0] <= 2)
+        found = index.fuzzy(query, limit=len(vocabulary))
+        assert [(m.distance, len(m.term), m.term) for m in found] == expected, query
+
+
+def test_complete_matches_a_prefix_scan():
+    import random
+
+    rng = random.Random(1)
+    vocabulary = random_vocabulary(rng)
+    index = TermIndex(vocabulary)
+    for prefix in ["a", "ab", "abc", "e", "dd", "ccccc", "z"]:
+        expected = sorted((t for t in vocabulary if t.startswith(prefix)), key=lambda t: (len(t), t))
+        assert index.complete(prefix, limit=10) == expected[:10]
+        assert index.complete(prefix, limit=50) == expected[:50]
+
+
+def test_compiled_index_answers_like_the_built_one(tmp_path):
+    import random
+
+    from services.knowledge_base import KnowledgeBase, write_knowledge_base
+
+    rng = random.Random(2)
+    vocabulary = random_vocabulary(rng)
+    abbreviations = {"ab": vocabulary[0]}
+    built = TermIndex(vocabulary, abbreviations)
+    path = str(tmp_path / "kb.bin")
+    write_knowledge_base(path, {"abbreviations": abbreviations, **built.export()}, built.export_arrays())
+    kb = KnowledgeBase(path)
+    mapped = TermIndex.from_knowledge_base(kb)
+
+    assert len(mapped) == len(built) and list(mapped.terms) == list(built.terms)
+    queries = ["a", "ab", "abc", "ccccc", "z", *rng.sample(vocabulary, 30)]
+    queries += ["".join(c if rng.random() > 0.2 else "e" for c in q) for q in queries]
+    for query in queries:
+        assert mapped.complete(query, limit=50) == built.complete(query, limit=50), query
+        assert mapped.fuzzy(query, limit=20) == built.fuzzy(query, limit=20), query
+        assert mapped.resolve(query) == built.resolve(query), query
+        assert mapped.suggest(query) == built.suggest(query), query
+    kb.close()